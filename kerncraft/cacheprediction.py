@@ -5,10 +5,353 @@ from __future__ import absolute_import
 from __future__ import division
 
 from itertools import chain
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from pprint import pprint
+import weakref
+import inspect
+import sys
+import os
+import hashlib
+import pickle
 
 import sympy
+import numpy
+
+from .diskcache import DiskCache
+
+
+# Number of iterations for which offsets are generated and simulated at once
+OFFSET_CHUNK_SIZE = 2**16
+
+# Number of iterations of an offset chunk copied into Python lists for the cache simulator at once,
+# which bounds the memory of the copies (pycachesim only takes iterables of Python integers)
+SIMULATION_BLOCK_SIZE = 2**10
+
+# Maximum number of cache lines of work in a benchmark window with traffic counted per array
+ARRAY_ATTRIBUTION_CACHELINES = 256
+
+# Maximum number of warm-up and benchmark window outcomes kept per kernel for reuse
+MAX_REUSABLE_RESULTS = 8
+
+# Number of cache lines of work a core simulates before the next core takes its turn
+INTERLEAVE_CACHELINES = 64
+
+# Two-sided 95% quantiles of Student's t-distribution by degrees of freedom (1.96 beyond)
+T_QUANTILES_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+    10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110,
+    18: 2.101, 19: 2.093, 20: 2.086, 21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060,
+    26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042}
+
+
+def simulate_offsets(csim, chunks, length):
+    '''
+    Simulates (loads, stores) offset chunks, as generated by Kernel.compile_global_offsets() with
+    chunk_size, in access order on the cache simulator *csim*.
+
+    *length* is the number of bytes accessed by each load and store.
+
+    Chunks are handed to the simulator in blocks of SIMULATION_BLOCK_SIZE iterations. Each block is
+    copied into plain integer lists, which loadstore() iterates over fastest, so only the copy of
+    one block exists at a time. If a kernel only loads (or only stores), each block is copied into
+    one flat list. Otherwise loads and stores alternate with every iteration and are passed as
+    rows.
+    '''
+    for loads, stores in chunks:
+        if isinstance(csim, (SetSampledCacheSimulator, PrefetchingCacheSimulator)):
+            csim.loadstore_arrays(loads, stores, length=length)
+            continue
+        for start in range(0, loads.shape[0], SIMULATION_BLOCK_SIZE):
+            block_loads = loads[start:start+SIMULATION_BLOCK_SIZE]
+            block_stores = stores[start:start+SIMULATION_BLOCK_SIZE]
+            if not block_stores.shape[1]:
+                csim.load(block_loads.ravel().tolist(), length=length)
+            elif not block_loads.shape[1]:
+                csim.store(block_stores.ravel().tolist(), length=length)
+            else:
+                csim.loadstore(zip(block_loads.tolist(), block_stores.tolist()), length=length)
+
+
+def stack_distances(lines):
+    '''
+    Returns the LRU stack distance of each access in the cache line trace *lines* (numpy array),
+    i.e., the number of distinct other lines accessed since the previous access to the same line,
+    or -1 if the line was not accessed before.
+
+    Distances are computed in a single pass over the trace, with a Fenwick tree marking the latest
+    access to every line: all marks after the previous access are distinct lines (O(n log n)).
+    '''
+    n = len(lines)
+    order = numpy.argsort(lines, kind='mergesort')
+    previous = numpy.full(n, -1, dtype='int64')
+    same = lines[order[1:]] == lines[order[:-1]]
+    previous[order[1:][same]] = order[:-1][same]
+
+    distances = [-1]*n
+    tree = [0]*(n + 1)
+    distinct = 0
+    for t, p in enumerate(previous.tolist()):
+        if p < 0:
+            distinct += 1
+        else:
+            # marks up to (and including) the previous access
+            k = p + 1
+            marked = 0
+            while k > 0:
+                marked += tree[k]
+                k &= k - 1
+            distances[t] = distinct - marked
+            k = p + 1
+            while k <= n:
+                tree[k] -= 1
+                k += k & -k
+        k = t + 1
+        while k <= n:
+            tree[k] += 1
+            k += k & -k
+    return numpy.array(distances, dtype='int64')
+
+
+class SetSampledCacheSimulator(object):
+    '''
+    Set-sampled stand-in for cachesim.CacheSimulator, as far as used by CacheSimulationPredictor.
+
+    Only cache lines with (line index % ratio) in a few offsets are simulated, each offset on its
+    own simulator (from *get_cachesim*). If ratio divides the number of sets of every cache level,
+    these lines map to sets with (set index % ratio == offset) on all levels, so each of those sets
+    sees exactly the trace it would see in a full simulation. Stats are scaled back by ratio and
+    averaged over the offsets, their spread is an estimate of the sampling error.
+    '''
+    def __init__(self, get_cachesim, ratio, groups=4):
+        groups = min(groups, ratio)
+        self.ratio = ratio
+        # spread offsets evenly, but with different residues to small powers of two, so strided
+        # accesses which favour some sets show up in the spread between offsets
+        self.offsets = [(ratio*g//groups + g) % ratio for g in range(groups)]
+        if len(set(self.offsets)) < groups:
+            self.offsets = [ratio*g//groups for g in range(groups)]
+        self.simulators = [get_cachesim() for o in self.offsets]
+        self.first_level = self.simulators[0].first_level
+        for c in self.levels(with_mem=False):
+            assert c.sets % ratio == 0, \
+                "set sampling ratio needs to divide the number of sets of all cache levels"
+        self.accesses = 0
+        self.simulated_accesses = 0
+
+    @staticmethod
+    def auto_ratio(csim, maximum=64):
+        '''Returns largest power of two (up to *maximum*) dividing the set counts of all levels.'''
+        ratio = 1
+        while ratio*2 <= maximum and all(
+                [c.sets % (ratio*2) == 0 for c in csim.levels(with_mem=False)]):
+            ratio *= 2
+        return ratio
+
+    def levels(self, with_mem=True):
+        return self.simulators[0].levels(with_mem=with_mem)
+
+    def force_write_back(self):
+        for csim in self.simulators:
+            csim.force_write_back()
+
+    def reset_stats(self):
+        for csim in self.simulators:
+            csim.reset_stats()
+
+    def loadstore_arrays(self, loads, stores, length=1):
+        '''Simulates (loads, stores) offset arrays of iterations, see simulate_offsets().'''
+        addrs = numpy.hstack((loads, stores)).ravel()
+        is_store = numpy.hstack((numpy.zeros(loads.shape, dtype=bool),
+                                 numpy.ones(stores.shape, dtype=bool))).ravel()
+        residue = (addrs >> self.first_level.cl_bits) % self.ratio
+        self.accesses += len(addrs)
+        for offset, csim in zip(self.offsets, self.simulators):
+            selected = residue == offset
+            group_addrs = addrs[selected]
+            group_is_store = is_store[selected]
+            self.simulated_accesses += len(group_addrs)
+            # hand over runs of loads and stores, in access order
+            bounds = [0] + (numpy.flatnonzero(
+                group_is_store[1:] != group_is_store[:-1]) + 1).tolist() + [len(group_addrs)]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if start == end:
+                    continue
+                if group_is_store[start]:
+                    csim.store(group_addrs[start:end].tolist(), length=length)
+                else:
+                    csim.load(group_addrs[start:end].tolist(), length=length)
+
+    def group_stats(self):
+        '''Returns scaled stats of each simulated offset, as lists of per level dictionaries.'''
+        return [[{k: v*self.ratio if k.endswith(('_count', '_byte')) else v
+                  for k, v in level_stats.items()}
+                 for level_stats in csim.stats()]
+                for csim in self.simulators]
+
+    def stats(self):
+        '''Yields scaled stats per level, averaged over all simulated offsets.'''
+        group_stats = self.group_stats()
+        for level_stats in zip(*group_stats):
+            yield {k: sum([s[k] for s in level_stats])/len(level_stats)
+                   if k.endswith(('_count', '_byte')) else v
+                   for k, v in level_stats[0].items()}
+
+
+class StreamPrefetcher(object):
+    '''
+    Hardware prefetcher of one cache level, as described by its 'prefetchers' entry in the
+    machine file, e.g. for the L2 streamer and adjacent line prefetcher of Intel processors:
+
+        prefetchers: {streams: 32, stream detection: 2, distance: 20, adjacent line: true}
+
+    Streams are tracked per page, at most *streams* pages at a time (least recently used ones are
+    replaced). Once a page saw *stream detection* cache lines advancing in the same direction, the
+    prefetcher keeps the following *distance* cache lines of that page fetched. With *adjacent
+    line*, the other cache line of the aligned pair is fetched along with every new line.
+    '''
+    def __init__(self, cacheline_size, streams=32, detection=2, distance=16, adjacent_line=False,
+                 page_size=4096):
+        self.max_streams = streams
+        self.detection = detection
+        self.distance = distance
+        self.adjacent_line = adjacent_line
+        self.lines_per_page = max(1, page_size//cacheline_size)
+        # page -> [head line, direction, advancing lines, last prefetched line]
+        self.streams = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config, cacheline_size):
+        '''Returns a prefetcher as described by a 'prefetchers' entry of the machine file.'''
+        return cls(cacheline_size,
+                   streams=config.get('streams', 32),
+                   detection=config.get('stream detection', 2),
+                   distance=config.get('distance', 16),
+                   adjacent_line=config.get('adjacent line', False),
+                   page_size=config.get('page size', 4096))
+
+    def train(self, lines):
+        '''
+        Trains the prefetcher with demand accesses to cache *lines* (in access order) and returns
+        the cache lines it prefetches in response.
+        '''
+        prefetches = []
+        streams = self.streams
+        for line in lines:
+            page = line//self.lines_per_page
+            stream = streams.pop(page, None)
+            if stream is None:
+                stream = [line, 0, 1, line]
+                if len(streams) >= self.max_streams:
+                    streams.popitem(last=False)
+            else:
+                delta = line - stream[0]
+                if stream[1] == 0 and delta:
+                    stream[1] = 1 if delta > 0 else -1
+                if delta*stream[1] <= 0:
+                    # not advancing, nothing new to prefetch
+                    streams[page] = stream
+                    continue
+                stream[0] = line
+                stream[2] += 1
+            streams[page] = stream
+
+            head, direction, count, ahead = stream
+            if direction and count >= self.detection:
+                # stay within the page
+                first_line = page*self.lines_per_page
+                target = min(max(head + direction*self.distance, first_line),
+                             first_line + self.lines_per_page - 1)
+                start = max(ahead, head) if direction > 0 else min(ahead, head)
+                if (target - start)*direction > 0:
+                    prefetches.extend(range(start + direction, target + direction, direction))
+                    stream[3] = target
+            if self.adjacent_line:
+                prefetches.append(line ^ 1)
+        return prefetches
+
+
+class PrefetchingCacheSimulator(object):
+    '''
+    Stand-in for cachesim.CacheSimulator (*csim*), as far as used by CacheSimulationPredictor,
+    which models the hardware prefetchers described in the machine file (see StreamPrefetcher).
+
+    Prefetchers are applied to the offsets before they are simulated: accesses are handed over in
+    blocks of one cache line per access, and the cache lines touched by a block train the
+    prefetchers, whose prefetches are loaded into their cache level ahead of the block.
+
+    stats() reports prefetches separately: hits and loads are those of demand accesses only,
+    PREFETCH_count, PREFETCH_MISS_count and PREFETCH_MISS_byte are the loads and misses caused by
+    prefetches. Misses include both, since prefetched cache lines are transferred all the same.
+    '''
+    counters = ['LOAD_count', 'LOAD_byte', 'HIT_count', 'HIT_byte', 'MISS_count', 'MISS_byte']
+
+    def __init__(self, csim, machine):
+        self.csim = csim
+        self.cacheline_size = int(machine['cacheline size'])
+        caches = list(csim.levels(with_mem=False))
+        names = [c.name for c in caches]
+        # prefetching cache level, backends of the levels it loads through and their index
+        self.prefetchers = [
+            (caches[names.index(c['level'])],
+             StreamPrefetcher.from_config(c['prefetchers'], self.cacheline_size),
+             [cache.backend for cache in caches[names.index(c['level']):]],
+             names.index(c['level']))
+            for c in machine['memory hierarchy'] if c.get('prefetchers') and c['level'] in names]
+        self.reset_stats()
+
+    @staticmethod
+    def has_prefetchers(machine):
+        '''Returns True if any cache level of *machine* describes prefetchers.'''
+        return any([c.get('prefetchers') for c in machine['memory hierarchy']])
+
+    def levels(self, with_mem=True):
+        return self.csim.levels(with_mem=with_mem)
+
+    def force_write_back(self):
+        self.csim.force_write_back()
+
+    def reset_stats(self):
+        self.csim.reset_stats()
+        self.prefetch_stats = [[0]*len(self.counters) for c in self.csim.levels()]
+
+    def _prefetch(self, lines):
+        '''Trains the prefetchers with *lines* and simulates their prefetches.'''
+        for cache, prefetcher, backends, first in self.prefetchers:
+            prefetches = prefetcher.train(lines)
+            if not prefetches:
+                continue
+            before = [[getattr(b, k) for k in self.counters] for b in backends]
+            cache.iterload([l*self.cacheline_size for l in prefetches], length=1)
+            for level, (b, counts) in enumerate(zip(backends, before)):
+                stats = self.prefetch_stats[first + level]
+                for i, k in enumerate(self.counters):
+                    stats[i] += getattr(b, k) - counts[i]
+
+    def loadstore_arrays(self, loads, stores, length=1):
+        '''Simulates (loads, stores) offset arrays of iterations, see simulate_offsets().'''
+        block = max(1, self.cacheline_size//length)
+        lines = numpy.hstack((loads, stores))//self.cacheline_size
+        # cache lines not accessed by the same load or store in the previous iteration, in order
+        new = numpy.ones(lines.shape, dtype=bool)
+        new[1:] = lines[1:] != lines[:-1]
+        new_lines = lines[new].tolist()
+        bounds = numpy.concatenate(([0], numpy.cumsum(new.sum(axis=1))))
+        for first in range(0, loads.shape[0], block):
+            last = min(first + block, loads.shape[0])
+            self._prefetch(new_lines[bounds[first]:bounds[last]])
+            simulate_offsets(self.csim, [(loads[first:last], stores[first:last])], length=length)
+
+    def stats(self):
+        '''Yields stats per level, with prefetches reported separately.'''
+        for level_stats, prefetch in zip(self.csim.stats(), self.prefetch_stats):
+            level_stats = dict(level_stats)
+            prefetch = dict(zip(self.counters, prefetch))
+            for k in ['LOAD_count', 'LOAD_byte', 'HIT_count', 'HIT_byte']:
+                level_stats[k] -= prefetch[k]
+            level_stats['PREFETCH_count'] = prefetch['LOAD_count']
+            level_stats['PREFETCH_MISS_count'] = prefetch['MISS_count']
+            level_stats['PREFETCH_MISS_byte'] = prefetch['MISS_byte']
+            yield level_stats
 
 
 # Not useing functools.cmp_to_key, because it does not exit in python 2.x
@@ -45,6 +388,8 @@ class CachePredictor(object):
     def __init__(self, kernel, machine):
         self.kernel = kernel
         self.machine = machine
+        # Bytes between arrays in the address space of Kernel.compile_global_offsets()
+        self.spacing = 0
 
     def get_hits(self):
         '''Returns a list with cache lines of hits per cache level'''
@@ -62,51 +407,118 @@ class CachePredictor(object):
         '''Returns verbose information about the predictor'''
         raise NotImplementedError("CachePredictor should only be used as a base class.")
 
+    def _align_iteration(self, iteration):
+        '''
+        Returns the last iteration before *iteration* which starts on a cacheline boundary.
+
+        Alignment is done with writes (preferred) or reads, under the assumption that they increase
+        linearly.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        cl_bits = int(self.machine['cacheline size']).bit_length() - 1
+        inner_increment = list(self.kernel.get_loop_stack(subs_consts=True))[-1]['increment']
+        o = list(self.kernel.compile_global_offsets(iteration=iteration, spacing=self.spacing))[0]
+        if o[1]:
+            # we have a write to work with:
+            first_offset = min(o[1])
+        else:
+            # we use reads
+            first_offset = min(o[0])
+        # Distance from cacheline boundary (in bytes)
+        diff = first_offset - \
+               (int(first_offset)>>cl_bits<<cl_bits)
+        return iteration - (diff//element_size)//inner_increment
+
+    def _benchmark_window(self, start, min_cachelines=0, stop=None):
+        '''
+        Returns end and number of cache lines of work of the benchmark window starting at
+        iteration *start*: up to the end of its inner loop (cacheline aligned), extended by whole
+        inner loops (within the current second inner most loop) to at least *min_cachelines*
+        cache lines of work. If given, the window ends at iteration *stop* at the latest.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        elements_per_cacheline = int(self.machine['cacheline size'] // element_size)
+        loop_stack = list(self.kernel.get_loop_stack(subs_consts=True))
+        inner_loop = loop_stack[-1]
+        inner_index = sympy.Symbol(inner_loop['index'], positive=True)
+        inner_increment = int(inner_loop['increment'])
+        cacheline_iterations = elements_per_cacheline*inner_increment
+
+        # End point is the end of the current dimension (cacheline alligned)
+        start_indices = self.kernel.global_iterator_to_indices(start)
+        first_dim_factor = int((inner_loop['stop'] - start_indices[inner_index] - 1)
+                               // (elements_per_cacheline//inner_increment))
+        end = start + cacheline_iterations*first_dim_factor
+        if first_dim_factor < min_cachelines:
+            loop_lengths = [int(l['stop'] - l['start']) for l in loop_stack]
+            inner_length = loop_lengths[-1]
+            rows = -(-(min_cachelines - first_dim_factor)*cacheline_iterations//inner_length)
+            if len(loop_lengths) > 1:
+                rows = min(rows, loop_lengths[-2] - (start//inner_length) % loop_lengths[-2] - 1)
+            rows = min(rows, (int(self.kernel.iteration_length()) - end)//inner_length)
+            end += rows*inner_length
+            first_dim_factor = (end - start)/cacheline_iterations
+        if stop is not None and end > stop:
+            first_dim_factor = (int(stop) - start)//cacheline_iterations
+            end = start + cacheline_iterations*first_dim_factor
+        return end, first_dim_factor
+
+    def _prefill_offsets(self, chunk_size=OFFSET_CHUNK_SIZE):
+        '''
+        Yields (loads, stores) offset chunks, as taken by simulate_offsets(), which bring all
+        arrays accessed by the kernel into the caches, as if the whole kernel had been run
+        before: every cache line of an array is accessed once, in layout order, by a store if the
+        kernel writes to the array and by a load otherwise.
+
+        The number of accesses only depends on the array sizes, not on the number of iterations.
+        '''
+        cacheline_size = int(self.machine['cacheline size'])
+        parametric = self.kernel._compile_parametric()
+        stored = set(parametric['store arrays'])
+        accessed = stored | set(parametric['load arrays'])
+        for name, start, end in self.kernel.array_extents(self.spacing):
+            if name not in accessed:
+                continue
+            lines = range(start - start % cacheline_size, end, cacheline_size)
+            for first in range(0, len(lines), chunk_size):
+                offsets = numpy.array(lines[first:first+chunk_size], dtype='int64').reshape(-1, 1)
+                none = numpy.empty((len(offsets), 0), dtype='int64')
+                yield (none, offsets) if name in stored else (offsets, none)
+
+    def _reuse_span(self):
+        '''
+        Returns the number of iterations between the first and the last access to the same array
+        element, based on the largest distance between accesses to one array within an iteration.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        inner_increment = list(self.kernel.get_loop_stack(subs_consts=True))[-1]['increment']
+        parametric = self.kernel._compile_parametric()
+        loads, stores = list(self.kernel.compile_global_offsets(
+            iteration=0, spacing=self.spacing))[0]
+        offsets = defaultdict(list)
+        for array, offset in chain(zip(parametric['load arrays'], loads or []),
+                                   zip(parametric['store arrays'], stores or [])):
+            offsets[array].append(offset)
+        span = max([max(o) - min(o) for o in offsets.values()] + [0])
+        return int(span//element_size//inner_increment)
+
+
 class LayerConditionPredictor(CachePredictor):
     '''
     Predictor classed based on layer condition analysis.
     '''
     def __init__(self, kernel, machine):
         CachePredictor.__init__(self, kernel, machine)
-        
-        # check that layer conditions can be applied on this kernel:
-        # 1. All iterations may only have a step width of 1
-        loop_stack = list(self.kernel.get_loop_stack())
-        if any([l['increment'] != 1 for l in loop_stack]):
-            raise ValueError("Can not apply layer-condition, since not all loops are of step "
-                             "length 1.")
-        
-        # 2. The order of iterations must be reflected in the order of indices in all array 
-        #    references containing the inner loop index. If the inner loop index is not part of the
-        #    reference, the reference is simply ignored
-        # TODO support flattend array indexes
-        references = list(self.kernel.index_order())
-        for aref in references:
-            for i, idx_names in enumerate(aref):
-                if any([loop_stack[i]['index'] != idx.name for idx in idx_names]):
-                    raise ValueError("Can not apply layer-condition, order of indices in array "
-                                     "does not follow order of loop indices. Single-dimension is "
-                                     "currently not supported.")
-        
-        # 3. Indices may only increase with one
-        # TODO use a public interface, not self.kernel._*
-        for arefs in chain(chain(*self.kernel._sources.values()),
-                           chain(*self.kernel._destinations.values())):
-            if arefs is None:
-                continue
-            for i, expr in enumerate(arefs):
-                diff = sympy.diff(expr, sympy.Symbol(loop_stack[i]['index']))
-                if diff != 0 and diff != 1:
-                    # TODO support -1 aswell
-                    raise ValueError("Can not apply layer-condition, array references may not "
-                                     "increment more then one per iteration.")
-                
+        self._check_kernel()
+
         # FIXME handle multiple datatypes
         element_size = self.kernel.datatypes_size[self.kernel.datatype]
         
         accesses = {}
         destinations = set()
         distances = []
+        # Reuse distances (in bytes) of each array
+        array_distances = {}
         results = {'accesses': accesses,
                    'distances': distances,
                    'destinations': destinations}
@@ -128,9 +540,12 @@ class LayerConditionPredictor(CachePredictor):
             acs.sort(reverse=True)
 
             # Create reuse distances by substracting accesses pairwise in decreasing order
-            distances += [(acs[i-1]-acs[i]).simplify() for i in range(1,len(acs))]
+            var_distances = [(acs[i-1]-acs[i]).simplify() for i in range(1,len(acs))]
+            distances += var_distances
             # Add infinity for each array
             distances.append(sympy.oo)
+            array_distances[var_name] = numpy.array(
+                [int(d)*element_size for d in var_distances], dtype='int64')
             
         # Sort distances by decreasing order
         distances.sort(reverse=True)
@@ -140,36 +555,47 @@ class LayerConditionPredictor(CachePredictor):
         
         results['distances_bytes'] = distances_bytes
         results['cache'] = []
-        
-        for c in  self.machine.get_cachesim().levels(with_mem=False):
-            # Assuming increasing order of cache sizes
-            hits = 0
-            misses = len(distances_bytes)
-            for tail in sorted(set(distances_bytes), reverse=True):
-                # Assuming decreasing order of tails
-                # Ignoring infinity tail:
-                if tail is sympy.oo:
-                    continue
-                cache_requirement = (
-                    sum([d for d in distances_bytes if d<=tail]) +  # Sum of inter-access caches
-                    tail*len([d for d in distances_bytes if d>tail]))  # Tails
-                
-                if cache_requirement <= c.size():
-                    # If we found a tail that fits into our available cache size
-                    # note hits and misses and break
-                    hits = len([d for d in distances_bytes if d<=tail])
-                    misses = len([d for d in distances_bytes if d>tail])
-                    break
-            
+        results['arrays'] = {name: {'hits': [], 'misses': [], 'evicts': []}
+                             for name in array_distances}
+
+        # Sorted finite distances with prefix sums, infinite distances are never hits
+        finite = numpy.array(sorted([int(d) for d in distances_bytes if d is not sympy.oo]),
+                             dtype='int64')
+        total = len(distances_bytes)
+        # Distinct tails, each with the count of distances up to (and including) it
+        tails, last_index = numpy.unique(finite[::-1], return_index=True)
+        hit_counts = len(finite) - last_index
+        prefix_sums = numpy.concatenate([[0], numpy.cumsum(finite)])
+        # Sum of inter-access caches plus tails, increasing with the tail
+        requirements = prefix_sums[hit_counts] + tails*(total - hit_counts)
+
+        caches = list(self.machine.get_cachesim().levels(with_mem=False))
+        # Index of the largest tail fitting into each cache level
+        fitting = numpy.searchsorted(
+            requirements, [c.size() for c in caches], side='right') - 1
+        for c, i in zip(caches, fitting.tolist()):
+            for name, d in array_distances.items():
+                # Distances up to the fitting tail are hits
+                var_hits = int(numpy.count_nonzero(d <= tails[i])) if i >= 0 else 0
+                results['arrays'][name]['hits'].append(var_hits)
+                results['arrays'][name]['misses'].append(len(d) + 1 - var_hits)
+                results['arrays'][name]['evicts'].append(
+                    len([d for d in destinations if d[0] == name]))
+            if i >= 0:
+                hits = int(hit_counts[i])
+            else:
+                # Not even the smallest tail fits, all accesses miss
+                hits = 0
+                i = 0 if len(tails) else None
             # Resulting analysis for current cache level
             results['cache'].append({
                 'name': c.name,
                 'hits': hits,
-                'misses': misses,
+                'misses': total - hits,
                 'evicts': len(destinations),
-                'requirement': cache_requirement,
-                'tail': tail})
-        
+                'requirement': int(requirements[i]) if i is not None else None,
+                'tail': int(tails[i]) if i is not None else None})
+
         self.results = results
 
     def get_hits(self):
@@ -188,15 +614,320 @@ class LayerConditionPredictor(CachePredictor):
         '''Returns verbose information about the predictor'''
         return self.results
 
+    def _check_kernel(self):
+        '''Raises ValueError if layer conditions can not be applied on the kernel.'''
+        # check that layer conditions can be applied on this kernel:
+        # 1. All iterations may only have a step width of 1
+        loop_stack = list(self.kernel.get_loop_stack())
+        if any([l['increment'] != 1 for l in loop_stack]):
+            raise ValueError("Can not apply layer-condition, since not all loops are of step "
+                             "length 1.")
+        
+        # 2. The order of iterations must be reflected in the order of indices in all array 
+        #    references containing the inner loop index. If the inner loop index is not part of the
+        #    reference, the reference is simply ignored
+        # TODO support flattend array indexes
+        references = list(self.kernel.index_order())
+        for aref in references:
+            for i, idx_names in enumerate(aref):
+                if any([loop_stack[i]['index'] != idx.name for idx in idx_names]):
+                    raise ValueError("Can not apply layer-condition, order of indices in array "
+                                     "does not follow order of loop indices. Single-dimension is "
+                                     "currently not supported.")
+        
+        # 3. Indices may only increase with one
+        # TODO use a public interface, not self.kernel._*
+        for arefs in chain(chain(*self.kernel._sources.values()),
+                           chain(*self.kernel._destinations.values())):
+            if arefs is None:
+                continue
+            for i, expr in enumerate(arefs):
+                diff = sympy.diff(expr, sympy.Symbol(loop_stack[i]['index']))
+                if diff != 0 and diff != 1:
+                    # TODO support -1 aswell
+                    raise ValueError("Can not apply layer-condition, array references may not "
+                                     "increment more then one per iteration.")
+
+
+class ParametricLayerConditionPredictor(LayerConditionPredictor):
+    '''
+    Predictor class based on layer condition analysis, derived once as a function of the constants.
+
+    Access offsets of each array are compiled into numeric functions of the constants (once per
+    kernel, see _derive()), so that a whole define sweep is evaluated in one vectorized call (see
+    evaluate()) and the points where a cache level's layer condition breaks are found exactly (see
+    transitions()). get_hits() etc. return the results for the kernel's current constants.
+
+    If the constants of all points of a define sweep are given as *points*, they are evaluated at
+    once (see sweep()) and a single predictor serves all of them, with the transitions along each
+    swept constant reported under 'transitions' in get_infos().
+    '''
+    # Derivations per kernel object, with the access description they were derived from
+    _derivations = weakref.WeakKeyDictionary()
+
+    def __init__(self, kernel, machine, points=None):
+        CachePredictor.__init__(self, kernel, machine)
+        self._check_kernel()
+        self.derivation = self._derive(kernel)
+        self.caches = [(c.name, c.size())
+                       for c in self.machine.get_cachesim().levels(with_mem=False)]
+
+        # Results by point (values of the derivation's constants)
+        self._points = {}
+        # Sorted values of each constant taking more than one value in the sweep
+        self._sweep_values = {}
+        # Transitions by swept constant and values of the other constants
+        self._transitions = {}
+        if points:
+            self.sweep(points)
+
+    @property
+    def results(self):
+        '''Results for the kernel's current constants, evaluated on first use if not swept.'''
+        point = self._point(self.kernel.constants)
+        if point not in self._points:
+            self._evaluate_points([point])
+        results = dict(self._points[point])
+        results['transitions'] = self._point_transitions(point)
+        return results
+
+    @classmethod
+    def _derive(cls, kernel):
+        '''
+        Returns numeric functions of the constants for the access offsets (in elements, with all
+        loop indices at zero) of every array, together with the constants, destinations and
+        element size. Layer condition distances are differences of those offsets.
+
+        Derivations are kept per kernel and redone once the kernel's variables or accesses change.
+        Constants need no invalidation, since the derivation is a function of them.
+        '''
+        description = kernel.access_description()
+        if kernel in cls._derivations and cls._derivations[kernel]['description'] == description:
+            return cls._derivations[kernel]
+
+        loop_symbols = [sympy.Symbol(l['index'], positive=True) for l in kernel.get_loop_stack()]
+        destinations = set()
+        offsets = []
+        for var_name in kernel.variables:
+            accesses = kernel._sources.get(var_name, []) + kernel._destinations.get(var_name, [])
+            # Skip non-variable offsets (acs is [None, None, None] or the like)
+            if not any(accesses):
+                continue
+            destinations.update(
+                [(var_name, tuple(r)) for r in kernel._destinations.get(var_name, [])])
+            offsets.append([kernel.access_to_sympy(var_name, r).subs(
+                {s: 0 for s in loop_symbols}) for r in accesses])
+        constant_symbols = set()
+        for expr in chain(*offsets):
+            constant_symbols |= sympy.sympify(expr).free_symbols
+        constant_symbols = sorted(constant_symbols, key=str)
+
+        cls._derivations[kernel] = {
+            'description': description,
+            'constants': constant_symbols,
+            'offsets': [sympy.lambdify(constant_symbols, o, numpy) for o in offsets],
+            'destinations': destinations,
+            # FIXME handle multiple datatypes
+            'element size': kernel.datatypes_size[kernel.datatype]}
+        return cls._derivations[kernel]
+
+    def _point(self, constants):
+        '''Returns the values of the derivation's constants in *constants* as a tuple.'''
+        values = {str(k): v for k, v in constants.items()}
+        missing = [s for s in self.derivation['constants'] if str(s) not in values]
+        if missing:
+            raise ValueError("Values for constants {} are required.".format(
+                ', '.join([str(s) for s in missing])))
+        return tuple([int(values[str(s)]) for s in self.derivation['constants']])
+
+    def _evaluate_points(self, points):
+        '''Evaluates all *points* (see _point()) in one call and keeps their results.'''
+        symbols = self.derivation['constants']
+        results = self.evaluate({s: [p[i] for p in points] for i, s in enumerate(symbols)})
+        for i, point in enumerate(points):
+            cache = []
+            for level, (name, size) in enumerate(self.caches):
+                cache.append({
+                    key: int(numpy.asarray(results[key][level]).reshape(-1)[i])
+                    if results[key] is not None else None
+                    for key in ['hits', 'misses', 'evicts', 'requirement', 'tail']})
+                cache[-1]['name'] = name
+            self._points[point] = {'destinations': self.derivation['destinations'],
+                                   'cache': cache}
+
+    def sweep(self, points):
+        '''
+        Evaluates the layer conditions of all *points* in one vectorized call and keeps the results
+        for get_hits() etc., whichever of the points the kernel's constants are set to.
+
+        :param points: list of dictionaries mapping constant names (or symbols) to values, e.g. the
+                       define points of a sweep
+        '''
+        points = sorted(set([self._point(p) for p in points]))
+        self._evaluate_points(points)
+        for i, symbol in enumerate(self.derivation['constants']):
+            values = sorted(set([p[i] for p in points]))
+            if len(values) > 1:
+                self._sweep_values[symbol] = values
+
+    def _point_transitions(self, point):
+        '''
+        Returns the transitions (see transitions()) along the values of each swept constant, with
+        the other constants as in *point*, by constant name.
+        '''
+        transitions = {}
+        for i, symbol in enumerate(self.derivation['constants']):
+            if symbol not in self._sweep_values:
+                continue
+            key = (symbol, point[:i] + point[i+1:])
+            if key not in self._transitions:
+                self._transitions[key] = self.transitions(
+                    symbol, self._sweep_values[symbol],
+                    dict(zip(self.derivation['constants'], point)))
+            transitions[str(symbol)] = self._transitions[key]
+        return transitions
+
+    def evaluate(self, constants):
+        '''
+        Returns hits, misses, evicts, requirement (in bytes) and tail (in bytes) per cache level,
+        each as an array with one entry per point (or None if there are no finite distances).
+
+        :param constants: dictionary mapping constant names (or symbols) to values, either scalars
+                          or arrays which are broadcast against each other (e.g. all points of a
+                          define sweep)
+        '''
+        derivation = self.derivation
+        values = {sympy.Symbol(str(k), positive=True): v for k, v in constants.items()}
+        missing = [s for s in derivation['constants'] if s not in values]
+        if missing:
+            raise ValueError("Values for constants {} are required.".format(
+                ', '.join([str(s) for s in missing])))
+        # all given constants determine the points, even if offsets do not depend on them
+        shape = numpy.broadcast_arrays(*[numpy.asarray(v) for v in values.values()] or [0])[0].shape
+        values = [numpy.broadcast_to(numpy.asarray(values[s], dtype='int64'), shape)
+                  for s in derivation['constants']]
+        points = int(numpy.prod(shape))
+
+        # Reuse distances between consecutive accesses (in decreasing order) per array and point
+        distances = []
+        for func in derivation['offsets']:
+            offsets = numpy.array([numpy.broadcast_to(o, shape) for o in func(*values)],
+                                  dtype='int64').reshape(-1, points)
+            offsets = -numpy.sort(-offsets, axis=0)
+            distances.append(offsets[:-1] - offsets[1:])
+        # Sorted finite distances (in bytes) with one row per point, one infinite distance per array
+        finite = numpy.sort(
+            numpy.concatenate(distances + [numpy.zeros((0, points), dtype='int64')], axis=0).T,
+            axis=1)*derivation['element size']
+        total = finite.shape[1] + len(distances)
+        # Sum of inter-access caches plus tails, using each distance as tail
+        requirements = numpy.cumsum(finite, axis=1) + \
+            finite*(total - numpy.arange(1, finite.shape[1] + 1))
+
+        results = {'hits': [], 'misses': [], 'evicts': [], 'requirement': [], 'tail': []}
+        for name, size in self.caches:
+            # requirements increase with the tail, hits are all distances up to the largest
+            # fitting one
+            hits = numpy.count_nonzero(requirements <= size, axis=1)
+            results['hits'].append(hits.reshape(shape))
+            results['misses'].append((total - hits).reshape(shape))
+            results['evicts'].append(numpy.full(shape, len(derivation['destinations'])))
+            if finite.shape[1]:
+                # Not even the smallest tail fits, all accesses miss
+                index = (numpy.arange(points), numpy.maximum(hits - 1, 0))
+                results['requirement'].append(requirements[index].reshape(shape))
+                results['tail'].append(finite[index].reshape(shape))
+        for key in ['requirement', 'tail']:
+            if not results[key]:
+                results[key] = None
+        return results
+
+    def transitions(self, name, values, constants=None):
+        '''
+        Returns, per cache level, the points where the number of hits changes while constant *name*
+        runs through the increasing *values* (other constants are taken from *constants*, or the
+        kernel). Changes between consecutive values are located by bisection, down to the exact
+        value from which on the new number of hits applies.
+
+        Returns a list of (value, hits before, hits after) tuples per cache level.
+        '''
+        symbol = sympy.Symbol(str(name), positive=True)
+        constants = dict(self.kernel.constants if constants is None else constants)
+        constants = {sympy.Symbol(str(k), positive=True): v for k, v in constants.items()}
+
+        def hits(values):
+            constants[symbol] = numpy.asarray(values, dtype='int64')
+            return numpy.array(self.evaluate(constants)['hits']).reshape(len(self.caches), -1)
+
+        def bisect(level, low, high, low_hits, high_hits):
+            if low_hits == high_hits:
+                return []
+            if high - low == 1:
+                return [(high, low_hits, high_hits)]
+            middle = (low + high)//2
+            middle_hits = int(hits([middle])[level][0])
+            return bisect(level, low, middle, low_hits, middle_hits) + \
+                bisect(level, middle, high, middle_hits, high_hits)
+
+        values = numpy.asarray(values, dtype='int64')
+        sweep = hits(values).tolist()
+        return [list(chain(*[bisect(level, int(low), int(high), low_hits, high_hits)
+                             for low, high, low_hits, high_hits in zip(
+                                 values[:-1], values[1:], sweep[level][:-1], sweep[level][1:])]))
+                for level in range(len(self.caches))]
+
 
 class CacheSimulationPredictor(CachePredictor):
     '''
-    Predictor classed based on layer condition analysis.
+    Predictor class based on cache simulation (using pycachesim).
+
+    :param warmup: 'fixed' (default) uses a third of each loop dimension (limited to 1.5x the
+                   largest cache), 'adaptive' simulates the warm-up in windows until the per
+                   cache line hits and misses of all cache levels converged.
+    :param warmup_tolerance: maximum change of hits and misses (in cache lines per cache line of
+                             work) between consecutive windows, for the warm-up to be converged.
+    :param samples: number of benchmark windows, spread evenly across the iteration space. Each
+                    additional window is simulated on a separately warmed-up cache simulator.
+                    Results are the mean over all windows.
+    :param budget: maximum number of iterations simulated for additional windows (including their
+                   warm-up), fewer windows are used if necessary. None means unlimited.
+    :param set_sampling: if not None, only a subset of cache sets is simulated (see
+                         SetSampledCacheSimulator), with one of every set_sampling lines being
+                         simulated, or the largest suitable ratio (up to 64) if 'auto'.
+    :param reuse_results: reuse the outcome of warm-up and first benchmark window of a previous
+                          define point of the same kernel, if they simulate the very same trace
+                          (see _reused_result()).
+    :param cores: number of cores the outer most loop is partitioned on (see _simulate_cores()).
+                  With more than one core, shared cache levels see the interleaved accesses of all
+                  cores and hits, misses and evicts are reported per core. Only the fixed warm-up
+                  and a single benchmark window, without set sampling, are supported.
+    :param spacing: bytes of padding between arrays (see Kernel.compile_global_offsets()).
+
+    Hardware prefetchers described in the machine file are modelled by PrefetchingCacheSimulator,
+    which supports neither set sampling nor more than one core. Their loads and misses are
+    reported under 'prefetch' in the infos; misses per level include those caused by prefetches.
     '''
-    def __init__(self, kernel, machine):
+    # Outcome of warm-up and first benchmark window per kernel object and trace key, least recently
+    # used first
+    _reusable_results = weakref.WeakKeyDictionary()
+
+    def __init__(self, kernel, machine, warmup='fixed', warmup_tolerance=0.01, samples=1,
+                 budget=None, set_sampling=None, reuse_results=False, cores=1, spacing=0):
         CachePredictor.__init__(self, kernel, machine)
+        self.spacing = spacing
+        assert warmup in ['adaptive', 'fixed'], "warmup needs to be 'adaptive' or 'fixed'"
+        assert samples >= 1, "at least one sample is required"
+        assert cores == 1 or samples == 1 and set_sampling is None, \
+            "multi-core simulation supports neither sampling of windows nor sets"
+        self.cores = cores
+        if set_sampling == 'auto':
+            set_sampling = SetSampledCacheSimulator.auto_ratio(self.machine.get_cachesim())
+        self.set_sampling = set_sampling
+        self.prefetching = PrefetchingCacheSimulator.has_prefetchers(self.machine)
+        assert not self.prefetching or cores == 1 and set_sampling is None, \
+            "prefetchers are supported neither with multi-core simulation nor set sampling"
         # Get the machine's cache model and simulator
-        csim = self.machine.get_cachesim()
+        csim = self._get_cachesim()
         
         # FIXME handle multiple datatypes
         element_size = self.kernel.datatypes_size[self.kernel.datatype]
@@ -205,23 +936,16 @@ class CacheSimulationPredictor(CachePredictor):
         
         # Gathering some loop information:
         inner_loop = list(self.kernel.get_loop_stack(subs_consts=True))[-1]
-        inner_index = sympy.Symbol(inner_loop['index'], positive=True)
         inner_increment = inner_loop['increment']# Calculate the number of iterations for warm-up
         max_cache_size = max(map(lambda c: c.size(), csim.levels(with_mem=False)))
         max_array_size = max(self.kernel.array_sizes(in_bytes=True, subs_consts=True).values())
 
-        offsets = []
-        if max_array_size < max_cache_size:
-            # Full caching possible, go through all itreration before actual initialization
-            offsets = list(self.kernel.compile_global_offsets(
-                iteration=range(0, self.kernel.iteration_length())))
-
         # Regular Initialization
         warmup_indices = {
             sympy.Symbol(l['index'], positive=True): ((l['stop']-l['start'])//l['increment'])//3
             for l in self.kernel.get_loop_stack(subs_consts=True)}
         warmup_iteration_count = self.kernel.indices_to_global_iterator(warmup_indices)
-        
+
         # Make sure we are not handeling gigabytes of data, but 1.5x the maximum cache size
         while warmup_iteration_count*element_size > max_cache_size*1.5:
             for index in [sympy.Symbol(l['index'], positive=True)
@@ -230,29 +954,187 @@ class CacheSimulationPredictor(CachePredictor):
                     warmup_indices[index] -= 1
                     break
             warmup_iteration_count = self.kernel.indices_to_global_iterator(warmup_indices)
-        
-        # Align iteration count with cachelines
-        # do this by aligning either writes (preferred) or reads:
-        # Assumption: writes (and reads) increase linearly
-        o = list(self.kernel.compile_global_offsets(iteration=warmup_iteration_count))[0]
-        if o[1]:
-            # we have a write to work with:
-            first_offset = min(o[1])
+        prefill = max_array_size < max_cache_size
+        if cores > 1:
+            self._simulate_cores(warmup_iteration_count, prefill)
+            return
+
+        if warmup == 'adaptive':
+            # The fixed heuristic only serves as a lower bound for the maximum warm-up length
+            max_warmup_iteration_count = max(warmup_iteration_count, min(
+                4*max_cache_size//element_size,
+                self.kernel.iteration_length() - int(inner_loop['stop'] - inner_loop['start'])))
+
+        # Warm-up and first benchmark window only depend on the offsets and these parameters
+        result_key = (
+            self.kernel.trace_fingerprint(self.spacing), self._cache_configuration(),
+            self.set_sampling, warmup, warmup_tolerance,
+            # the maximum warm-up length only matters through the windows, or if it was reached
+            self._adaptive_warmup_windows(max_warmup_iteration_count) if warmup == 'adaptive'
+            else warmup_iteration_count,
+            # all arrays are brought into the caches for full caching
+            tuple(self.kernel.array_extents(self.spacing)) if prefill else None)
+        result = None
+        if reuse_results:
+            result = self._reused_result(
+                result_key, max_warmup_iteration_count if warmup == 'adaptive' else None)
+        if result is not None:
+            self.warmup = dict(result['warm-up'], reused=True)
+            warmup_iteration_count = self.warmup['iterations']
+            self.first_dim_factor, self.stats = result['first dim factor'], result['stats']
+            self.array_counters = result['array counters']
+            if self.set_sampling is not None:
+                self.set_sampling_groups, self.set_sampling_accesses = result['set sampling']
         else:
-            # we use reads
-            first_offset = min(o[0])
-        # Distance from cacheline boundary (in bytes)
-        diff = first_offset - \
-               (int(first_offset)>>csim.first_level.cl_bits<<csim.first_level.cl_bits)
-        warmup_iteration_count -= (diff//element_size)//inner_increment
-        warmup_indices = self.kernel.global_iterator_to_indices(warmup_iteration_count)
+            if prefill:
+                # Full caching possible, bring all arrays into the caches before initialization
+                simulate_offsets(csim, self._prefill_offsets(), length=element_size)
 
-        offsets += list(self.kernel.compile_global_offsets(
-            iteration=range(0, warmup_iteration_count)))
+            warmup_limits = None
+            if warmup == 'adaptive':
+                warmup_iteration_count, self.warmup = self._adaptive_warmup(
+                    csim, max_warmup_iteration_count, warmup_tolerance)
+                # range of maximum warm-up lengths leading to the same warm-up
+                window = self._adaptive_warmup_windows(max_warmup_iteration_count)[0]
+                warmup_limits = (warmup_iteration_count, None if self.warmup['converged']
+                                 else warmup_iteration_count + window - 1)
+                # Continue warm-up up to the next cacheline aligned iteration
+                aligned_iteration_count = self._align_iteration(warmup_iteration_count)
+                if aligned_iteration_count < warmup_iteration_count:
+                    aligned_iteration_count += elements_per_cacheline*inner_increment
+                simulate_offsets(
+                    csim,
+                    self.kernel.compile_global_offsets(
+                        iteration=range(warmup_iteration_count, aligned_iteration_count),
+                        chunk_size=OFFSET_CHUNK_SIZE, spacing=self.spacing),
+                    length=element_size)
+                warmup_iteration_count = aligned_iteration_count
+            else:
+                warmup_iteration_count = self._align_iteration(warmup_iteration_count)
 
-        # Do the warm-up
-        csim.loadstore(offsets, length=element_size)
-        # FIXME compile_global_offsets should already expand to element_size
+                # Do the warm-up
+                simulate_offsets(
+                    csim,
+                    self.kernel.compile_global_offsets(
+                        iteration=range(0, warmup_iteration_count),
+                        chunk_size=OFFSET_CHUNK_SIZE, spacing=self.spacing),
+                    length=element_size)
+                # FIXME compile_global_offsets should already expand to element_size
+                self.warmup = {'mode': 'fixed'}
+            self.warmup['iterations'] = warmup_iteration_count
+
+            # Benchmark iterations:
+            # Strting point is one past the last warmup element
+            # (with traffic per array, which is not available with set sampling or prefetchers)
+            self.array_counters = None if self.set_sampling is not None or self.prefetching \
+                else {}
+            self.first_dim_factor, self.stats = self._simulate_window(
+                csim, warmup_iteration_count, self.array_counters)
+            if self.set_sampling is not None:
+                self.set_sampling_groups = [self._normalize_stats(stats, self.first_dim_factor)
+                                            for stats in csim.group_stats()]
+                self.set_sampling_accesses = [csim.simulated_accesses, csim.accesses]
+            if reuse_results:
+                self._store_result(result_key, warmup_limits)
+        self.samples = [self._normalize_stats(self.stats, self.first_dim_factor)]
+        self.sampling = {'positions': [warmup_iteration_count], 'budget': budget,
+                         'simulated iterations': 0}
+        if samples > 1:
+            self._sample_windows(
+                samples - 1, warmup_iteration_count, max_array_size < max_cache_size, budget)
+
+    def _cache_configuration(self):
+        '''Returns a hashable description of the machine's caches.'''
+        return tuple([(c['level'], tuple(sorted(c['cache per group'].items())),
+                       tuple(sorted(c.get('prefetchers', {}).items()))
+                       if self.prefetching else None)
+                      for c in self.machine['memory hierarchy'] if 'cache per group' in c])
+
+    def _window_cachelines(self):
+        '''Returns the minimum number of cache lines of work in a benchmark window.'''
+        # Only one in set_sampling cache lines is simulated, so at least 16 simulated cache lines
+        # of work are needed
+        return 16*self.set_sampling if self.set_sampling is not None else 0
+
+    def _store_result(self, key, warmup_limits=None):
+        '''
+        Stores the outcome of warm-up and first benchmark window under *key*. Only the
+        MAX_REUSABLE_RESULTS most recently used outcomes are kept per kernel.
+
+        *warmup_limits* is the (lowest, highest or None) maximum length of an adaptive warm-up
+        with the same outcome.
+        '''
+        result = {
+            'warm-up': dict(self.warmup),
+            'warm-up limits': warmup_limits,
+            'window': self._benchmark_window(self.warmup['iterations'], self._window_cachelines()),
+            'first dim factor': self.first_dim_factor,
+            'stats': self.stats,
+            'array counters': self.array_counters}
+        if self.set_sampling is not None:
+            result['set sampling'] = (self.set_sampling_groups, self.set_sampling_accesses)
+        results = self._reusable_results.setdefault(self.kernel, OrderedDict())
+        results.pop(key, None)
+        results[key] = result
+        while len(results) > MAX_REUSABLE_RESULTS:
+            results.popitem(last=False)
+
+    def _reused_result(self, key, max_warmup_iteration_count=None):
+        '''
+        Returns the outcome stored under *key* for this kernel, if its adaptive warm-up would also
+        end the same way with *max_warmup_iteration_count* and its benchmark window is the same
+        for the current constants, otherwise None.
+
+        pycachesim offers no way to copy or read back the state of a simulator, so this is not a
+        checkpoint of the warmed-up caches, but the memoized outcome of simulating the very same
+        trace. The key covers everything it depends on: the offsets trace (see
+        Kernel.trace_fingerprint()), the cache configuration and the warm-up parameters. Only
+        define points which extend the outer most loop without moving any array (e.g. a sweep
+        over M, with arrays not depending on M) share an outcome. Sweeps over constants which
+        size the arrays change the trace and never do.
+        '''
+        results = self._reusable_results.get(self.kernel, {})
+        result = results.get(key)
+        if result is None:
+            return None
+        if result['warm-up limits'] is not None:
+            low, high = result['warm-up limits']
+            if max_warmup_iteration_count < low or \
+                    high is not None and max_warmup_iteration_count > high:
+                return None
+        window = self._benchmark_window(result['warm-up']['iterations'], self._window_cachelines())
+        if window != result['window']:
+            return None
+        # Mark as most recently used
+        del results[key]
+        results[key] = result
+        return result
+
+    def _get_cachesim(self):
+        '''
+        Returns a new (set-sampled, if requested) cache simulator of the machine, with prefetchers
+        if modelled.
+        '''
+        if self.prefetching:
+            return PrefetchingCacheSimulator(self.machine.get_cachesim(), self.machine)
+        if self.set_sampling is None:
+            return self.machine.get_cachesim()
+        return SetSampledCacheSimulator(
+            lambda: self.machine.get_cachesim(), self.set_sampling)
+
+    def _simulate_window(self, csim, start, array_counters=None):
+        '''
+        Simulates the benchmark window from iteration *start* to the end of its inner loop
+        (cacheline aligned), after concluding the warm-up phase.
+
+        If a dictionary is given as *array_counters*, hits, misses and stores of each array are
+        counted over the first ARRAY_ATTRIBUTION_CACHELINES cache lines of work in the window
+        (see _simulate_arrays()), and stored in it under 'arrays' and 'cachelines'.
+
+        Returns the number of cache lines of work in the window and the cache stats.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        start = int(start)
 
         # Force write-back on all cache levels
         csim.force_write_back()
@@ -260,59 +1142,962 @@ class CacheSimulationPredictor(CachePredictor):
         # Reset stats to conclude warm-up phase
         csim.reset_stats()
 
-        # Benchmark iterations:
-        # Strting point is one past the last warmup element
-        bench_iteration_start = warmup_iteration_count
-        # End point is the end of the current dimension (cacheline alligned)
-        first_dim_factor = int((inner_loop['stop'] - warmup_indices[inner_index] - 1) 
-                               // (elements_per_cacheline//inner_increment))
-        bench_iteration_end = (bench_iteration_start + 
-                               elements_per_cacheline*inner_increment*first_dim_factor)
-
-        # compile access needed for one cache-line
-        offsets = list(self.kernel.compile_global_offsets(
-            iteration=range(bench_iteration_start, bench_iteration_end)))
-        # simulate
-        csim.loadstore(offsets, length=element_size)
+        end, first_dim_factor = self._benchmark_window(start, self._window_cachelines())
+
+        attributed_end = start
+        if array_counters is not None:
+            cacheline_iterations = int(
+                self.machine['cacheline size']//element_size *
+                list(self.kernel.get_loop_stack(subs_consts=True))[-1]['increment'])
+            attributed_end = min(end, start + ARRAY_ATTRIBUTION_CACHELINES*cacheline_iterations)
+            array_counters['arrays'] = self._simulate_arrays(csim, range(start, attributed_end))
+            array_counters['cachelines'] = (attributed_end - start)/cacheline_iterations
+
+        # compile access needed for one cache-line and simulate
+        simulate_offsets(
+            csim,
+            self.kernel.compile_global_offsets(
+                iteration=range(attributed_end, end), chunk_size=OFFSET_CHUNK_SIZE,
+                spacing=self.spacing),
+            length=element_size)
         # FIXME compile_global_offsets should already expand to element_size
 
         # Force write-back on all cache levels
         csim.force_write_back()
-        
-        # use stats to build results
-        self.stats = list(csim.stats())
-        self.first_dim_factor = first_dim_factor
+
+        return first_dim_factor, list(csim.stats())
+
+    def _simulate_arrays(self, csim, iteration):
+        '''
+        Simulates *iteration* on *csim* like simulate_offsets(), but hands over the accesses of
+        each array separately, and returns hits and misses per cache level and the number of
+        stores, caused by each array.
+
+        Traffic on lower cache levels due to evicts from higher levels is counted for the array
+        whose access caused the evict.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        parametric = self.kernel._compile_parametric()
+        levels = list(csim.levels(with_mem=False))
+
+        def runs(names):
+            # (name, first, last) column of each array, accesses to one array are adjacent
+            bounds = [i for i in range(len(names)) if i == 0 or names[i] != names[i-1]]
+            return [(names[b], b, e) for b, e in zip(bounds, bounds[1:] + [len(names)])]
+        load_runs = runs(parametric['load arrays'])
+        store_runs = runs(parametric['store arrays'])
+
+        counters = {name: {'hits': [0]*len(levels), 'misses': [0]*len(levels), 'stores': 0}
+                    for name in set(parametric['load arrays'] + parametric['store arrays'])}
+        for loads, stores in self.kernel.compile_global_offsets(
+                iteration=iteration, chunk_size=OFFSET_CHUNK_SIZE, spacing=self.spacing):
+            for name, first, last in store_runs:
+                counters[name]['stores'] += stores.shape[0]*(last - first)
+            for load_row, store_row in zip(loads.tolist(), stores.tolist()):
+                for row, row_runs, access in [(load_row, load_runs, csim.load),
+                                              (store_row, store_runs, csim.store)]:
+                    for name, first, last in row_runs:
+                        before = [(c.HIT_count, c.MISS_count) for c in levels]
+                        access(row[first:last], length=element_size)
+                        for level, (c, (hits, misses)) in enumerate(zip(levels, before)):
+                            counters[name]['hits'][level] += c.HIT_count - hits
+                            counters[name]['misses'][level] += c.MISS_count - misses
+        return counters
+
+    def _array_traffic(self):
+        '''
+        Returns hits, misses and evicts per cache level and cache line of work for each array,
+        from the first benchmark window. Evicts are split between the stored arrays in proportion
+        to their stores. None if traffic was not counted per array.
+        '''
+        if not self.array_counters or not self.array_counters['cachelines']:
+            return None
+        arrays = self.array_counters['arrays']
+        cachelines = self.array_counters['cachelines']
+        evicts = self.samples[0]['evicts']
+        stores = sum([c['stores'] for c in arrays.values()])
+        return {name: {'hits': [h/cachelines for h in c['hits']],
+                       'misses': [m/cachelines for m in c['misses']],
+                       'evicts': [e*c['stores']/stores if stores else 0.0 for e in evicts]}
+                for name, c in arrays.items()}
+
+    def _simulate_cores(self, warmup_iteration_count, prefill):
+        '''
+        Simulates warm-up and benchmark window on all cores, with the outer most loop statically
+        partitioned into contiguous blocks (as with OpenMP's static schedule).
+
+        Each core has its own simulator from MachineModel.get_cachesims(cores), sharing the cache
+        objects of shared levels. Cores advance in turns of up to INTERLEAVE_CACHELINES cache
+        lines of work (at most one inner loop), so shared levels see the interleaved accesses of
+        all cores. Every core warms up with (up to) *warmup_iteration_count* iterations from the
+        start of its block, preceded by all arrays (see _prefill_offsets()) if *prefill*. Warm-up
+        and benchmark window of a core stay within its block.
+
+        Traffic of shared levels is attributed to the cores in proportion to their work, so the
+        resulting hits, misses and evicts are per core and cache line of work.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        elements_per_cacheline = int(self.machine['cacheline size'] // element_size)
+        loop_stack = list(self.kernel.get_loop_stack(subs_consts=True))
+        inner_length = int(loop_stack[-1]['stop'] - loop_stack[-1]['start'])
+        cacheline_iterations = int(elements_per_cacheline*loop_stack[-1]['increment'])
+        outer_length = int(loop_stack[0]['stop'] - loop_stack[0]['start'])//int(
+            loop_stack[0]['increment'])
+        iteration_length = int(self.kernel.iteration_length())
+        if outer_length < self.cores:
+            raise ValueError("Outer most loop has less iterations than cores.")
+        block = iteration_length//outer_length
+        partitions = [(block*(outer_length*core//self.cores),
+                       block*(outer_length*(core+1)//self.cores)) for core in range(self.cores)]
+
+        chunk = min(inner_length, INTERLEAVE_CACHELINES*cacheline_iterations)
+
+        csims = self.machine.get_cachesims(self.cores)
+        if prefill:
+            # Cores take turns bringing INTERLEAVE_CACHELINES lines of the arrays into the caches
+            prefills = [(csim, self._prefill_offsets(chunk_size=INTERLEAVE_CACHELINES))
+                        for csim in csims]
+            while prefills:
+                for csim, offsets in list(prefills):
+                    offsets_chunk = next(offsets, None)
+                    if offsets_chunk is None:
+                        prefills.remove((csim, offsets))
+                    else:
+                        simulate_offsets(csim, [offsets_chunk], length=element_size)
+
+        # Warm-up, leaving at least one inner loop (up to half the block) for the benchmark window
+        starts = []
+        for start, end in partitions:
+            window = min(inner_length, (end - start)//2)
+            warmup_end = start + max(0, min(int(warmup_iteration_count), end - start - window))
+            aligned = self._align_iteration(warmup_end)
+            if aligned < warmup_end:
+                aligned += cacheline_iterations
+            starts.append(max(start, aligned))
+        self._simulate_interleaved(
+            csims, [(p[0], s) for p, s in zip(partitions, starts)], chunk)
+        self.warmup = {'mode': 'fixed', 'iterations': starts[0] - partitions[0][0]}
+
+        # Benchmark window
+        for csim in csims:
+            csim.force_write_back()
+        for csim in csims:
+            csim.reset_stats()
+        windows = [self._benchmark_window(start, stop=end)
+                   for start, (partition_start, end) in zip(starts, partitions)]
+        self._simulate_interleaved(
+            csims, [(s, w[0]) for s, w in zip(starts, windows)], chunk)
+        for csim in csims:
+            csim.force_write_back()
+
+        # Group cores by the cache objects they share on each level
+        factors = [w[1] for w in windows]
+        levels = [list(csim.levels()) for csim in csims]
+        per_core_stats = [[] for core in range(self.cores)]
+        self.stats = []
+        for l in range(len(levels[0])):
+            groups = {}
+            for core in range(self.cores):
+                groups.setdefault(id(levels[core][l]), []).append(core)
+            total = None
+            for group in groups.values():
+                stats = levels[group[0]][l].stats()
+                group_factor = sum([factors[core] for core in group])
+                for core in group:
+                    per_core_stats[core].append(
+                        {k: v*factors[core]/group_factor if k != 'name' else v
+                         for k, v in stats.items()})
+                if total is None:
+                    total = dict(stats)
+                else:
+                    total.update({k: total[k] + v for k, v in stats.items() if k != 'name'})
+            self.stats.append(total)
+        self.first_dim_factor = sum(factors)
+        self.array_counters = None
+
+        self.samples = [self._normalize_stats(self.stats, self.first_dim_factor)]
+        self.sampling = {'positions': [starts[0]], 'budget': None, 'simulated iterations': 0}
+        self.multi_core = {
+            'cores': self.cores,
+            'partitions': partitions,
+            'windows': [(s, w[0]) for s, w in zip(starts, windows)],
+            'shared levels': [levels[0][l].name for l in range(len(levels[0]) - 1)
+                              if len(set([id(c[l]) for c in levels])) < self.cores],
+            'per core': [self._normalize_stats(stats, factor)
+                         for stats, factor in zip(per_core_stats, factors)]}
+
+    def _simulate_interleaved(self, csims, ranges, chunk):
+        '''
+        Simulates the iteration *ranges* (start, end) on the corresponding simulators in *csims*,
+        taking turns after *chunk* iterations.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        positions = [start for start, end in ranges]
+        while any([p < end for p, (start, end) in zip(positions, ranges)]):
+            for core, (csim, (start, end)) in enumerate(zip(csims, ranges)):
+                if positions[core] >= end:
+                    continue
+                stop = min(positions[core] + chunk, end)
+                simulate_offsets(
+                    csim,
+                    self.kernel.compile_global_offsets(
+                        iteration=range(positions[core], stop), chunk_size=OFFSET_CHUNK_SIZE,
+                        spacing=self.spacing),
+                    length=element_size)
+                positions[core] = stop
+
+    def _normalize_stats(self, stats, first_dim_factor):
+        '''Returns hits, misses and evicts per cache level and cache line of work.'''
+        cache_levels = range(len(self.machine['memory hierarchy'][:-1]))
+        normalized = {
+            'hits': [stats[l]['HIT_count']/first_dim_factor for l in cache_levels],
+            'misses': [stats[l]['MISS_count']/first_dim_factor for l in cache_levels],
+            # FIXME assumption for line evicts: all stores are consecutive
+            'evicts': [stats[l+1]['STORE_count']/first_dim_factor for l in cache_levels],
+            'hit bytes': [stats[l]['HIT_byte']/first_dim_factor for l in cache_levels],
+            'miss bytes': [stats[l]['MISS_byte']/first_dim_factor for l in cache_levels],
+            'evict bytes': [stats[l]['STORE_byte']/first_dim_factor for l in cache_levels]}
+        if 'PREFETCH_count' in stats[0]:
+            normalized['prefetches'] = [
+                stats[l]['PREFETCH_count']/first_dim_factor for l in cache_levels]
+            normalized['prefetch misses'] = [
+                stats[l]['PREFETCH_MISS_count']/first_dim_factor for l in cache_levels]
+        return normalized
+
+    def _sample_windows(self, count, warmup_iteration_count, prefill, budget):
+        '''
+        Simulates up to *count* additional benchmark windows, evenly spread between the first
+        window and the last inner loop, each on a new cache simulator warmed up with the
+        *warmup_iteration_count* iterations preceding it (after bringing all arrays into the
+        caches if *prefill*).
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        elements_per_cacheline = int(self.machine['cacheline size'] // element_size)
+        inner_loop = list(self.kernel.get_loop_stack(subs_consts=True))[-1]
+        inner_length = int(inner_loop['stop'] - inner_loop['start'])
+        cacheline_iterations = int(elements_per_cacheline*inner_loop['increment'])
+        iteration_length = int(self.kernel.iteration_length())
+
+        prefill_cost = 0
+        if prefill:
+            # prefill accesses, in iterations with the same number of accesses
+            parametric = self.kernel._compile_parametric()
+            prefill_cost = sum([len(l) for l, s in self._prefill_offsets()])//max(
+                1, len(parametric['load arrays']) + len(parametric['store arrays']))
+        cost = warmup_iteration_count + inner_length + prefill_cost
+        if budget is not None:
+            count = min(count, budget//cost)
+        first = self.sampling['positions'][0]
+        last = iteration_length - inner_length
+        if count < 1 or last <= first:
+            return
+
+        for sample in range(1, count+1):
+            position = first + (last - first)*sample//count
+            # move to start of inner loop and align with cachelines
+            position -= position % inner_length
+            csim = self._get_cachesim()
+            aligned = self._align_iteration(position)
+            if aligned < position:
+                aligned += cacheline_iterations
+            warmup_start = max(0, aligned - warmup_iteration_count)
+
+            if prefill:
+                simulate_offsets(csim, self._prefill_offsets(), length=element_size)
+            simulate_offsets(
+                csim,
+                self.kernel.compile_global_offsets(
+                    iteration=range(warmup_start, aligned), chunk_size=OFFSET_CHUNK_SIZE,
+                    spacing=self.spacing),
+                length=element_size)
+            first_dim_factor, stats = self._simulate_window(csim, aligned)
+            if first_dim_factor < 1:
+                continue
+            self.samples.append(self._normalize_stats(stats, first_dim_factor))
+            self.sampling['positions'].append(aligned)
+            self.sampling['simulated iterations'] += \
+                aligned - warmup_start + first_dim_factor*cacheline_iterations + \
+                prefill_cost
+
+    def _sample_mean(self, key):
+        '''Returns mean of normalized stats *key* over all samples, per cache level.'''
+        return [sum(values)/len(values) for values in zip(*[s[key] for s in self.samples])]
+
+    def _sample_statistics(self, key):
+        '''Returns mean, standard deviation and 95% confidence interval of *key* per cache level.'''
+        n = len(self.samples)
+        mean = self._sample_mean(key)
+        stddev = []
+        interval = []
+        for m, values in zip(mean, zip(*[s[key] for s in self.samples])):
+            if n > 1:
+                sd = (sum([(v - m)**2 for v in values])/(n - 1))**0.5
+                half_width = T_QUANTILES_95.get(n - 1, 1.96)*sd/n**0.5
+            else:
+                sd = half_width = 0.0
+            stddev.append(sd)
+            interval.append((m - half_width, m + half_width))
+        return {'mean': mean, 'stddev': stddev, 'confidence interval': interval}
+
+    def _adaptive_warmup_windows(self, max_iteration_count):
+        '''
+        Returns the window length and the number of iterations simulated before the first window
+        of an adaptive warm-up with *max_iteration_count* (see _adaptive_warmup()).
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        elements_per_cacheline = int(self.machine['cacheline size'] // element_size)
+        inner_loop = list(self.kernel.get_loop_stack(subs_consts=True))[-1]
+        cacheline_iterations = int(elements_per_cacheline*inner_loop['increment'])
+        inner_length = int(inner_loop['stop'] - inner_loop['start'])
+        window = -(-1024*(self.set_sampling or 1)//inner_length)*inner_length
+        window = -(-window//cacheline_iterations)*cacheline_iterations
+        window = max(cacheline_iterations, min(
+            window, max_iteration_count//4//cacheline_iterations*cacheline_iterations))
+        return window, min(self._reuse_span(), max(max_iteration_count - 2*window, 0))
+
+    def _adaptive_warmup(self, csim, max_iteration_count, tolerance):
+        '''
+        Simulates warm-up windows, starting at iteration 0, until hits and misses per cache line of
+        work changed by at most *tolerance* (in cache lines) on all cache levels compared to the
+        previous window, or *max_iteration_count* is reached.
+
+        Convergence is only checked after the reuse span of the kernel (see _reuse_span()) was
+        simulated, since cold caches also produce stable, but meaningless, hit and miss rates. A
+        window spans whole inner loops with at least 1024 iterations (times the set sampling
+        ratio), but at most a quarter of *max_iteration_count*, rounded to whole cache lines.
+
+        Returns the number of simulated iterations and a dictionary describing the convergence.
+        '''
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        elements_per_cacheline = int(self.machine['cacheline size'] // element_size)
+        inner_loop = list(self.kernel.get_loop_stack(subs_consts=True))[-1]
+        cacheline_iterations = int(elements_per_cacheline*inner_loop['increment'])
+        window, iteration_count = self._adaptive_warmup_windows(max_iteration_count)
+        cache_levels = len(self.machine['memory hierarchy'][:-1])
+
+        # Cover the reuse span before looking for convergence
+        simulate_offsets(
+            csim,
+            self.kernel.compile_global_offsets(
+                iteration=range(0, iteration_count), chunk_size=OFFSET_CHUNK_SIZE,
+                spacing=self.spacing),
+            length=element_size)
+
+        windows = 0
+        deviation = None
+        last_rates = None
+        while iteration_count + window <= max_iteration_count:
+            csim.reset_stats()
+            simulate_offsets(
+                csim,
+                self.kernel.compile_global_offsets(
+                    iteration=range(iteration_count, iteration_count + window),
+                    chunk_size=OFFSET_CHUNK_SIZE, spacing=self.spacing),
+                length=element_size)
+            iteration_count += window
+            windows += 1
+
+            stats = list(csim.stats())
+            rates = [stats[level][counter]*cacheline_iterations/window
+                     for level in range(cache_levels) for counter in ['HIT_count', 'MISS_count']]
+            if last_rates is not None:
+                deviation = max([abs(a - b) for a, b in zip(rates, last_rates)])
+                if deviation <= tolerance:
+                    break
+            last_rates = rates
+
+        return iteration_count, {'mode': 'adaptive',
+                                 'converged': deviation is not None and deviation <= tolerance,
+                                 'deviation': deviation,
+                                 'tolerance': tolerance,
+                                 'windows': windows}
 
     def get_hits(self):
         '''Returns a list with cache lines of hits per cache level'''
-        return [self.stats[cache_level]['HIT_count']/self.first_dim_factor
-                for cache_level in range(len(self.machine['memory hierarchy'][:-1]))]
+        return self._sample_mean('hits')
 
     def get_misses(self):
         '''Returns a list with cache lines of misses per cache level'''
-        return [self.stats[cache_level]['MISS_count']/self.first_dim_factor
-                for cache_level in range(len(self.machine['memory hierarchy'][:-1]))]
+        return self._sample_mean('misses')
 
     def get_evicts(self):
         '''Returns a list with cache lines of misses per cache level'''
-        return [self.stats[cache_level+1]['STORE_count']/self.first_dim_factor
-                for cache_level in range(len(self.machine['memory hierarchy'][:-1]))]
+        return self._sample_mean('evicts')
 
     def get_infos(self):
         '''Returns verbose information about the predictor'''
         first_dim_factor = self.first_dim_factor
         infos = {'memory hierarchy': [], 'cache stats': self.stats,
-                        'cachelines in stats': first_dim_factor}
+                 'cachelines in stats': first_dim_factor, 'warm-up': self.warmup}
+        mean = {k: self._sample_mean(k) for k in self.samples[0]}
         for cache_level, cache_info in list(enumerate(self.machine['memory hierarchy']))[:-1]:
             infos['memory hierarchy'].append({
                 'index': len(infos['memory hierarchy']),
                 'level': '{}'.format(cache_info['level']),
-                'total misses': self.stats[cache_level]['MISS_byte']/first_dim_factor,
-                'total hits': self.stats[cache_level]['HIT_byte']/first_dim_factor,
-                'total evicts': self.stats[cache_level]['STORE_byte']/first_dim_factor,
-                'total lines misses': self.stats[cache_level]['MISS_count']/first_dim_factor,
-                'total lines hits': self.stats[cache_level]['HIT_count']/first_dim_factor,
-                # FIXME assumption for line evicts: all stores are consecutive
-                'total lines evicts': self.stats[cache_level+1]['STORE_count']/first_dim_factor,
+                'total misses': mean['miss bytes'][cache_level],
+                'total hits': mean['hit bytes'][cache_level],
+                'total evicts': mean['evict bytes'][cache_level],
+                'total lines misses': mean['misses'][cache_level],
+                'total lines hits': mean['hits'][cache_level],
+                'total lines evicts': mean['evicts'][cache_level],
+                'cycles': None})
+        infos['sampling'] = dict(self.sampling)
+        infos['sampling']['samples'] = len(self.samples)
+        for key in ['hits', 'misses', 'evicts']:
+            infos['sampling'][key] = self._sample_statistics(key)
+        if self.set_sampling is not None:
+            simulated, total = self.set_sampling_accesses
+            infos['set sampling'] = {
+                'ratio': self.set_sampling,
+                'groups': len(self.set_sampling_groups),
+                'simulated accesses': simulated,
+                'total accesses': total,
+                'speed-up': total/max(simulated, 1)}
+            # standard error of the mean over groups, in cache lines per cache line of work
+            n = len(self.set_sampling_groups)
+            for key in ['hits', 'misses', 'evicts']:
+                error = []
+                for values in zip(*[g[key] for g in self.set_sampling_groups]):
+                    mean = sum(values)/n
+                    variance = sum([(v - mean)**2 for v in values])/(n - 1) if n > 1 else 0.0
+                    error.append((variance/n)**0.5)
+                infos['set sampling'][key+' error'] = error
+        if self.cores > 1:
+            infos['multi-core'] = self.multi_core
+        if 'prefetches' in self.samples[0]:
+            prefetch_misses = self._sample_mean('prefetch misses')
+            infos['prefetch'] = {
+                'prefetches': self._sample_mean('prefetches'),
+                'prefetch misses': prefetch_misses,
+                'demand misses': [m - p for m, p in zip(self.get_misses(), prefetch_misses)]}
+        infos['arrays'] = self._array_traffic()
+        return infos
+
+
+class ReuseDistancePredictor(CachePredictor):
+    '''
+    Predictor class based on LRU stack (reuse) distances of the kernel's cache line trace.
+
+    Distances are computed once (see stack_distances()), after which hits, misses and evicts of
+    fully associative LRU caches of any size are read off without re-simulation: for all levels
+    of the memory hierarchy, hypothetical cache sizes (get_misses_for_size()) or a whole miss
+    ratio curve (get_miss_ratio_curve()). Conflict misses are not modeled.
+
+    The trace starts with one access per cache line of all arrays, if all data fits into the
+    largest cache (as in CacheSimulationPredictor), followed by all iterations up to the end of
+    the benchmark window.
+    The window starts on the first inner loop after the reuse span (or at iteration *start*, if
+    given) and spans whole inner loops with at least *window* iterations. Since the trace always
+    covers all iterations before the window, a CacheSimulationPredictor's window can be
+    reproduced by passing its start and length, e.g. to compare against its misses.
+
+    Consecutive iterations touching the same cache line with the same access are merged into the
+    last of them, the others are first level hits. This shrinks the trace by about the number of
+    elements per cache line, but may underestimate distances by up to the number of accesses per
+    iteration.
+
+    *spacing* is the number of bytes of padding between arrays (see
+    Kernel.compile_global_offsets()).
+    '''
+    def __init__(self, kernel, machine, window=1024, spacing=0, start=None):
+        CachePredictor.__init__(self, kernel, machine)
+        self.spacing = spacing
+
+        # FIXME handle multiple datatypes
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        cacheline_size = int(self.machine['cacheline size'])
+        cl_bits = cacheline_size.bit_length() - 1
+        elements_per_cacheline = cacheline_size // element_size
+        inner_loop = list(self.kernel.get_loop_stack(subs_consts=True))[-1]
+        inner_length = int(inner_loop['stop'] - inner_loop['start'])
+        cacheline_iterations = int(elements_per_cacheline*inner_loop['increment'])
+        iteration_length = int(self.kernel.iteration_length())
+
+        # Cache sizes in cache lines
+        self.cacheline_size = cacheline_size
+        self.cache_levels = [(c.name, c.size()//cacheline_size)
+                             for c in self.machine.get_cachesim().levels(with_mem=False)]
+        max_cache_size = max([size for name, size in self.cache_levels])*cacheline_size
+        max_array_size = max(self.kernel.array_sizes(in_bytes=True, subs_consts=True).values())
+
+        # Benchmark window
+        if start is None:
+            start = min(-(-self._reuse_span()//inner_length)*inner_length,
+                        iteration_length - inner_length)
+        aligned = self._align_iteration(start)
+        if aligned < start:
+            aligned += cacheline_iterations
+        start = int(aligned)
+        end, self.first_dim_factor = self._benchmark_window(
+            start, -(-window//cacheline_iterations))
+        self.window = (start, end)
+
+        # Cache line trace
+        lines, is_store, in_window = [], [], []
+        if max_array_size < max_cache_size:
+            # Full caching possible, bring all arrays into the caches before
+            for loads, stores in self._prefill_offsets():
+                lines.append(numpy.hstack([loads, stores]).ravel() >> cl_bits)
+                is_store.append(numpy.full(len(lines[-1]), stores.shape[1] > 0, dtype=bool))
+                in_window.append(numpy.zeros(len(lines[-1]), dtype=bool))
+        self.merged_loads = self.merged_stores = 0
+        position = 0
+        for loads, stores in self.kernel.compile_global_offsets(
+                iteration=range(0, end), chunk_size=OFFSET_CHUNK_SIZE, spacing=self.spacing):
+            chunk_lines = numpy.hstack([loads, stores]) >> cl_bits
+            chunk_window = numpy.arange(position, position + len(chunk_lines)) >= start
+            position += len(chunk_lines)
+            # merge runs of the same cache line per access
+            keep = numpy.ones(chunk_lines.shape, dtype=bool)
+            keep[:-1] = chunk_lines[:-1] != chunk_lines[1:]
+            merged = ~keep[chunk_window]
+            self.merged_loads += int(numpy.count_nonzero(merged[:, :loads.shape[1]]))
+            self.merged_stores += int(numpy.count_nonzero(merged[:, loads.shape[1]:]))
+            lines.append(chunk_lines[keep])
+            is_store.append(numpy.broadcast_to(
+                numpy.arange(chunk_lines.shape[1]) >= loads.shape[1], keep.shape)[keep])
+            in_window.append(numpy.broadcast_to(chunk_window[:, None], keep.shape)[keep])
+        lines = numpy.concatenate(lines)
+        is_store = numpy.concatenate(is_store)
+        in_window = numpy.concatenate(in_window)
+
+        infinity = numpy.iinfo('int64').max
+        distances = stack_distances(lines)
+        distances[distances < 0] = infinity
+        self.trace_length = len(lines)
+        self.distances = numpy.sort(distances[in_window])
+        self.load_distances = numpy.sort(distances[in_window & ~is_store])
+
+        # Distance of the next access to the same line, per line in access order (for evicts)
+        order = numpy.argsort(lines, kind='mergesort')
+        next_distances = numpy.full(len(lines), infinity, dtype='int64')
+        same = lines[order[1:]] == lines[order[:-1]]
+        next_distances[order[:-1][same]] = distances[order[1:][same]]
+        self._next_distances = next_distances[order]
+        self._is_store = is_store[order]
+        self._in_window = in_window[order]
+
+        self.results = self._predict([size for name, size in self.cache_levels])
+
+    def _count_misses(self, size, distances=None):
+        '''
+        Returns the number of window accesses (or those with sorted *distances*) missing a cache
+        of *size* cache lines.
+        '''
+        if distances is None:
+            distances = self.distances
+        return len(distances) - int(numpy.searchsorted(distances, size, side='left'))
+
+    def _count_evicts(self, size):
+        '''Returns the number of dirty lines evicted from a cache of *size* cache lines.'''
+        # a line is evicted, if the next access to it has a distance of at least size
+        evicted = self._next_distances >= size
+        # accesses of one line between two evictions, dirty if any of them is a store
+        residency = numpy.concatenate([[0], numpy.cumsum(evicted)[:-1]])
+        dirty = numpy.bincount(residency, weights=self._is_store) > 0
+        return int(numpy.count_nonzero(evicted & self._in_window & dirty[residency]))
+
+    def _predict(self, sizes):
+        '''Returns hits, misses and evicts per cache line of work for caches of *sizes* lines.'''
+        results = {'hits': [], 'misses': [], 'evicts': []}
+        requests = None
+        for size in sizes:
+            misses = self._count_misses(size)
+            if requests is None:
+                # stores are only counted as misses on the first level (as in pycachesim)
+                hits = len(self.load_distances) + self.merged_loads - \
+                    self._count_misses(size, self.load_distances)
+            else:
+                hits = requests - misses
+            results['hits'].append(hits/self.first_dim_factor)
+            results['misses'].append(misses/self.first_dim_factor)
+            results['evicts'].append(self._count_evicts(size)/self.first_dim_factor)
+            requests = misses
+        return results
+
+    def get_misses_for_size(self, size):
+        '''
+        Returns cache lines of misses per cache line of work in a fully associative LRU cache of
+        *size* bytes.
+        '''
+        return self._count_misses(int(size)//self.cacheline_size)/self.first_dim_factor
+
+    def get_miss_ratio_curve(self, sizes=None):
+        '''
+        Returns a list of (cache size in bytes, miss ratio) tuples, with the miss ratio being the
+        fraction of all accesses missing a fully associative LRU cache of that size.
+
+        By default, sizes are powers of two from one cache line up to the size without any
+        capacity misses (at least the largest cache level).
+        '''
+        if sizes is None:
+            finite = self.distances[self.distances < numpy.iinfo('int64').max]
+            max_size = max([int(finite[-1]) + 1 if len(finite) else 1] +
+                           [size for name, size in self.cache_levels])
+            sizes = [self.cacheline_size << e for e in range(max_size.bit_length() + 1)]
+        accesses = len(self.distances) + self.merged_loads + self.merged_stores
+        return [(size, self._count_misses(int(size)//self.cacheline_size)/max(accesses, 1))
+                for size in sizes]
+
+    def get_hits(self):
+        '''Returns a list with cache lines of hits per cache level'''
+        return self.results['hits']
+
+    def get_misses(self):
+        '''Returns a list with cache lines of misses per cache level'''
+        return self.results['misses']
+
+    def get_evicts(self):
+        '''Returns a list with cache lines of misses per cache level'''
+        return self.results['evicts']
+
+    def get_infos(self):
+        '''Returns verbose information about the predictor'''
+        infos = {'memory hierarchy': [], 'cachelines in stats': self.first_dim_factor,
+                 'window': self.window,
+                 'trace': {'accesses': self.trace_length,
+                           'window accesses': len(self.distances) + self.merged_loads +
+                                              self.merged_stores,
+                           'merged accesses': self.merged_loads + self.merged_stores},
+                 'miss ratio curve': self.get_miss_ratio_curve()}
+        for cache_level, (name, size) in enumerate(self.cache_levels):
+            infos['memory hierarchy'].append({
+                'index': cache_level,
+                'level': name,
+                'size': size*self.cacheline_size,
+                'total misses': self.results['misses'][cache_level]*self.cacheline_size,
+                'total hits': self.results['hits'][cache_level]*self.cacheline_size,
+                'total evicts': self.results['evicts'][cache_level]*self.cacheline_size,
+                'total lines misses': self.results['misses'][cache_level],
+                'total lines hits': self.results['hits'][cache_level],
+                'total lines evicts': self.results['evicts'][cache_level],
                 'cycles': None})
         return infos
+
+
+class AutomaticPredictor(CachePredictor):
+    '''
+    Predictor class using layer conditions wherever they apply, and cache simulation otherwise.
+
+    Layer conditions are used for every cache level, unless
+     * they can not be applied on the kernel at all (see LayerConditionPredictor._check_kernel()),
+     * the level is shared by several of *cores* (layer conditions assume a single core),
+     * all arrays together fit into the level, so there is reuse across kernel invocations, or
+     * the level's layer condition is only just met, with the requirement above (1 - *margin*)
+       of the cache size, where associativity makes the LRU assumption unreliable.
+
+    The remaining levels are taken from a CacheSimulationPredictor, constructed with
+    *simulation_options*, which is only run if needed.
+    '''
+    def __init__(self, kernel, machine, margin=0.1, **simulation_options):
+        CachePredictor.__init__(self, kernel, machine)
+        self.margin = margin
+        cores = simulation_options.get('cores', 1)
+
+        self.layer_conditions = None
+        reason = None
+        try:
+            self.layer_conditions = LayerConditionPredictor(kernel, machine)
+        except ValueError as e:
+            reason = str(e)
+
+        caches = list(self.machine.get_cachesim().levels(with_mem=False))
+        total_array_size = sum(self.kernel.array_sizes(in_bytes=True, subs_consts=True).values())
+        self.engines = []
+        for level, c in enumerate(caches):
+            level_reason = reason
+            if reason is None:
+                requirement = self.layer_conditions.results['cache'][level]['requirement']
+                if cores > 1 and self.machine['memory hierarchy'][level].get(
+                        'cores per group', 1) > 1:
+                    level_reason = "Level is shared by multiple cores."
+                elif total_array_size <= c.size():
+                    level_reason = "All arrays fit into the cache."
+                elif requirement is not None and \
+                        requirement <= c.size() and requirement > (1 - margin)*c.size():
+                    level_reason = "Layer condition is met by less than {:.0%} of the cache " \
+                                   "size.".format(margin)
+            self.engines.append({'level': c.name,
+                                 'engine': 'LC' if level_reason is None else 'SIM',
+                                 'reason': level_reason})
+
+        self.simulation = None
+        if any([e['engine'] == 'SIM' for e in self.engines]):
+            self.simulation = CacheSimulationPredictor(kernel, machine, **simulation_options)
+
+    def _combine(self, getter):
+        '''Returns per level results of *getter* from the engine selected for each level.'''
+        return [getter(self.layer_conditions if e['engine'] == 'LC' else self.simulation)[level]
+                for level, e in enumerate(self.engines)]
+
+    def get_hits(self):
+        '''Returns a list with cache lines of hits per cache level'''
+        return self._combine(lambda p: p.get_hits())
+
+    def get_misses(self):
+        '''Returns a list with cache lines of misses per cache level'''
+        return self._combine(lambda p: p.get_misses())
+
+    def get_evicts(self):
+        '''Returns a list with cache lines of evicts per cache level'''
+        return self._combine(lambda p: p.get_evicts())
+
+    def get_infos(self):
+        '''Returns verbose information about the predictor'''
+        infos = {'engines': self.engines,
+                 'layer conditions': self.layer_conditions.get_infos()
+                 if self.layer_conditions is not None else None,
+                 'simulation': self.simulation.get_infos()
+                 if self.simulation is not None else None,
+                 'arrays': None}
+        # Traffic per array, from the engine selected for each level
+        engine_arrays = {'LC': (infos['layer conditions'] or {}).get('arrays'),
+                         'SIM': (infos['simulation'] or {}).get('arrays')}
+        if all([engine_arrays[e['engine']] is not None for e in self.engines]):
+            names = set(chain(*[a.keys() for a in engine_arrays.values() if a is not None]))
+            infos['arrays'] = {
+                name: {key: [engine_arrays[e['engine']][name][key][level]
+                             for level, e in enumerate(self.engines)]
+                       for key in ['hits', 'misses', 'evicts']}
+                for name in names}
+        return infos
+
+
+class StoredPrediction(CachePredictor):
+    '''Serves the results of a cache predictor, as loaded from a PredictionStore.'''
+    def __init__(self, kernel, machine, prediction):
+        CachePredictor.__init__(self, kernel, machine)
+        self.prediction = prediction
+
+    def get_hits(self):
+        '''Returns a list with cache lines of hits per cache level'''
+        return self.prediction['hits']
+
+    def get_misses(self):
+        '''Returns a list with cache lines of misses per cache level'''
+        return self.prediction['misses']
+
+    def get_evicts(self):
+        '''Returns a list with cache lines of evicts per cache level'''
+        return self.prediction['evicts']
+
+    def get_infos(self):
+        '''Returns verbose information about the predictor'''
+        return self.prediction['infos']
+
+
+class PredictionStore(DiskCache):
+    '''
+    Content-addressed on-disk cache of cache predictor results (see DiskCache).
+
+    Results are stored as one pickle file per key in *path*. Keys hash the kernel accesses and loop
+    stack, the constants, the predictor and its options, the caches of the machine and the source
+    code of the modules computing the prediction, so changes to any of them lead to a new
+    prediction.
+    '''
+    name = 'predictions'
+    # Needs to be increased whenever the format of stored results changes
+    version = 4
+
+    # Source digest per module file name
+    _source_digests = {}
+
+    def __init__(self, path, max_size=256*1024**2, refresh=False):
+        DiskCache.__init__(self, path, max_size=max_size, refresh=refresh)
+
+    @classmethod
+    def source_digest(cls, module):
+        '''Returns the hex digest of the source file of *module*.'''
+        filename = inspect.getsourcefile(module)
+        if filename not in cls._source_digests:
+            with open(filename, 'rb') as f:
+                cls._source_digests[filename] = hashlib.sha256(f.read()).hexdigest()
+        return cls._source_digests[filename]
+
+    def key(self, kernel, machine, predictor_class, options):
+        '''Returns the hex digest addressing the prediction for the given inputs.'''
+        caches = [(c['level'], sorted([(str(k), str(v)) for k, v in c['cache per group'].items()]),
+                   sorted([(str(k), str(v)) for k, v in c.get('prefetchers', {}).items()]))
+                  for c in machine['memory hierarchy'] if c.get('cache per group')]
+        # predictors, offset generation and cache simulator construction
+        modules = [inspect.getmodule(predictor_class), inspect.getmodule(type(kernel)),
+                   inspect.getmodule(type(machine))]
+        return self.hash_key(
+            sorted(set([self.source_digest(m) for m in modules])),
+            kernel.access_description(),
+            sorted([(str(k), int(v)) for k, v in kernel.constants.items()]),
+            predictor_class.__name__,
+            sorted([(str(k), str(v)) for k, v in options.items()]),
+            str(machine['cacheline size']),
+            caches)
+
+    def load(self, key):
+        '''Returns the stored prediction for *key*, None if there is none or on refresh.'''
+        data = self.read(key)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # Corrupted or incompatible file, will be replaced by the next store()
+            return None
+
+    def store(self, key, predictor):
+        '''Stores the results of *predictor* under *key* and evicts old results if needed.'''
+        prediction = {'hits': predictor.get_hits(),
+                      'misses': predictor.get_misses(),
+                      'evicts': predictor.get_evicts(),
+                      'infos': predictor.get_infos()}
+        self.write(key, pickle.dumps(prediction, protocol=2))
+
+
+class PredictorCache(object):
+    '''
+    Shares cache predictors between models.
+
+    If passed to get_predictor() (kerncraft.run hands one to all models of a define point), the
+    same predictor is returned for the same kernel, constants, machine and predictor
+    configuration, so, e.g., ECM, ECMData and Roofline are all served by a single cache
+    simulation. Used as a context manager, predictors are released on exit.
+
+    If a PredictionStore is given as *store*, predictions are also loaded from and saved to disk.
+
+    If the constants of all define points are given as *points*, predictors able to evaluate a
+    whole sweep at once (i.e., ParametricLayerConditionPredictor) are constructed once with them
+    and kept across define points, so the cache can be entered again for each point.
+    '''
+    def __init__(self, store=None, points=None):
+        self.predictors = {}
+        self.store = store
+        self.points = points
+        self.sweep_predictors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.predictors.clear()
+
+    def get(self, key, predictor_class, *args, **kwargs):
+        '''Returns the predictor stored under *key*, constructing it with the arguments if new.'''
+        if key not in self.predictors:
+            self.predictors[key] = predictor_class(*args, **kwargs)
+        return self.predictors[key]
+
+    def get_sweep(self, key, predictor_class, *args, **kwargs):
+        '''
+        Returns the predictor serving all points stored under *key*, constructing it with the
+        arguments and the points if new.
+        '''
+        if key not in self.sweep_predictors:
+            self.sweep_predictors[key] = predictor_class(*args, points=self.points, **kwargs)
+        return self.sweep_predictors[key]
+
+
+def print_array_traffic(arrays, machine, output_file=sys.stdout):
+    '''
+    Prints hits, misses and evicts per cache level of each array, as reported under 'arrays' in
+    the infos of LayerConditionPredictor and CacheSimulationPredictor.
+    '''
+    print('Traffic per array (cache lines per cache line of work):', file=output_file)
+    print('  array |  level |    hits |  misses |  evicts', file=output_file)
+    print('--------+--------+---------+---------+--------', file=output_file)
+    for name in sorted(arrays):
+        for level, cache_info in enumerate(machine['memory hierarchy'][:-1]):
+            print('{:>7} | {:>6} | {:>7.2f} | {:>7.2f} | {:>7.2f}'.format(
+                      name, cache_info['level'], arrays[name]['hits'][level],
+                      arrays[name]['misses'][level], arrays[name]['evicts'][level]),
+                  file=output_file)
+    print('', file=output_file)
+
+
+def print_prefetch_traffic(prefetch, machine, output_file=sys.stdout):
+    '''
+    Prints demand and prefetch misses per cache level, as reported under 'prefetch' in the infos
+    of CacheSimulationPredictor.
+    '''
+    print('Prefetch traffic (cache lines per cache line of work):', file=output_file)
+    print(' level | prefetches | demand misses | prefetch misses', file=output_file)
+    print('-------+------------+---------------+----------------', file=output_file)
+    for level, cache_info in enumerate(machine['memory hierarchy'][:-1]):
+        print('{:>6} | {:>10.2f} | {:>13.2f} | {:>15.2f}'.format(
+                  cache_info['level'], prefetch['prefetches'][level],
+                  prefetch['demand misses'][level], prefetch['prefetch misses'][level]),
+              file=output_file)
+    print('', file=output_file)
+
+
+def print_layer_condition_transitions(transitions, machine, output_file=sys.stdout):
+    '''
+    Prints the values of each swept constant from which on the hits of a cache level change, as
+    reported under 'transitions' in the infos of ParametricLayerConditionPredictor.
+    '''
+    print('Layer condition transitions:', file=output_file)
+    print(' constant |  level |     from on |  hits', file=output_file)
+    print('----------+--------+-------------+-------', file=output_file)
+    for name in sorted(transitions):
+        for level, cache_info in enumerate(machine['memory hierarchy'][:-1]):
+            for value, hits_before, hits_after in transitions[name][level]:
+                print('{:>9} | {:>6} | {:>11} | {:>2} -> {}'.format(
+                          name, cache_info['level'], value, hits_before, hits_after),
+                      file=output_file)
+    print('', file=output_file)
+
+
+def get_predictor(kernel, machine, args, cache=None, predictor_name=None, **predictor_options):
+    '''
+    Returns the cache predictor selected by the command line *args* (--cache-predictor and its
+    options), shared with other models through the PredictorCache *cache*, if given.
+
+    *predictor_name* (e.g. 'RD') replaces --cache-predictor, further keyword arguments (e.g.
+    spacing) are passed on to the predictor.
+    '''
+    predictor_name = predictor_name or args.cache_predictor
+    options = {}
+    if predictor_name == 'SIM':
+        predictor_class = CacheSimulationPredictor
+        options = {'samples': args.cache_sim_samples, 'budget': args.cache_sim_budget,
+                   'warmup': args.cache_sim_warmup, 'reuse_results': args.cache_sim_reuse,
+                   'cores': args.cores}
+    elif predictor_name == 'SSIM':
+        predictor_class = CacheSimulationPredictor
+        options = {'samples': args.cache_sim_samples, 'budget': args.cache_sim_budget,
+                   'warmup': args.cache_sim_warmup, 'reuse_results': args.cache_sim_reuse,
+                   'set_sampling': args.cache_sim_set_ratio or 'auto'}
+    elif predictor_name == 'RD':
+        predictor_class = ReuseDistancePredictor
+    elif predictor_name == 'LC':
+        predictor_class = LayerConditionPredictor
+    elif predictor_name == 'PLC':
+        predictor_class = ParametricLayerConditionPredictor
+    elif predictor_name == 'auto':
+        predictor_class = AutomaticPredictor
+        options = {'samples': args.cache_sim_samples, 'budget': args.cache_sim_budget,
+                   'warmup': args.cache_sim_warmup, 'reuse_results': args.cache_sim_reuse,
+                   'cores': args.cores}
+    else:
+        raise NotImplementedError("Unknown cache predictor, only LC (layer condition), PLC "
+                                  "(parametric layer condition), SIM (cache simulation with "
+                                  "pycachesim), SSIM (set-sampled cache simulation), RD "
+                                  "(reuse distances) and auto (LC where applicable, SIM "
+                                  "otherwise) are supported.")
+    options.update(predictor_options)
+
+    if cache is None:
+        return predictor_class(kernel, machine, **options)
+    if predictor_class is ParametricLayerConditionPredictor and cache.points is not None:
+        # All define points are evaluated at once, which is cheaper than loading them from disk
+        return cache.get_sweep((kernel, machine, predictor_class, tuple(sorted(options.items()))),
+                               predictor_class, kernel, machine, **options)
+    key = (kernel, tuple(sorted([(str(k), v) for k, v in kernel.constants.items()])), machine,
+           predictor_class, tuple(sorted(options.items())))
+    if cache.store is None or key in cache.predictors:
+        return cache.get(key, predictor_class, kernel, machine, **options)
+
+    store_key = cache.store.key(kernel, machine, predictor_class, options)
+    prediction = cache.store.load(store_key)
+    if prediction is not None:
+        return cache.get(key, StoredPrediction, kernel, machine, prediction)
+    predictor = cache.get(key, predictor_class, kernel, machine, **options)
+    cache.store.store(store_key, predictor)
+    return predictor
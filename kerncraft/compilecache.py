@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+'''Content-addressed cache of compiled, assembled and built kernel artifacts.'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import pickle
+import subprocess
+
+from .diskcache import DiskCache
+
+
+# Version output per compiler, compilers are only asked once per run
+_compiler_versions = {}
+
+
+def compiler_version(compiler):
+    '''Returns the output of "*compiler* --version", empty if it can not be determined.'''
+    if compiler not in _compiler_versions:
+        try:
+            _compiler_versions[compiler] = subprocess.check_output(
+                [compiler, '--version'], stderr=subprocess.STDOUT).decode('utf-8').strip()
+        except (OSError, subprocess.CalledProcessError):
+            _compiler_versions[compiler] = ''
+    return _compiler_versions[compiler]
+
+
+class CompileCache(DiskCache):
+    '''
+    Content-addressed on-disk cache of the files produced by KernelCode.compile(), assemble() and
+    build() (see DiskCache).
+
+    Artifacts of one step are stored as one pickle file per key in *path*. Keys hash the step, its
+    input (generated source or marked assembly), the compiler, its version and the flags. Since
+    constants are passed at runtime, all define points of a sweep share the same artifacts.
+    '''
+    name = 'compile'
+    # Needs to be increased whenever the way kernels are compiled changes
+    version = 1
+
+    def key(self, step, content, compiler, flags=None):
+        '''Returns the hex digest addressing the artifacts of *step* for the given inputs.'''
+        return self.hash_key(step, content, compiler, compiler_version(compiler),
+                             list(flags or []))
+
+    def load(self, key, files):
+        '''
+        Writes the artifacts stored under *key* to the files given by name in *files* and returns
+        True, or False if there are none or on refresh.
+        '''
+        data = self.read(key)
+        if data is None:
+            return False
+        try:
+            artifacts = pickle.loads(data)
+        except Exception:
+            # Corrupted or incompatible file, will be replaced by the next store()
+            return False
+        if set(artifacts) != set(files):
+            return False
+        for name, (content, mode) in artifacts.items():
+            with open(files[name], 'wb') as f:
+                f.write(content)
+            os.chmod(files[name], mode)
+        return True
+
+    def store(self, key, files):
+        '''Stores the files given by name in *files* under *key* and evicts old artifacts.'''
+        artifacts = {}
+        for name, filename in files.items():
+            with open(filename, 'rb') as f:
+                artifacts[name] = (f.read(), os.stat(filename).st_mode & 0o777)
+        self.write(key, pickle.dumps(artifacts, protocol=2))
+
+
+def get_compile_cache(args):
+    '''Returns the CompileCache selected by the command line *args*, None if bypassed.'''
+    if args is None or args.compile_cache == 'bypass':
+        return None
+    return CompileCache(args.compile_cache_dir or CompileCache.default_path(),
+                        max_size=args.compile_cache_size*1024**2,
+                        refresh=args.compile_cache == 'refresh')
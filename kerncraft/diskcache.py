@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+'''Content-addressed on-disk cache, shared by the stores of predictions, analyses and builds.'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import hashlib
+import tempfile
+
+
+class DiskCache(object):
+    '''
+    Content-addressed on-disk cache.
+
+    Entries are stored as one file per key in *path*, with keys being hex digests of their inputs
+    (see hash_key()). Entries are written to a temporary file first and renamed, so concurrent
+    runs never read partial entries. Once the files take more than *max_size* bytes, least
+    recently used entries are deleted. With *refresh*, stored entries are not used, but replaced
+    by new ones.
+
+    Subclasses set *name* (the subdirectory of the default location), *suffix* of the entry files
+    and *version*.
+    '''
+    name = None
+    suffix = '.pickle'
+    # Needs to be increased by subclasses whenever the format of stored entries changes
+    version = 1
+
+    def __init__(self, path, max_size=128*1024**2, refresh=False):
+        self.path = path
+        self.max_size = max_size
+        self.refresh = refresh
+
+    @classmethod
+    def default_path(cls):
+        '''Returns the default location of the cache, below $XDG_CACHE_HOME or ~/.cache.'''
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        return os.path.join(cache_home, 'kerncraft', cls.name)
+
+    def hash_key(self, *content):
+        '''Returns the hex digest of *content* (which needs a stable repr) and the version.'''
+        content = repr([self.version] + list(content))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def read(self, key):
+        '''Returns the bytes stored under *key*, None if there are none or on refresh.'''
+        if self.refresh:
+            return None
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # Update modification time, which is used for least recently used eviction
+            os.utime(filename, None)
+        except (IOError, OSError):
+            # Missing or just evicted by a concurrent run
+            return None
+        return data
+
+    def write(self, key, data):
+        '''Stores the bytes *data* under *key* and evicts old entries if needed.'''
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_filename, self._filename(key))
+        self.evict()
+
+    def evict(self):
+        '''Deletes least recently used entries until the cache is not larger than max_size.'''
+        files = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                # already removed by a concurrent run
+                continue
+            files.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum([f[1] for f in files])
+        for mtime, size, name in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                # already removed by a concurrent run
+                pass
+            total_size -= size
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+'''Runs IACA on marked binaries and caches its analyses by the marked assembly block.'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import re
+import sys
+import subprocess
+from distutils.spawn import find_executable
+
+from .diskcache import DiskCache
+
+
+class IACAStore(DiskCache):
+    '''
+    Content-addressed on-disk cache of IACA outputs (see DiskCache).
+
+    Outputs are stored as one text file per key in *path*. Keys hash the marked assembly block,
+    the micro-architecture and the analysis type, so a kernel only needs to be analyzed again if
+    the compiler produced a different loop body.
+    '''
+    name = 'iaca'
+    suffix = '.txt'
+    # Needs to be increased whenever the way IACA is invoked changes
+    version = 1
+
+    def __init__(self, path, max_size=16*1024**2, refresh=False):
+        DiskCache.__init__(self, path, max_size=max_size, refresh=refresh)
+
+    def key(self, asm_lines, micro_architecture, analysis):
+        '''Returns the hex digest addressing the analysis of the given assembly block.'''
+        return self.hash_key([l.strip() for l in asm_lines], micro_architecture, analysis)
+
+    def load(self, key):
+        '''Returns the stored output for *key*, None if there is none or on refresh.'''
+        data = self.read(key)
+        if data is None:
+            return None
+        return data.decode('utf-8')
+
+    def store(self, key, output):
+        '''Stores IACA *output* under *key* and evicts old outputs if needed.'''
+        self.write(key, output.encode('utf-8'))
+
+
+def get_store(args):
+    '''Returns the IACAStore selected by the command line *args*, None if bypassed.'''
+    if args is None or args.iaca_cache == 'bypass':
+        return None
+    return IACAStore(args.iaca_cache_dir or IACAStore.default_path(),
+                     max_size=args.iaca_cache_size*1024**2,
+                     refresh=args.iaca_cache == 'refresh')
+
+
+def run_iaca(bin_name, micro_architecture, analysis='THROUGHPUT', verbose=0):
+    '''Runs iaca.sh with *analysis* (THROUGHPUT or LATENCY) on *bin_name* and returns its output.'''
+    # Making sure iaca.sh is available:
+    if find_executable('iaca.sh') is None:
+        print("iaca.sh was not found. Make sure it is found in PATH.", file=sys.stderr)
+        sys.exit(1)
+
+    cmd = ['iaca.sh', '-64']
+    if analysis != 'THROUGHPUT':
+        cmd += ['-analysis', analysis]
+    cmd += ['-arch', micro_architecture, bin_name]
+    try:
+        if verbose >= 3:
+            print('Executing:', ' '.join(cmd))
+        return subprocess.check_output(cmd).decode('utf-8')
+    except OSError as e:
+        print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print("IACA {} analysis failed:".format(analysis.lower()), e, file=sys.stderr)
+        sys.exit(1)
+
+
+def parse_throughput(iaca_output):
+    '''Returns block throughput, cycles per port and uops from an IACA throughput analysis.'''
+    # Get total cycles per loop iteration
+    match = re.search(
+        r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
+    assert match, "Could not find Block Throughput in IACA output."
+    block_throughput = float(match.groups()[0])
+
+    # Find ports and cyles per port
+    ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
+    cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
+    assert ports and cycles, "Could not find ports/cylces lines in IACA output."
+    ports = [p.strip() for p in ports[0].split('|')][2:]
+    cycles = [c.strip() for c in cycles[0].split('|')][2:]
+    port_cycles = []
+    for i in range(len(ports)):
+        if '-' in ports[i] and ' ' in cycles[i]:
+            subports = [p.strip() for p in ports[i].split('-')]
+            subcycles = [c for c in cycles[i].split(' ') if bool(c)]
+            port_cycles.append((subports[0], float(subcycles[0])))
+            port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
+        elif ports[i] and cycles[i]:
+            port_cycles.append((ports[i], float(cycles[i])))
+    port_cycles = dict(port_cycles)
+
+    match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
+    assert match, "Could not find Uops in IACA output."
+    uops = float(match.groups()[0])
+
+    return block_throughput, port_cycles, uops
+
+
+def parse_latency(iaca_latency_output):
+    '''Returns block latency from an IACA latency analysis.'''
+    match = re.search(
+        r'^Latency: ([0-9\.]+) Cycles', iaca_latency_output, re.MULTILINE)
+    assert match, "Could not find Latency in IACA latency analysis output."
+    return float(match.groups()[0])
+
+
+def analyze(kernel, machine, bin_name, args=None):
+    '''
+    Returns IACA throughput and latency analysis of the block marked in *bin_name* (see
+    KernelCode.assemble()), taken from the IACAStore selected by *args* if analyzed before.
+
+    The result is a dictionary with 'block throughput', 'block latency', 'port cycles' and 'uops'
+    per block iteration, and the raw 'IACA output' and 'IACA latency output'.
+    '''
+    store = get_store(args)
+    verbose = args.verbose if args else 0
+    outputs = {}
+    for analysis in ['THROUGHPUT', 'LATENCY']:
+        key = None
+        if store is not None:
+            key = store.key(kernel.asm_block['lines'], machine['micro-architecture'], analysis)
+            outputs[analysis] = store.load(key)
+        if outputs.get(analysis) is None:
+            outputs[analysis] = run_iaca(
+                bin_name, machine['micro-architecture'], analysis, verbose=verbose)
+            if store is not None:
+                store.store(key, outputs[analysis])
+
+    block_throughput, port_cycles, uops = parse_throughput(outputs['THROUGHPUT'])
+    return {'block throughput': block_throughput,
+            'block latency': parse_latency(outputs['LATENCY']),
+            'port cycles': port_cycles,
+            'uops': uops,
+            'IACA output': outputs['THROUGHPUT'],
+            'IACA latency output': outputs['LATENCY']}
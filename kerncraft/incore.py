@@ -0,0 +1,533 @@
+#!/usr/bin/env python
+'''In-core analysis backends and a built-in port pressure analysis of marked assembly blocks.'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import re
+import sys
+from collections import OrderedDict
+from distutils.spawn import find_executable
+
+import ruamel.yaml
+
+from kerncraft import iaca
+
+
+# Loaded instruction tables per micro-architecture
+_instruction_tables = {}
+
+
+def instruction_table_path(micro_architecture):
+    '''Returns the location of the instruction table shipped for *micro_architecture*.'''
+    return os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))),
+                        'instruction_tables', micro_architecture + '.yaml')
+
+
+def load_instruction_table(micro_architecture):
+    '''Returns the instruction table for *micro_architecture* (see instruction_tables/HSW.yaml).'''
+    if micro_architecture not in _instruction_tables:
+        path = instruction_table_path(micro_architecture)
+        if not os.path.exists(path):
+            print("No instruction table found for micro-architecture {!r}, the built-in in-core "
+                  "model supports: {}".format(micro_architecture,
+                                             ', '.join(supported_micro_architectures())),
+                  file=sys.stderr)
+            sys.exit(1)
+        with open(path, 'r') as f:
+            _instruction_tables[micro_architecture] = ruamel.yaml.load(
+                f, Loader=ruamel.yaml.Loader)
+    return _instruction_tables[micro_architecture]
+
+
+def supported_micro_architectures():
+    '''Returns the micro-architectures with a shipped instruction table.'''
+    path = os.path.dirname(instruction_table_path(''))
+    return sorted([os.path.splitext(f)[0] for f in os.listdir(path) if f.endswith('.yaml')])
+
+
+def _split_operands(operands):
+    '''Splits AT&T operands at commas which are not within an address.'''
+    parts = []
+    depth = 0
+    current = ''
+    for c in operands:
+        if c == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        current += c
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def register_name(register):
+    '''
+    Returns the architectural register *register* (without %) belongs to, so that partial
+    registers depend on each other (e.g. eax -> rax, ymm3 -> xmm3).
+    '''
+    register = register.lower()
+    m = re.match(r'^[xyz]mm([0-9]+)$', register)
+    if m:
+        return 'xmm' + m.group(1)
+    m = re.match(r'^r([0-9]+)[dwb]?$', register)
+    if m:
+        return 'r' + m.group(1)
+    m = re.match(r'^[re]?([abcd])[xlh]$', register)
+    if m:
+        return 'r' + m.group(1) + 'x'
+    m = re.match(r'^[re]?(si|di|sp|bp)l?$', register)
+    if m:
+        return 'r' + m.group(1)
+    return register
+
+
+def parse_instruction(line):
+    '''
+    Returns a dictionary with 'mnemonic' and 'operands' of an AT&T assembly line, None for
+    labels, directives and empty lines.
+
+    Operands are dictionaries with 'type' ('register', 'immediate' or 'memory'), the 'text' and
+    the 'registers' referenced (for memory operands the address registers).
+    '''
+    line = line.split('#')[0].strip()
+    if not line or line.startswith('.') or re.match(r'^\S+:', line):
+        return None
+    parts = line.split(None, 1)
+    mnemonic = parts[0].lower()
+    operands = []
+    for text in _split_operands(parts[1]) if len(parts) > 1 else []:
+        if text.startswith('$'):
+            operands.append({'type': 'immediate', 'text': text, 'registers': []})
+        elif text.startswith('%'):
+            operands.append({'type': 'register', 'text': text, 'registers': [text[1:].lower()]})
+        else:
+            operands.append({'type': 'memory', 'text': text,
+                             'registers': [r.lower() for r in re.findall(r'%(\w+)', text)]})
+    return {'line': line, 'mnemonic': mnemonic, 'operands': operands}
+
+
+def _operand_width(instruction):
+    '''Returns 'zmm', 'ymm' or 'xmm' for the widest vector register used, else None.'''
+    registers = [r for o in instruction['operands'] for r in o['registers']]
+    for width in ['zmm', 'ymm', 'xmm']:
+        if any([r.startswith(width) for r in registers]):
+            return width
+    return None
+
+
+def _lookup(table, keys):
+    for key in keys:
+        if key in table:
+            return table[key]
+    return None
+
+
+def lookup_instruction(instruction, table):
+    '''Returns the table entry of *instruction*, None if it is not in *table*.'''
+    mnemonic = instruction['mnemonic']
+    if mnemonic.startswith('j') and mnemonic != 'jmp':
+        mnemonic = 'jcc'
+    # FMA operand order does not change port usage or latency
+    mnemonic = re.sub(r'^(vf(?:n)?m(?:add|sub)(?:sub|add)?)(?:132|213|231)', r'\1', mnemonic)
+    width = _operand_width(instruction)
+    keys = []
+    for m in [mnemonic] + ([mnemonic[:-1]] if mnemonic[-1] in 'bwlq' else []):
+        if width:
+            keys.append(m + ' ' + width)
+        keys.append(m)
+    return _lookup(table['instructions'], keys)
+
+
+def _memory_accesses(instruction, entry):
+    '''Returns the list of (kind, operand) memory accesses ('load' or 'store') of *instruction*.'''
+    if instruction['mnemonic'].startswith('lea') or instruction['mnemonic'].startswith('j'):
+        return []
+    accesses = []
+    operands = instruction['operands']
+    for i, operand in enumerate(operands):
+        if operand['type'] != 'memory':
+            continue
+        if i < len(operands) - 1 or len(operands) == 1:
+            accesses.append(('load', operand))
+        else:
+            # destination in memory
+            if not (entry and entry.get('move')):
+                accesses.append(('load', operand))
+            if not (entry and entry.get('destination') == 'none'):
+                accesses.append(('store', operand))
+    return accesses
+
+
+def _memory_entry(table, kind, operand, width):
+    indexed = bool(re.search(r'\([^)]*,', operand['text']))
+    keys = []
+    for k in ([kind + ' indexed'] if indexed else []) + [kind]:
+        if width:
+            keys.append(k + ' ' + width)
+        keys.append(k)
+    return _lookup(table, keys)
+
+
+def _destination_mode(instruction, entry):
+    '''Returns if the last operand is written ("write"), read and written or not at all.'''
+    if entry and 'destination' in entry:
+        return entry['destination']
+    if entry and entry.get('move'):
+        return 'write'
+    if instruction['mnemonic'].startswith('v') and len(instruction['operands']) >= 3:
+        # VEX encoded three operand form, the destination is not a source
+        return 'write'
+    return 'read-write'
+
+
+def _is_zero_idiom(instruction):
+    '''Returns True for xor/sub of a register with itself, which does not depend on it.'''
+    operands = instruction['operands']
+    return (re.match(r'^v?p?(xor|sub)', instruction['mnemonic']) is not None and
+            len(operands) >= 2 and all([o['type'] == 'register' for o in operands]) and
+            len(set([register_name(o['registers'][0]) for o in operands])) == 1)
+
+
+def decode_block(asm_lines, table):
+    '''
+    Returns the instructions of *asm_lines* annotated with their table entry, memory accesses,
+    port usages (list of (cycles, ports)), fused domain uops and register dependencies.
+
+    Conditional jumps are macro-fused with a preceding compare (or other fusible instruction
+    listed in the table), which then neither uses ports nor issues uops of its own.
+    '''
+    instructions = []
+    for line in asm_lines:
+        instruction = parse_instruction(line)
+        if instruction is None:
+            continue
+        entry = lookup_instruction(instruction, table)
+        width = _operand_width(instruction)
+        accesses = _memory_accesses(instruction, entry)
+
+        port_usage = []
+        uops = 0
+        if entry is not None and not (entry.get('move') and accesses):
+            port_usage += [(c, list(p)) for c, p in entry['ports']]
+            uops += entry['uops']
+        load_latency = 0
+        memory_width = entry.get('memory width', width) if entry else width
+        for kind, operand in accesses:
+            memory_entry = _memory_entry(table, kind, operand, memory_width)
+            port_usage += [(c, list(p)) for c, p in memory_entry['ports']]
+            if kind == 'load':
+                load_latency = memory_entry['latency']
+                # Loads are micro-fused with the operation using them
+                if uops == 0:
+                    uops += memory_entry['uops']
+            else:
+                uops += memory_entry['uops']
+
+        # Register dependencies
+        mode = _destination_mode(instruction, entry)
+        operands = instruction['operands']
+        sources = []
+        memory_sources = []
+        destinations = []
+        for i, operand in enumerate(operands):
+            if operand['type'] == 'memory':
+                memory_sources += [register_name(r) for r in operand['registers']]
+            elif operand['type'] == 'register':
+                is_destination = i == len(operands) - 1 and len(operands) > 1
+                if not is_destination or mode != 'write' or len(operands) == 1:
+                    sources.append(register_name(operand['registers'][0]))
+                if (is_destination or len(operands) == 1) and mode != 'none':
+                    destinations.append(register_name(operand['registers'][0]))
+        if _is_zero_idiom(instruction):
+            sources = []
+        if instruction['mnemonic'].startswith('lea'):
+            sources += memory_sources
+            memory_sources = []
+        sources = [r for r in sources if r != 'rip']
+        memory_sources = [r for r in memory_sources if r != 'rip']
+
+        instruction.update({
+            'entry': entry,
+            'port usage': port_usage,
+            'uops': uops,
+            # Pure loads and stores do not add the latency of a register move
+            'latency': entry['latency'] if entry and not (entry.get('move') and accesses) else 0,
+            'load latency': load_latency if any([k == 'load' for k, o in accesses]) else None,
+            'sources': sources,
+            'memory sources': memory_sources,
+            'destinations': destinations,
+            'fused': False})
+
+        # Macro-fusion with the previous instruction
+        previous = instructions[-1] if instructions else None
+        if (instruction['mnemonic'].startswith('j') and instruction['mnemonic'] != 'jmp' and
+                previous is not None and previous['entry'] is not None and
+                not any([o['type'] == 'memory' for o in previous['operands']]) and
+                re.sub(r'[bwlq]$', '', previous['mnemonic']) in table.get('macro fusion', [])):
+            previous['port usage'] = []
+            previous['uops'] = 0
+            instruction['fused'] = True
+
+        instructions.append(instruction)
+    return instructions
+
+
+def _fill_ports(pressure, ports, cycles):
+    '''
+    Distributes *cycles* over *ports*, so that the least loaded ports are filled up to a common
+    level. Returns the cycles added per port.
+    '''
+    loads = sorted([pressure[p] for p in ports])
+    level = loads[0] + cycles
+    for k in range(1, len(loads) + 1):
+        level = (cycles + sum(loads[:k]))/k
+        if k == len(loads) or level <= loads[k]:
+            break
+    added = OrderedDict()
+    for p in ports:
+        added[p] = max(0.0, level - pressure[p])
+        pressure[p] += added[p]
+    return added
+
+
+def port_pressure(instructions, table):
+    '''
+    Returns cycles per port for *instructions* (see decode_block()) and stores the cycles of
+    each instruction in its 'port cycles'.
+
+    Port usages with fewer alternative ports are scheduled first, each one filling up its least
+    loaded ports. This mimics an optimal assignment for the typical kernel mix, e.g. on Haswell
+    additions bound to port 1 move multiplications to port 0.
+    '''
+    pressure = OrderedDict([(p, 0.0) for p in table['ports']])
+    usages = [(len(ports), i, cycles, ports)
+              for i, instruction in enumerate(instructions)
+              for cycles, ports in instruction['port usage']]
+    for instruction in instructions:
+        instruction['port cycles'] = OrderedDict([(p, 0.0) for p in table['ports']])
+    for _, i, cycles, ports in sorted(usages, key=lambda u: (u[0], u[1])):
+        for p, c in _fill_ports(pressure, ports, cycles).items():
+            instructions[i]['port cycles'][p] += c
+    return pressure
+
+
+def _start(instruction, ready):
+    '''
+    Returns (cycles, instructions leading there) when *instruction* can start, given the *ready*
+    registers as register -> (cycles, instructions), None if it depends on none of them.
+    '''
+    start = None
+    for r in instruction['sources']:
+        if r in ready and (start is None or ready[r][0] > start[0]):
+            start = ready[r]
+    if instruction['load latency'] is not None:
+        # Loads add their latency after the address registers are ready
+        for r in instruction['memory sources']:
+            if r in ready and (start is None or
+                               ready[r][0] + instruction['load latency'] > start[0]):
+                start = (ready[r][0] + instruction['load latency'], ready[r][1])
+    return start
+
+
+def critical_path(instructions):
+    '''
+    Returns the latency of the longest dependency chain through one block iteration and the
+    instructions on it.
+
+    Values are ready at the beginning of the block, dependencies through memory are not
+    considered.
+    '''
+    ready = {}
+    longest = (0, [])
+    for instruction in instructions:
+        start = _start(instruction, ready) or (0, [])
+        if instruction['load latency'] is not None and start[0] < instruction['load latency']:
+            start = (instruction['load latency'], [])
+        finish = (start[0] + instruction['latency'], start[1] + [instruction])
+        for r in instruction['destinations']:
+            ready[r] = finish
+        if finish[0] > longest[0]:
+            longest = finish
+    return float(longest[0]), longest[1]
+
+
+def _dependency_paths(instructions, register):
+    '''
+    Returns the longest paths from the value of *register* at the beginning of a block iteration
+    to the registers depending on it at the end, as register -> (cycles, instructions).
+    '''
+    ready = {register: (0, [])}
+    for instruction in instructions:
+        start = _start(instruction, ready)
+        for r in instruction['destinations']:
+            if start is None:
+                # overwritten by a value independent of register
+                ready.pop(r, None)
+            else:
+                ready[r] = (start[0] + instruction['latency'], start[1] + [instruction])
+    return ready
+
+
+def loop_carried_dependencies(instructions):
+    '''
+    Returns the latency per block iteration of the longest loop-carried dependency chain and the
+    instructions on it.
+
+    Registers written in one iteration and read in the next form a graph between iterations,
+    weighted by the longest path through the block. Its cycle with the largest latency per
+    iteration bounds how fast iterations can follow each other, regardless of port pressure.
+    Cycles over up to one iteration per register are searched, so chains alternating between
+    registers (e.g. after unrolling) are found as well. Dependencies through memory are not
+    considered.
+    '''
+    registers = sorted(set([r for i in instructions for r in i['destinations']]))
+    paths = {}
+    for a in registers:
+        paths[a] = dict([(b, p) for b, p in _dependency_paths(instructions, a).items()
+                         if b in registers])
+
+    # longest[(a, b)]: longest path from a to b over k iterations
+    longest = dict([((a, b), p) for a in registers for b, p in paths[a].items()])
+    best = (0, [])
+    for k in range(1, len(registers)+1):
+        for r in registers:
+            if (r, r) in longest and longest[(r, r)][0]/k > best[0]:
+                best = (longest[(r, r)][0]/k, longest[(r, r)][1])
+        if k == len(registers):
+            break
+        extended = {}
+        for (a, b), (cycles, chain) in longest.items():
+            for c, (next_cycles, next_chain) in paths[b].items():
+                if (a, c) not in extended or extended[(a, c)][0] < cycles + next_cycles:
+                    extended[(a, c)] = (cycles + next_cycles, chain + next_chain)
+        longest = extended
+    return float(best[0]), best[1]
+
+
+def format_port_pressure(instructions, pressure, block_throughput, uops, micro_architecture):
+    '''Returns a textual report of the port pressure, similar to IACA's throughput analysis.'''
+    ports = list(pressure.keys())
+    lines = ['Built-in port pressure analysis for {}'.format(micro_architecture), '',
+             'Block Throughput: {:.2f} Cycles'.format(block_throughput), '',
+             '| Num Of |' + '|'.join(['{:^6}'.format(p) for p in ports]) + '|',
+             '|  Uops  |' + '|'.join(['------'] * len(ports)) + '|']
+    for instruction in instructions:
+        cycles = '|'.join(['{:^6}'.format('{:.2g}'.format(c) if c else '')
+                           for c in instruction['port cycles'].values()])
+        flags = 'X ' if instruction['entry'] is None else ('F ' if instruction['fused'] else '  ')
+        lines.append('|  {:^4}  |{}| {}{}'.format(
+            instruction['uops'] or '', cycles, flags, instruction['line']))
+    lines += ['|  Port  |' + '|'.join(['{:^6}'.format(p) for p in ports]) + '|',
+              '| Cycles |' + '|'.join(['{:^6.2f}'.format(c) for c in pressure.values()]) + '|',
+              '', 'Total Num Of Uops: {}'.format(uops),
+              'F - Macro-fused with the previous instruction',
+              'X - Not in instruction table, ignored']
+    return '\n'.join(lines) + '\n'
+
+
+def format_latency(block_latency, path, loop_carried_latency, chain, micro_architecture):
+    '''
+    Returns a textual report of the critical path, similar to IACA's latency analysis, and of
+    the loop-carried dependency chain.
+    '''
+    lines = ['Built-in latency analysis for {}'.format(micro_architecture), '',
+             'Latency: {:.2f} Cycles'.format(block_latency), '', 'Critical path:']
+    lines += ['  ' + instruction['line'] for instruction in path]
+    lines += ['', 'Loop-carried dependency: {:.2f} Cycles'.format(loop_carried_latency), '',
+              'Loop-carried chain:']
+    lines += ['  ' + instruction['line'] for instruction in chain]
+    return '\n'.join(lines) + '\n'
+
+
+def analyze_block(asm_lines, micro_architecture):
+    '''
+    Returns the built-in throughput and latency analysis of *asm_lines* (one block iteration)
+    as a dictionary with the same keys as iaca.analyze().
+    '''
+    table = load_instruction_table(micro_architecture)
+    instructions = decode_block(asm_lines, table)
+    unknown = sorted(set([i['mnemonic'] for i in instructions if i['entry'] is None]))
+    if unknown:
+        print("Instructions not found in {} instruction table were ignored: {}".format(
+            micro_architecture, ', '.join(unknown)), file=sys.stderr)
+
+    pressure = port_pressure(instructions, table)
+    uops = sum([i['uops'] for i in instructions])
+    block_throughput = max(list(pressure.values()) + [uops/table['issue width']])
+    block_latency, path = critical_path(instructions)
+    loop_carried_latency, chain = loop_carried_dependencies(instructions)
+
+    return {'block throughput': block_throughput,
+            'block latency': block_latency,
+            'port cycles': dict(pressure),
+            'uops': float(uops),
+            'loop-carried latency': loop_carried_latency,
+            'loop-carried chain': [i['line'] for i in chain],
+            'IACA output': format_port_pressure(
+                instructions, pressure, block_throughput, uops, micro_architecture),
+            'IACA latency output': format_latency(
+                block_latency, path, loop_carried_latency, chain, micro_architecture)}
+
+
+def analyze_loop_carried(asm_lines, micro_architecture):
+    '''
+    Returns 'loop-carried latency' per iteration of *asm_lines* and the 'loop-carried chain'
+    (lines), None and empty if there is no instruction table for *micro_architecture*.
+    '''
+    if not os.path.exists(instruction_table_path(micro_architecture)):
+        return {'loop-carried latency': None, 'loop-carried chain': []}
+    instructions = decode_block(asm_lines, load_instruction_table(micro_architecture))
+    loop_carried_latency, chain = loop_carried_dependencies(instructions)
+    return {'loop-carried latency': loop_carried_latency,
+            'loop-carried chain': [i['line'] for i in chain]}
+
+
+def analyze_builtin(kernel, machine, bin_name=None, args=None):
+    '''
+    Returns the built-in port pressure analysis of the block selected by
+    KernelCode.assemble(), with the instruction table for the machine's micro-architecture.
+    '''
+    return analyze_block(kernel.asm_block['lines'], machine['micro-architecture'])
+
+
+# In-core backends by name, each is called with kernel, machine, marked binary and command line
+# arguments and returns 'block throughput', 'block latency', 'port cycles' and 'uops' per block
+# iteration and the textual 'IACA output' and 'IACA latency output'. Backends may return
+# 'loop-carried latency' and 'loop-carried chain', otherwise they are taken from the built-in
+# analysis.
+backends = OrderedDict([('IACA', iaca.analyze),
+                        ('builtin', analyze_builtin)])
+
+
+def select_backend(args=None):
+    '''
+    Returns the name of the in-core backend selected by *args*. With "auto" (default), IACA is
+    used if iaca.sh is found in PATH, the built-in analysis otherwise.
+    '''
+    name = getattr(args, 'incore_model', 'auto') if args else 'auto'
+    if name == 'auto':
+        name = 'IACA' if find_executable('iaca.sh') is not None else 'builtin'
+    return name
+
+
+def analyze(kernel, machine, bin_name, args=None):
+    '''
+    Returns the in-core analysis of the block marked in *bin_name* by the backend selected by
+    *args*, with its name in 'in-core model' and the loop-carried dependencies (see
+    loop_carried_dependencies()).
+    '''
+    name = select_backend(args)
+    analysis = backends[name](kernel, machine, bin_name, args)
+    analysis['in-core model'] = name
+    if 'loop-carried latency' not in analysis:
+        analysis.update(analyze_loop_carried(kernel.asm_block['lines'],
+                                             machine['micro-architecture']))
+    return analysis
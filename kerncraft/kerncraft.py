@@ -29,8 +29,10 @@ from six.moves import range
 from ruamel import yaml
 
 from . import models
+from . import incore
 from .kernel import KernelCode, KernelDescription
 from .machinemodel import MachineModel
+from .cacheprediction import PredictorCache, PredictionStore, PrefetchingCacheSimulator
 
 
 def space(start, stop, num, endpoint=True, log=False, base=10):
@@ -140,9 +142,79 @@ def create_parser():
                         help='Use kernel description instead of analyzing the kernel code.')
 
     # Needed for ECM, ECMData and Roofline model:
-    parser.add_argument('--cache-predictor', '-P', choices=['LC', 'SIM'], default='SIM',
-                        help='Change cache predictor to use, options are LC (layer conditions) and '
-                             'SIM (cache simulation with pycachesim), default is SIM.')
+    parser.add_argument('--cache-predictor', '-P',
+                        choices=['LC', 'PLC', 'SIM', 'SSIM', 'RD', 'auto'], default='SIM',
+                        help='Change cache predictor to use, options are LC (layer conditions), '
+                             'PLC (layer conditions derived once for all defines), SIM (cache '
+                             'simulation with pycachesim), SSIM (set-sampled cache simulation), '
+                             'RD (reuse distances of fully associative LRU caches) and auto (LC '
+                             'for all cache levels where it applies, SIM for the others), '
+                             'default is SIM.')
+    parser.add_argument('--cache-sim-warmup', choices=['fixed', 'adaptive'], default='fixed',
+                        help='Warm-up of the SIM and SSIM cache predictors. "fixed" simulates a '
+                             'third of each loop dimension (limited to 1.5x the largest cache), '
+                             '"adaptive" simulates until the hits and misses per cache line '
+                             'converged, which may change predictions. (default: fixed)')
+    parser.add_argument('--cache-sim-reuse', action='store_true',
+                        help='Reuse the simulated warm-up and benchmark window of a previous '
+                             'define point, if its trace is the very same (e.g. a sweep over the '
+                             'outer most loop bound, with arrays not depending on it).')
+    parser.add_argument('--cache-sim-samples', metavar='WINDOWS', type=int, default=1,
+                        help='Number of benchmark windows, spread across the iteration space, '
+                             'simulated by the SIM cache predictor. Results are averaged and '
+                             'reported with a confidence interval. (default: 1)')
+    parser.add_argument('--cache-sim-budget', metavar='ITERATIONS', type=int, default=None,
+                        help='Maximum number of iterations simulated for additional benchmark '
+                             'windows (see --cache-sim-samples), default is unlimited.')
+    parser.add_argument('--cache-sim-set-ratio', metavar='RATIO', type=int, default=None,
+                        help='Only one in RATIO cache sets is simulated by the SSIM cache '
+                             'predictor. Must divide the set counts of all cache levels, default '
+                             'is the largest power of two up to 64 which does.')
+    parser.add_argument('--prediction-cache', choices=['use', 'refresh', 'bypass'],
+                        default='bypass',
+                        help='With "use", cache predictor results are stored on disk and reused '
+                             'by later runs with the same kernel, constants, predictor and '
+                             'caches. "refresh" replaces stored results by new predictions, '
+                             '"bypass" neither reads nor writes them. (default: bypass)')
+    parser.add_argument('--prediction-cache-dir', metavar='DIR', default=None,
+                        help='Directory of stored predictor results, default is '
+                             '$XDG_CACHE_HOME/kerncraft/predictions (or ~/.cache/...).')
+    parser.add_argument('--prediction-cache-size', metavar='MB', type=int, default=256,
+                        help='Maximum size of stored predictor results in megabytes, least '
+                             'recently used results are removed first. (default: 256)')
+
+    # Needed for ECMCPU, ECM and RooflineIACA model:
+    parser.add_argument('--incore-model', choices=['auto'] + list(incore.backends), default='auto',
+                        help='In-core analysis of the marked assembly block. "builtin" uses the '
+                             'port pressure analysis with instruction tables shipped for {}, '
+                             '"auto" uses IACA if iaca.sh is found in PATH and "builtin" '
+                             'otherwise. (default: auto)'.format(
+                                 ', '.join(incore.supported_micro_architectures())))
+    parser.add_argument('--iaca-cache', choices=['use', 'refresh', 'bypass'], default='bypass',
+                        help='With "use", IACA analyses are stored on disk and reused for the '
+                             'same marked assembly block and micro-architecture. "refresh" '
+                             'replaces stored analyses by new ones, "bypass" neither reads nor '
+                             'writes them. (default: bypass)')
+    parser.add_argument('--iaca-cache-dir', metavar='DIR', default=None,
+                        help='Directory of stored IACA analyses, default is '
+                             '$XDG_CACHE_HOME/kerncraft/iaca (or ~/.cache/...).')
+    parser.add_argument('--iaca-cache-size', metavar='MB', type=int, default=16,
+                        help='Maximum size of stored IACA analyses in megabytes, least recently '
+                             'used ones are removed first. (default: 16)')
+
+    # Needed for ECMCPU, ECM, RooflineIACA and Benchmark model:
+    parser.add_argument('--compile-cache', choices=['use', 'refresh', 'bypass'],
+                        default='bypass',
+                        help='With "use", compiled, assembled and built kernels are stored on '
+                             'disk and reused for the same generated code, compiler, compiler '
+                             'version and flags. "refresh" replaces stored files by new ones, '
+                             '"bypass" neither reads nor writes them. (default: bypass)')
+    parser.add_argument('--compile-cache-dir', metavar='DIR', default=None,
+                        help='Directory of stored compiled kernels, default is '
+                             '$XDG_CACHE_HOME/kerncraft/compile (or ~/.cache/...).')
+    parser.add_argument('--compile-cache-size', metavar='MB', type=int, default=128,
+                        help='Maximum size of stored compiled kernels in megabytes, least '
+                             'recently used ones are removed first. (default: 128)')
 
     for m in models.__all__:
         ag = parser.add_argument_group('arguments for '+m+' model', getattr(models, m).name)
@@ -158,6 +230,32 @@ def check_arguments(args, parser):
         except ValueError:
             parser.error('--asm-block can only be "auto", "manual" or an integer')
 
+    if args.cache_sim_samples < 1:
+        parser.error('--cache-sim-samples needs to be at least 1')
+    if args.cores > 1 and args.cache_predictor == 'SSIM':
+        parser.error('--cores larger than 1 is not supported by the SSIM cache predictor')
+    if args.cores > 1 and args.cache_sim_warmup == 'adaptive' and \
+            args.cache_predictor in ['SIM', 'auto']:
+        parser.error('--cache-sim-warmup adaptive is not supported with --cores larger than 1')
+    if args.cores > 1 and args.cache_sim_samples > 1 and args.cache_predictor in ['SIM', 'auto']:
+        parser.error('--cache-sim-samples larger than 1 is not supported with --cores larger '
+                     'than 1')
+    if args.cache_predictor == 'SSIM' or args.cores > 1 and args.cache_predictor in ['SIM', 'auto']:
+        if PrefetchingCacheSimulator.has_prefetchers(MachineModel(args.machine.name)):
+            parser.error('prefetchers in the machine file are supported neither by the SSIM cache '
+                         'predictor nor with --cores larger than 1')
+    if 'Padding' in args.pmodel:
+        if args.cache_predictor not in ['SIM', 'SSIM']:
+            parser.error('Padding needs the SIM or SSIM cache predictor')
+        if args.cache_sim_samples > 1 or args.cores > 1:
+            parser.error('Padding supports neither --cache-sim-samples nor --cores larger than 1')
+    if args.prediction_cache_size < 0:
+        parser.error('--prediction-cache-size may not be negative')
+    if args.iaca_cache_size < 0:
+        parser.error('--iaca-cache-size may not be negative')
+    if args.compile_cache_size < 0:
+        parser.error('--compile-cache-size may not be negative')
+
 
 def run(parser, args, output_file=sys.stdout):
     # Try loading results file (if requested)
@@ -227,6 +325,18 @@ def run(parser, args, output_file=sys.stdout):
                     define_dict[name].append([name, v])
         define_product = list(itertools.product(*list(define_dict.values())))
 
+    prediction_store = None
+    if args.prediction_cache != 'bypass':
+        prediction_store = PredictionStore(
+            args.prediction_cache_dir or PredictionStore.default_path(),
+            max_size=args.prediction_cache_size*1024**2,
+            refresh=args.prediction_cache == 'refresh')
+
+    # Models of one define point share their cache predictions, the PLC predictor evaluates all
+    # define points at once and serves them all
+    predictor_cache = PredictorCache(
+        prediction_store, points=[dict(define) for define in define_product])
+
     for define in define_product:
         # Reset state of kernel
         kernel.clear_state()
@@ -235,38 +345,40 @@ def run(parser, args, output_file=sys.stdout):
         for k, v in define:
             kernel.set_constant(k, v)
 
-        for model_name in set(args.pmodel):
-            # print header
-            print('{:=^80}'.format(' kerncraft '), file=output_file)
-            print('{:<40}{:>40}'.format(args.code_file.name, '-m '+args.machine.name),
-                  file=output_file)
-            print(' '.join(['-D {} {}'.format(k,v) for k,v in define]), file=output_file)
-            print('{:-^80}'.format(' '+model_name+' '), file=output_file)
-
-            if args.verbose > 1:
-                if not args.kernel_description:
-                    kernel.print_kernel_code(output_file=output_file)
-                    print('', file=output_file)
-                kernel.print_variables_info(output_file=output_file)
-                kernel.print_kernel_info(output_file=output_file)
-            if args.verbose > 0:
-                kernel.print_constants_info(output_file=output_file)
-
-            model = getattr(models, model_name)(kernel, machine, args, parser)
-
-            model.analyze()
-            model.report(output_file=output_file)
-
-            # Add results to storage
-            kernel_name = os.path.split(args.code_file.name)[1]
-            if kernel_name not in result_storage:
-                result_storage[kernel_name] = {}
-            if tuple(kernel.constants.items()) not in result_storage[kernel_name]:
-                result_storage[kernel_name][tuple(kernel.constants.items())] = {}
-            result_storage[kernel_name][tuple(kernel.constants.items())][model_name] = \
-                model.results
-
-            print('', file=output_file)
+        with predictor_cache:
+            for model_name in set(args.pmodel):
+                # print header
+                print('{:=^80}'.format(' kerncraft '), file=output_file)
+                print('{:<40}{:>40}'.format(args.code_file.name, '-m '+args.machine.name),
+                      file=output_file)
+                print(' '.join(['-D {} {}'.format(k,v) for k,v in define]), file=output_file)
+                print('{:-^80}'.format(' '+model_name+' '), file=output_file)
+
+                if args.verbose > 1:
+                    if not args.kernel_description:
+                        kernel.print_kernel_code(output_file=output_file)
+                        print('', file=output_file)
+                    kernel.print_variables_info(output_file=output_file)
+                    kernel.print_kernel_info(output_file=output_file)
+                if args.verbose > 0:
+                    kernel.print_constants_info(output_file=output_file)
+
+                model = getattr(models, model_name)(
+                    kernel, machine, args, parser, predictor_cache=predictor_cache)
+
+                model.analyze()
+                model.report(output_file=output_file)
+
+                # Add results to storage
+                kernel_name = os.path.split(args.code_file.name)[1]
+                if kernel_name not in result_storage:
+                    result_storage[kernel_name] = {}
+                if tuple(kernel.constants.items()) not in result_storage[kernel_name]:
+                    result_storage[kernel_name][tuple(kernel.constants.items())] = {}
+                result_storage[kernel_name][tuple(kernel.constants.items())][model_name] = \
+                    model.results
+
+                print('', file=output_file)
 
         # Save storage to file (if requested)
         if args.store:
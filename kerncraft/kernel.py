@@ -5,7 +5,7 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 from __future__ import division
 
-from copy import deepcopy
+from copy import copy, deepcopy
 import operator
 import tempfile
 import subprocess
@@ -22,7 +22,6 @@ from collections import defaultdict
 from pprint import pprint
 
 import sympy
-from sympy.utilities.lambdify import implemented_function
 from sympy.parsing.sympy_parser import parse_expr
 import numpy
 from six.moves import filter
@@ -129,6 +128,102 @@ def find_array_references(ast):
         return reduce(operator.add, [find_array_references(o[1]) for o in ast.children()], [])
 
 
+def affine_coefficients(expr, symbols):
+    '''
+    Returns coefficients of *expr* for each of *symbols* and its constant term.
+
+    Coefficients may depend on other symbols (e.g. constants), as long as they are polynomials with
+    integer coefficients and hence evaluate to integers for integer values. If *expr* is not affine
+    in *symbols* or this does not hold, None is returned.
+
+    e.g. 8*i + 8*N*j + 16 with symbols (i, j) -> ([8, 8*N], 16)
+    '''
+    try:
+        poly = sympy.Poly(expr, *symbols)
+    except sympy.PolynomialError:
+        return None
+    if poly.total_degree() > 1:
+        return None
+    coefficients = [poly.coeff_monomial(s) for s in symbols]
+    constant = poly.coeff_monomial(1)
+    for c in coefficients + [constant]:
+        if not c.free_symbols:
+            if not c.is_Integer:
+                return None
+            continue
+        try:
+            c_poly = sympy.Poly(c, *sorted(c.free_symbols, key=str))
+        except sympy.PolynomialError:
+            return None
+        if not all([k.is_Integer for k in c_poly.coeffs()]):
+            return None
+    return coefficients, constant
+
+
+class AffineOffsets(object):
+    '''
+    Evaluates offset expressions for many iterations at once.
+
+    Coefficients and constant terms of expressions affine in the loop indices are extracted and
+    compiled once as functions of the constants. bind() evaluates them to integer matrices for
+    specific values of the constants, after which the offsets of a whole iteration range are
+    computed with a single matrix multiplication. Expressions which are not affine fall back to
+    sympy.lambdify over loop indices and constants.
+    '''
+    def __init__(self, exprs, loop_symbols, constant_symbols=()):
+        self.loop_symbols = list(loop_symbols)
+        self.constant_symbols = list(constant_symbols)
+        self.constant_values = None
+        self.fallbacks = []
+        self._length = len(exprs)
+        self._affine_rows = []
+
+        affine_exprs = []
+        for row, expr in enumerate(exprs):
+            affine = affine_coefficients(expr, self.loop_symbols)
+            if affine is None:
+                self.fallbacks.append((row, sympy.lambdify(
+                    self.loop_symbols + self.constant_symbols, expr, numpy)))
+            else:
+                self._affine_rows.append(row)
+                affine_exprs.append(affine[0] + [affine[1]])
+        self._affine_func = sympy.lambdify(self.constant_symbols, affine_exprs, numpy)
+
+    def __len__(self):
+        return self._length
+
+    def bind(self, constant_values, shift=0):
+        '''
+        Returns a copy with integer coefficients and base offsets for *constant_values*.
+
+        :param constant_values: values in the order of constant_symbols
+        :param shift: added to all offsets, either a scalar or one value per expression
+        '''
+        bound = copy(self)
+        bound.constant_values = tuple(constant_values)
+        matrix = numpy.array(self._affine_func(*bound.constant_values), dtype=numpy.int64)
+        matrix = matrix.reshape((len(self._affine_rows), len(self.loop_symbols)+1))
+        bound.coefficients = numpy.zeros((len(self), len(self.loop_symbols)), dtype=numpy.int64)
+        bound.coefficients[self._affine_rows] = matrix[:, :-1]
+        bound.base = numpy.zeros(len(self), dtype=numpy.int64) + \
+            numpy.array(shift, dtype=numpy.int64)
+        bound.base[self._affine_rows] += matrix[:, -1]
+        return bound
+
+    def evaluate(self, counters):
+        '''
+        Returns contiguous offsets with one row per iteration and one column per expression.
+
+        :param counters: integer array with one row per loop symbol and one column per iteration
+        '''
+        assert self.constant_values is not None, "bind() needs to be called before evaluate()"
+        offsets = counters.T.dot(self.coefficients.T) + self.base
+        for column, func in self.fallbacks:
+            offsets[:, column] = func(*(list(counters) + list(self.constant_values))) + \
+                self.base[column]
+        return offsets
+
+
 class Kernel(object):
     '''This class captures the kernel information, analyzes it and reports access pattern'''
     # Datatype sizes in bytes
@@ -141,6 +236,7 @@ class Kernel(object):
         self._destinations = {}
         self._flops = {}
         self.datatype = None
+        self._parametric = None
 
         self.clear_state()
 
@@ -168,12 +264,32 @@ class Kernel(object):
             assert type_ == self.datatype, 'mixing of datatypes within a kernel is not supported.'
         assert type(size) in [list, type(None)], 'size has to be defined as tuple'
         self.variables[name] = (type_, size)
+        self._parametric = None
 
     def clear_state(self):
         '''Clears changable internal states
         (constants, asm_blocks and asm_block_idx)'''
         self.constants = {}
         self.subs_consts.clear()  # clear LRU cache of function
+        self._offset_engines = {}
+
+    def access_description(self):
+        '''
+        Returns a normalized string of datatype, variables, loop stack and array accesses.
+
+        Kernels with equal descriptions generate the same accesses for the same constants, no
+        matter how the code was formatted or whether it was given as a kernel description.
+        '''
+        def accesses(references):
+            return sorted([(name, sorted([str(r) for r in refs if r is not None]))
+                           for name, refs in references.items()])
+        return repr([
+            self.datatype,
+            sorted([(name, type_, [str(s) for s in size or []])
+                    for name, (type_, size) in self.variables.items()]),
+            [tuple([str(e) for e in l]) for l in self._loop_stack],
+            accesses(self._sources),
+            accesses(self._destinations)])
 
     @lrudecorator(40)
     def subs_consts(self, expr):
@@ -185,6 +301,60 @@ class Kernel(object):
         else:
             return expr.subs(self.constants)
 
+    def _compile_parametric(self):
+        '''
+        Compiles loop bounds, array sizes and access offsets into numeric functions of the
+        constants.
+
+        Compilation happens once per kernel and is kept across clear_state(), so a new set of
+        constants (e.g. the next define point of a sweep) only requires numeric evaluation.
+        '''
+        if self._parametric is not None:
+            return self._parametric
+
+        loop_symbols = [sympy.Symbol(l[0], positive=True) for l in reversed(self._loop_stack)]
+        loop_bounds = [list(l[1:]) for l in self._loop_stack]
+        array_sizes = self.array_sizes()
+
+        # Gather all read and write accesses to the arrays (in bytes):
+        load_exprs = []
+        store_exprs = []
+        for var_name in array_sizes:
+            element_size = self.datatypes_size[self.variables[var_name][0]]
+            for r in self._sources.get(var_name, []):
+                # TODO possibly differentiate between index order
+                load_exprs.append(self.access_to_sympy(var_name, r)*element_size)
+            for w in self._destinations.get(var_name, []):
+                # TODO possibly differentiate between index order
+                store_exprs.append(self.access_to_sympy(var_name, w)*element_size)
+
+        free_symbols = set()
+        for expr in chain(chain(*loop_bounds), array_sizes.values(), load_exprs, store_exprs):
+            free_symbols |= sympy.sympify(expr).free_symbols
+        constant_symbols = sorted(free_symbols - set(loop_symbols), key=str)
+
+        self._parametric = {
+            'constants': constant_symbols,
+            'loop symbols': loop_symbols,
+            'loop bounds': sympy.lambdify(constant_symbols, loop_bounds, numpy),
+            'arrays': list(array_sizes.keys()),
+            'array sizes': sympy.lambdify(constant_symbols, list(array_sizes.values()), numpy),
+            'loads': AffineOffsets(load_exprs, loop_symbols, constant_symbols),
+            'load arrays': [v for v in array_sizes for r in self._sources.get(v, [])],
+            'stores': AffineOffsets(store_exprs, loop_symbols, constant_symbols),
+            'store arrays': [v for v in array_sizes for w in self._destinations.get(v, [])]}
+        return self._parametric
+
+    def _constant_values(self):
+        '''
+        Returns values of all constants used by the kernel (in the order of _compile_parametric()),
+        or None if not all of them are set.
+        '''
+        try:
+            return tuple([self.constants[s] for s in self._compile_parametric()['constants']])
+        except KeyError:
+            return None
+
     def array_sizes(self, in_bytes=False, subs_consts=False):
         '''Returns a dictionary with all arrays sizes (optunally in bytes, otherwise in elements).
 
@@ -193,6 +363,13 @@ class Kernel(object):
 
         Scalar variables are ignored.
         '''
+        if subs_consts and self._constant_values() is not None:
+            parametric = self._compile_parametric()
+            sizes = parametric['array sizes'](*self._constant_values())
+            return {var_name: sympy.Integer(int(size))*(
+                        self.datatypes_size[self.variables[var_name][0]] if in_bytes else 1)
+                    for var_name, size in zip(parametric['arrays'], sizes)}
+
         var_sizes = {}
 
         for var_name, var_info in self.variables.items():
@@ -257,10 +434,14 @@ class Kernel(object):
 
         total_length = 1
 
+        loop_stack = self._loop_stack
+        if self._constant_values() is not None:
+            loop_stack = [(l[0],) + bounds for l, bounds in zip(loop_stack, self._loop_bounds())]
+
         if dimension is not None:
-            loops = [self._loop_stack[dimension]]
+            loops = [loop_stack[dimension]]
         else:
-            loops = reversed(self._loop_stack)
+            loops = reversed(loop_stack)
 
         for var_name, start, end, incr in loops:
             # This unspools the iterations:
@@ -269,7 +450,21 @@ class Kernel(object):
 
         return self.subs_consts(total_length)
 
+    def _loop_bounds(self):
+        '''
+        Returns (start, stop, increment) integers of each loop, with all constants substituted.
+        '''
+        constant_values = self._constant_values()
+        if constant_values is None:
+            return [tuple([int(self.subs_consts(e)) for e in l[1:]]) for l in self._loop_stack]
+        return [tuple([sympy.Integer(int(e)) for e in bounds])
+                for bounds in self._compile_parametric()['loop bounds'](*constant_values)]
+
     def get_loop_stack(self, subs_consts=False):
+        if subs_consts and self._constant_values() is not None:
+            for l, (start, stop, incr) in zip(self._loop_stack, self._loop_bounds()):
+                yield {'index': l[0], 'start': start, 'stop': stop, 'increment': incr}
+            return
         for l in self._loop_stack:
             if subs_consts:
                 yield {'index': l[0],
@@ -313,59 +508,76 @@ class Kernel(object):
 
         return sympy_distances
 
-    def global_iterator_to_indices(self, git=None):
-        '''Returns sympy expressions translating global_iterator to loop indices,
-        or if global_iterator is given, an integer is returned'''
-        # unwind global iteration count into loop counters:
-        base_loop_counters = {}
-        if git is None:
-            global_iterator = sympy.Symbol('global_iterator', positive=True)
-        else:
-            global_iterator = git
-        idiv = implemented_function(sympy.Function(str('idiv')), lambda x, y: x//y)
+    def _loop_radices(self):
+        '''Returns (loop symbol, start, length, increment, last increment, total length) per loop,
+        from the inner most to the outer most loop, with all constants substituted.
+
+        This is the mixed-radix system which maps the global iterator onto loop indices.'''
+        radices = []
         total_length = 1
         last_incr = 1
-        for var_name, start, end, incr in reversed(self._loop_stack):
-            loop_var = sympy.Symbol(var_name, positive=True)
-
-            # This unspools the iterations:
+        for l, bounds in reversed(list(zip(self._loop_stack, self._loop_bounds()))):
+            var_name = l[0]
+            start, end, incr = [int(e) for e in bounds]
             length = end-start  # FIXME is incr handled correct here?
-            counter = start+(idiv(global_iterator*last_incr, total_length)*incr) % length
+            radices.append((sympy.Symbol(var_name, positive=True),
+                            start, length, incr, last_incr, total_length))
             total_length = total_length*length
             last_incr = incr
+        return radices
+
+    def global_iterator_to_indices(self, git=None):
+        '''Returns functions translating global_iterator to loop indices,
+        or if global_iterator is given, an integer is returned
 
-            if git is not None:
-                try:  # Try to resolve to integer if global_iterator was given
-                    base_loop_counters[loop_var] = sympy.Integer(self.subs_consts(counter))
-                    continue
-                except:
-                    pass
-            base_loop_counters[loop_var] = sympy.lambdify(
-                global_iterator,
-                self.subs_consts(counter), modules=[numpy, {'Mod': numpy.mod}])
+        The functions accept integers as well as numpy arrays of global iterators.'''
+        if git is not None:
+            return {loop_var: sympy.Integer(int(counter)) for loop_var, counter in
+                    self.global_iterator_to_indices_array(git).items()}
+
+        base_loop_counters = {}
+        for loop_var, start, length, incr, last_incr, total_length in self._loop_radices():
+            # This unspools the iterations:
+            def counter(global_iterator, start=start, length=length, incr=incr,
+                        last_incr=last_incr, total_length=total_length):
+                global_iterator = numpy.asarray(global_iterator, dtype=numpy.int64)
+                quotient = numpy.floor_divide(global_iterator*last_incr, total_length)
+                return start + numpy.mod(quotient*incr, length)
+            base_loop_counters[loop_var] = counter
 
         return base_loop_counters
 
+    def global_iterator_to_indices_array(self, git):
+        '''Returns dictionary of loop indices (int64 numpy arrays) for global iterator(s) git.
+
+        Vectorized, sympy-free variant of global_iterator_to_indices(git).'''
+        git = numpy.asarray(git, dtype=numpy.int64)
+        return {loop_var: counter(git)
+                for loop_var, counter in self.global_iterator_to_indices().items()}
+
     def indices_to_global_iterator(self, indices):
         '''Transforms a dictionary of indices to a global iterator integer.
 
+        Indices may also be numpy arrays, in which case an array of global iterators is returned.
+
         Inverse of global_iterator_to_indices().'''
-        global_iterator = sympy.Integer(0)
-        total_length = 1
-        for var_name, start, end, incr in reversed(self._loop_stack):
-            loop_var = sympy.Symbol(var_name, positive=True)
-            length = end-start  # FIXME is incr handled correct here?
-            global_iterator += (indices[loop_var] - start)*total_length
-            total_length = total_length*length
+        global_iterator = 0
+        for loop_var, start, length, incr, last_incr, total_length in self._loop_radices():
+            global_iterator = global_iterator + \
+                (numpy.asarray(indices[loop_var], dtype=numpy.int64) - start)*total_length
 
-        return self.subs_consts(global_iterator)
+        if numpy.ndim(global_iterator) == 0:
+            return int(global_iterator)
+        return global_iterator
 
 
-    def compile_global_offsets(self, iteration=0, spacing=0):
+    def compile_global_offsets(self, iteration=0, spacing=0, chunk_size=None):
         '''Returns load and store offsets on a virtual address space.
 
         :param iteration: controlls the inner index counter
         :param spacing: sets a spacing between the arrays, default is 0
+        :param chunk_size: if given, offsets are generated in chunks of at most chunk_size
+                           iterations (see below)
 
         All array variables (non scalars) are layed out linearly starting from 0. An optional
         spacing can be set. The accesses are based on this layout.
@@ -375,65 +587,144 @@ class Kernel(object):
         Accesses to scalars are ignored.
 
         Returned are load and store byte-offset pairs for each iteration.
-        '''
-        global_load_offsets = []
-        global_store_offsets = []
 
+        If chunk_size is given, a generator is returned instead. It yields (loads, stores) pairs of
+        contiguous int64 arrays, with one row per iteration and one column per access, in iteration
+        order. Chunks are only computed when requested, so memory usage stays bounded regardless of
+        the number of iterations.
+        '''
         if not isinstance(iteration, collections.Sequence):
             iteration = [iteration]
-        iteration = numpy.array(iteration)
 
         # loop indices based on iteration
         # unwind global iteration count into loop counters:
         base_loop_counters = self.global_iterator_to_indices()
         total_length = self.iteration_length()
 
-        assert max(iteration) < self.subs_consts(total_length), \
+        if len(iteration) == 0:
+            return iter([])
+        elif isinstance(iteration, six.moves.range):
+            # avoid iterating over (possibly huge) ranges
+            max_iteration = max(iteration[0], iteration[-1])
+        else:
+            max_iteration = max(iteration)
+        assert max_iteration < self.subs_consts(total_length), \
             "Iterations go beyond what is possible in the original code. One common reason is, " + \
             "that the iteration length are unrealistically small."
 
-        # Get sizes of arrays and base offsets for each array
+        if chunk_size is not None:
+            return self._global_offsets_chunks(iteration, spacing, chunk_size, base_loop_counters)
+
+        load_offsets, store_offsets = self._global_offsets_block(
+            iteration, spacing, base_loop_counters)
+
+        # Data access as they appear with iteration order
+        return zip_longest(zip(*load_offsets.T),
+                           zip(*store_offsets.T),
+                           fillvalue=None)
+
+    def _global_offsets_chunks(self, iteration, spacing, chunk_size, base_loop_counters):
+        '''Generator used by compile_global_offsets() if chunk_size is given.'''
+        for start in range(0, len(iteration), chunk_size):
+            yield self._global_offsets_block(
+                iteration[start:start+chunk_size], spacing, base_loop_counters)
+
+    def _global_offsets_block(self, iteration, spacing, base_loop_counters):
+        '''Returns load and store offset arrays of iterations (one row per iteration).'''
+        if isinstance(iteration, six.moves.range):
+            step = iteration[1] - iteration[0] if len(iteration) > 1 else 1
+            iteration = iteration[0] + step*numpy.arange(len(iteration), dtype=numpy.int64)
+        else:
+            iteration = numpy.array(iteration, dtype=numpy.int64)
+
+        load_offsets, store_offsets = self._compile_offset_engines(spacing)
+
+        # Generate numpy.array for each counter (in the order of the engines' loop symbols)
+        counters = numpy.array(
+            [numpy.broadcast_to(base_loop_counters[s](iteration), iteration.shape)
+             for s in load_offsets.loop_symbols],
+            dtype=numpy.int64)
+
+        return load_offsets.evaluate(counters), store_offsets.evaluate(counters)
+
+    def _compile_offset_engines(self, spacing=0):
+        '''
+        Returns load and store AffineOffsets, bound to the current constants, for
+        compile_global_offsets().
+
+        Offset expressions are compiled once per kernel (see _compile_parametric()), binding is
+        done once per spacing until clear_state() is called.
+        '''
+        if spacing in self._offset_engines:
+            return self._offset_engines[spacing]
+
+        constant_values = self._constant_values()
+        assert constant_values is not None, \
+            "All constants need to be set to compile offsets: " + \
+            ", ".join([str(s) for s in self._compile_parametric()['constants']])
+        parametric = self._compile_parametric()
+
+        # Base offsets for each array
+        base_offsets = {var_name: start for var_name, start, end in self.array_extents(spacing)}
+
+        engines = (
+            parametric['loads'].bind(
+                constant_values, [base_offsets[v] for v in parametric['load arrays']]),
+            parametric['stores'].bind(
+                constant_values, [base_offsets[v] for v in parametric['store arrays']]))
+        self._offset_engines[spacing] = engines
+        return engines
+
+    def array_extents(self, spacing=0):
+        '''
+        Returns (name, first byte offset, end byte offset) of all arrays, in the virtual address
+        space used by compile_global_offsets().
+        '''
         var_sizes = self.array_sizes(in_bytes=True, subs_consts=True)
-        base_offsets = {}
+        extents = []
         base = 0
         # Always arange arrays in alphabetical order in memory, for reproducability
         for var_name, var_size in sorted(var_sizes.items(), key=lambda v: v[0]):
-            base_offsets[var_name] = base
-            array_total_size = self.subs_consts(var_size + spacing)
+            extents.append((var_name, base, base + int(var_size)))
+            array_total_size = var_size + spacing
             # Add bytes to align by 64 byte (typical cacheline size):
             array_total_size = ((int(array_total_size)+63)& ~63)
             base += array_total_size
+        return extents
 
-        # Gather all read and write accesses to the array:
-        for var_name, var_size in var_sizes.items():
-            element_size = self.datatypes_size[self.variables[var_name][0]]
-            for r in self._sources.get(var_name, []):
-                offset_expr = self.access_to_sympy(var_name, r)
-                offset = sympy.lambdify(
-                    base_loop_counters.keys(),
-                    self.subs_consts(
-                        offset_expr*element_size
-                        + base_offsets[var_name]), numpy)
-                # TODO possibly differentiate between index order
-                global_load_offsets.append(offset)
-            for w in self._destinations.get(var_name, []):
-                offset_expr = self.access_to_sympy(var_name, w)
-                offset = sympy.lambdify(
-                    base_loop_counters.keys(),
-                    self.subs_consts(
-                        offset_expr*element_size
-                        + base_offsets[var_name]), numpy)
-                # TODO possibly differentiate between index order
-                global_store_offsets.append(offset)
-                # TODO take element sizes into account, return in bytes
-
-        # Generate numpy.array for each counter
-        counter_per_it = [v(iteration) for v in base_loop_counters.values()]
+    def padded(self, padding):
+        '''
+        Returns a copy of the kernel with *padding* elements added to the inner most (leading)
+        dimension of all multi-dimensional arrays, with the same constants.
+        '''
+        kernel = copy(self)
+        kernel.variables = {
+            name: (type_, size[:-1] + [size[-1] + padding] if size and len(size) > 1 else size)
+            for name, (type_, size) in self.variables.items()}
+        kernel.constants = dict(self.constants)
+        kernel._parametric = None
+        kernel._offset_engines = {}
+        return kernel
+
+    def trace_fingerprint(self, spacing=0):
+        '''
+        Returns a hashable description of the offsets generated by compile_global_offsets().
 
-        # Data access as they appear with iteration order
-        return zip_longest(zip(*[o(*counter_per_it) for o in global_load_offsets]),
-                           zip(*[o(*counter_per_it) for o in global_store_offsets]),
-                           fillvalue=None)
+        Equal fingerprints guarantee equal offsets for all iterations within both iteration spaces.
+        The length of the outer most loop is not part of it, since it only limits the number of
+        iterations, so the fingerprint stays the same if only the outer most loop is extended.
+        '''
+        load_offsets, store_offsets = self._compile_offset_engines(spacing)
+        radices = [r[1:] for r in self._loop_radices()]
+        # drop the length of the outer most loop
+        radices[-1] = radices[-1][:1] + radices[-1][2:]
+        fingerprint = [tuple(radices)]
+        for offsets in [load_offsets, store_offsets]:
+            fingerprint += [offsets.coefficients.tobytes(), offsets.base.tobytes()]
+            if offsets.fallbacks:
+                # non-affine offsets depend on the constants directly
+                fingerprint.append(offsets.constant_values)
+        return tuple(fingerprint)
 
     def print_kernel_info(self, output_file=sys.stdout):
         table = ('     idx |        min        max       step\n' +
@@ -972,7 +1263,8 @@ class KernelCode(Kernel):
         return code
 
     def assemble(self, compiler, in_filename,
-                 out_filename=None, iaca_markers=True, asm_block='auto', asm_increment=0):
+                 out_filename=None, iaca_markers=True, asm_block='auto', asm_increment=0,
+                 cache=None):
         '''
         Assembles *in_filename* to *out_filename*.
 
@@ -990,6 +1282,9 @@ class KernelCode(Kernel):
         if it is 0 (default), automatic detection will be use and might lead to an interactive user
         interface.
 
+        If a CompileCache is given as *cache*, the binary is reused if the same (marked) assembly
+        was assembled before.
+
         Returns two-tuple (filepointer, filename) to temp binary file.
         '''
         if not out_filename:
@@ -999,7 +1294,8 @@ class KernelCode(Kernel):
             if self._filename:
                 out_filename = os.path.abspath(os.path.splitext(self._filename)[0]+suffix)
             else:
-                out_filename = tempfile.mkstemp(suffix=suffix)
+                fd, out_filename = tempfile.mkstemp(suffix=suffix)
+                os.close(fd)
 
         # insert iaca markers
         if iaca_markers:
@@ -1034,23 +1330,46 @@ class KernelCode(Kernel):
             with open(in_filename, 'w') as in_file:
                 in_file.writelines(lines)
 
+        directory = os.path.dirname(os.path.realpath(in_filename))
+        if cache is not None:
+            with open(in_filename) as in_file, \
+                    open(os.path.join(directory, 'dummy.s')) as dummy_file:
+                key = cache.key('assemble', [in_file.read(), dummy_file.read()], compiler)
+            if cache.load(key, {'binary': out_filename}):
+                return out_filename
+
         try:
             # Assamble all to a binary
             subprocess.check_output(
-                [compiler, os.path.basename(in_file.name), 'dummy.s', '-o', out_filename],
-                cwd=os.path.dirname(os.path.realpath(in_file.name)))
+                [compiler, os.path.basename(in_filename), 'dummy.s', '-o', out_filename],
+                cwd=directory)
         except subprocess.CalledProcessError as e:
             print(u"Assemblation failed:", e, file=sys.stderr)
             sys.exit(1)
-        finally:
-            in_file.close()
+
+        if cache is not None:
+            cache.store(key, {'binary': out_filename})
 
         return out_filename
 
-    def compile(self, compiler, compiler_args=None):
+    @staticmethod
+    def _header_sources():
+        '''Returns the contents of the headers compiled with and included by the kernel code.'''
+        headers = os.path.join(os.path.abspath(os.path.dirname(os.path.realpath(__file__))),
+                               'headers')
+        sources = []
+        for name in ['dummy.c', 'kerncraft.h']:
+            with open(os.path.join(headers, name)) as f:
+                sources.append(f.read())
+        return sources
+
+    def compile(self, compiler, compiler_args=None, cache=None):
         '''
         Compiles source (from as_code(type_)) to assembly.
 
+        If a CompileCache is given as *cache*, the assembly is reused if the same source (and
+        headers) was compiled before with the same compiler and arguments.
+
         Returns two-tuple (filepointer, filename) to assembly file.
 
         Output can be used with Kernel.assemble()
@@ -1068,12 +1387,21 @@ class KernelCode(Kernel):
         else:
             in_file = open(self._filename+"_compilable.c", 'w')
 
-        in_file.write(self.as_code())
+        code = self.as_code()
+        in_file.write(code)
         in_file.flush()
 
-        if compiler_args is None:
-            compiler_args = []
-        compiler_args += ['-std=c99']
+        # copy, so the caller's list (e.g. from the machine file) is not extended
+        compiler_args = list(compiler_args or []) + ['-std=c99']
+
+        directory = os.path.dirname(os.path.realpath(in_file.name))
+        out_filename = os.path.splitext(in_file.name)[0]+'.s'
+        artifacts = {'kernel': out_filename, 'dummy': os.path.join(directory, 'dummy.s')}
+        if cache is not None:
+            key = cache.key('compile', [code] + self._header_sources(), compiler, compiler_args)
+            if cache.load(key, artifacts):
+                in_file.close()
+                return out_filename
 
         try:
             subprocess.check_output(
@@ -1095,13 +1423,19 @@ class KernelCode(Kernel):
         finally:
             in_file.close()
 
+        if cache is not None:
+            cache.store(key, artifacts)
+
         # Let's return the out_file name
-        return os.path.splitext(in_file.name)[0]+'.s'
+        return out_filename
 
-    def build(self, compiler, cflags=None, lflags=None, verbose=False):
+    def build(self, compiler, cflags=None, lflags=None, verbose=False, cache=None):
         '''
         compiles source to executable with likwid capabilities
 
+        If a CompileCache is given as *cache*, the executable is reused if the same source (and
+        headers) was built before with the same compiler and flags.
+
         returns the executable name
         '''
         if not (('LIKWID_INCLUDE' in os.environ or 'LIKWID_INC' in os.environ) and
@@ -1116,17 +1450,14 @@ class KernelCode(Kernel):
                   "or make sure it is found in PATH.".format(compiler), file=sys.stderr)
             sys.exit(1)
 
-        if cflags is None:
-            cflags = []
-        cflags += ['-std=c99',
+        # copy, so the caller's lists (e.g. from the machine file) are not extended
+        cflags = list(cflags or []) + ['-std=c99',
                    '-I'+os.path.abspath(os.path.dirname(os.path.realpath(__file__)))+'/headers/',
                    os.environ.get('LIKWID_INCLUDE', ''),
                    os.environ.get('LIKWID_INC', ''),
                    '-llikwid']
 
-        if lflags is None:
-            lflags = []
-        lflags += os.environ['LIKWID_LIB'].split(' ') + ['-pthread']
+        lflags = list(lflags or []) + os.environ['LIKWID_LIB'].split(' ') + ['-pthread']
 
         if not self._filename:
             source_file = tempfile.NamedTemporaryFile(
@@ -1135,7 +1466,8 @@ class KernelCode(Kernel):
         else:
             source_file = open(self._filename+"_compilable.c", 'w')
 
-        source_file.write(self.as_code(type_='likwid'))
+        code = self.as_code(type_='likwid')
+        source_file.write(code)
         source_file.flush()
 
         infiles = [os.path.abspath(os.path.dirname(os.path.realpath(__file__)))+'/headers/dummy.c',
@@ -1143,7 +1475,15 @@ class KernelCode(Kernel):
         if self._filename:
             outfile = os.path.abspath(os.path.splitext(self._filename)[0]+'.likwid_marked')
         else:
-            outfile = tempfile.mkstemp(suffix='.likwid_marked')
+            fd, outfile = tempfile.mkstemp(suffix='.likwid_marked')
+            os.close(fd)
+        if cache is not None:
+            key = cache.key('build', [code] + self._header_sources(), compiler,
+                            list(filter(bool, cflags + lflags)))
+            if cache.load(key, {'executable': outfile}):
+                source_file.close()
+                return outfile
+
         cmd = [compiler] + infiles + cflags + lflags + ['-o', outfile]
         # remove empty arguments
         cmd = list(filter(bool, cmd))
@@ -1157,6 +1497,9 @@ class KernelCode(Kernel):
         finally:
             source_file.close()
 
+        if cache is not None:
+            cache.store(key, {'executable': outfile})
+
         return outfile
 
 
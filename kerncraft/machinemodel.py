@@ -41,6 +41,54 @@ class MachineModel(object):
 
         return cs
 
+    def get_cachesims(self, cores):
+        '''Returns a list of cachesim.CacheSimulator objects (one per core) based on the machine
+        description and used core count
+
+        Cache levels with one core per group are private and replicated for every core, all
+        others are shared (as the very same cache objects) by the simulators of all cores within
+        a group. Cores are assigned to groups in order.'''
+        if cores == 1:
+            return [self.get_cachesim()]
+
+        cache_config = {c['level']: c for c in self['memory hierarchy'] if 'cache per group' in c}
+
+        for level, c in cache_config.items():
+            assert cores <= c.get('cores per group', 1)*c.get('groups', cores), \
+                'machine has less than {} cores sharing {}'.format(cores, level)
+
+        # Caches and main memories by (level, group)
+        caches = {}
+        memories = {}
+
+        def get_cache(level, core):
+            group = core//cache_config[level].get('cores per group', 1)
+            if (level, group) not in caches:
+                conf = dict(cache_config[level]['cache per group'])
+                # Instantiation has to happen from last to first level
+                for ref in ['load_from', 'store_to', 'victims_to']:
+                    if conf.get(ref) is not None:
+                        conf[ref] = get_cache(conf[ref], core)
+                caches[(level, group)] = cachesim.Cache(name=level, **conf)
+            return caches[(level, group)]
+
+        referred_levels = set([c['cache per group'].get(ref) for c in cache_config.values()
+                               for ref in ['load_from', 'store_to', 'victims_to']])
+        first_level = [level for level in cache_config if level not in referred_levels]
+        assert len(first_level) == 1, "Unable to find first cache level."
+
+        simulators = []
+        for core in range(cores):
+            first = get_cache(first_level[0], core)
+            last = first
+            while last.load_from is not None:
+                last = last.load_from
+            if id(last) not in memories:
+                memories[id(last)] = cachesim.MainMemory(
+                    last_level_load=last, last_level_store=last)
+            simulators.append(cachesim.CacheSimulator(first, memories[id(last)]))
+        return simulators
+
     def get_bandwidth(self, cache_level, read_streams, write_streams, threads_per_core, cores=None):
         '''Returns best fitting bandwidth according to parameters
 
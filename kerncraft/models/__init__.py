@@ -15,5 +15,6 @@ from .ecm import ECM, ECMData, ECMCPU
 from .roofline import Roofline, RooflineIACA
 from .benchmark import Benchmark
 from .layer_condition import LC
+from .padding import Padding
 
-__all__ = ['ECM', 'ECMData', 'ECMCPU', 'Roofline', 'RooflineIACA', 'Benchmark', 'LC']
+__all__ = ['ECM', 'ECMData', 'ECMCPU', 'Roofline', 'RooflineIACA', 'Benchmark', 'LC', 'Padding']
@@ -11,6 +11,7 @@ import six
 from distutils.spawn import find_executable
 
 from kerncraft.kernel import KernelCode
+from kerncraft.compilecache import get_compile_cache
 
 
 class Benchmark(object):
@@ -24,11 +25,12 @@ class Benchmark(object):
     def configure_arggroup(cls, parser):
         pass
 
-    def __init__(self, kernel, machine, args=None, parser=None):
+    def __init__(self, kernel, machine, args=None, parser=None, predictor_cache=None):
         """
         *kernel* is a Kernel object
         *machine* describes the machine (cpu, cache and memory) characteristics
         *args* (optional) are the parsed arguments from the comand line
+        *predictor_cache* (optional) is a PredictorCache shared with other models
         """
         if not isinstance(kernel, KernelCode):
             raise ValueError("Kernel was not derived from code, can not perform Benchmark "
@@ -89,7 +91,8 @@ class Benchmark(object):
     def analyze(self):
         bench = self.kernel.build(self.machine['compiler'],
                                   cflags=self.machine['compiler flags'],
-                                  verbose=self._args.verbose > 1)
+                                  verbose=self._args.verbose > 1,
+                                  cache=get_compile_cache(self._args))
 
         # Build arguments to pass to command:
         args = [bench] + [six.text_type(s) for s in list(self.kernel.constants.values())]
@@ -4,13 +4,9 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 from __future__ import division
 
-import copy
 import sys
-import subprocess
-import re
 import math
 from pprint import pprint, pformat
-from distutils.spawn import find_executable
 from itertools import chain
 from copy import deepcopy
 
@@ -26,7 +22,10 @@ import sympy
 
 from kerncraft.prefixedunit import PrefixedUnit
 from kerncraft.kernel import KernelCode
-from kerncraft.cacheprediction import LayerConditionPredictor, CacheSimulationPredictor
+from kerncraft import incore
+from kerncraft.compilecache import get_compile_cache
+from kerncraft.cacheprediction import (
+    get_predictor, print_array_traffic, print_prefetch_traffic, print_layer_condition_transitions)
 
 
 def round_to_next(x, base):
@@ -69,43 +68,52 @@ class ECMData(object):
     def configure_arggroup(cls, parser):
         pass
 
-    def __init__(self, kernel, machine, args=None, parser=None):
+    def __init__(self, kernel, machine, args=None, parser=None, predictor_cache=None):
         """
         *kernel* is a Kernel object
         *machine* describes the machine (cpu, cache and memory) characteristics
         *args* (optional) are the parsed arguments from the comand line
+        *predictor_cache* (optional) is a PredictorCache shared with other models
         """
         self.kernel = kernel
         self.machine = machine
         self._args = args
         self._parser = parser
+        self._predictor_cache = predictor_cache
 
         if args:
             # handle CLI info
             pass
 
     def calculate_cache_access(self):
-        if self._args.cache_predictor == 'SIM':
-            self.predictor = CacheSimulationPredictor(self.kernel, self.machine)
-        elif self._args.cache_predictor == 'LC':
-            self.predictor = LayerConditionPredictor(self.kernel, self.machine)
-        else:
-            raise NotImplementedError("Unknown cache predictor, only LC (layer condition) and "
-                                      "SIM (cache simulation with pycachesim) is supported.")
+        self.predictor = get_predictor(
+            self.kernel, self.machine, self._args, cache=self._predictor_cache)
         self.results = {'cycles': [],  # will be filled by caclculate_cycles()
                         'misses': self.predictor.get_misses(),
                         'hits': self.predictor.get_hits(),
                         'evicts': self.predictor.get_evicts(),
                         'verbose infos': self.predictor.get_infos()}  # only for verbose outputs
 
-    def calculate_cycles(self):
+    def transfer_cycles(self, cores=None):
+        '''
+        Returns the cycles per cache line of work of the transfer between each cache level and
+        the next, as a list of (transfer, cycles, bandwidth, bandwidth kernel). Bandwidth and
+        bandwidth kernel are None for levels with cycles per cacheline transfer.
+
+        Bandwidth limited transfers use the bandwidth measured with *cores* cores, or the maximum
+        bandwidth of all measurements if *cores* is None. Beyond the largest measured core count,
+        bandwidth is assumed to be saturated.
+        '''
         element_size = self.kernel.datatypes_size[self.kernel.datatype]
         elements_per_cacheline = float(self.machine['cacheline size']) // element_size
         
         misses, evicts = (self.predictor.get_misses(), self.predictor.get_evicts())
 
+        transfers = []
         for cache_level, cache_info in list(enumerate(self.machine['memory hierarchy']))[:-1]:
             cache_cycles = cache_info['cycles per cacheline transfer']
+            next_level = self.machine['memory hierarchy'][cache_level+1]['level']
+            bw, measurement_kernel = None, None
 
             if cache_cycles is not None:
                 # only cache cycles count
@@ -121,8 +129,15 @@ class ECMData(object):
                 write_streams = evicts[cache_level]
                 # second, try to find best fitting kernel (closest to stream seen stream counts):
                 threads_per_core = 1
+                measured_cores = None
+                if cores is not None:
+                    measured_cores = self.machine['benchmarks']['measurements'][next_level][
+                        threads_per_core]['cores']
+                    measured_cores = max(
+                        [c for c in measured_cores if c <= cores] or [min(measured_cores)])
                 bw, measurement_kernel = self.machine.get_bandwidth(
-                    cache_level+1, read_streams, write_streams, threads_per_core)
+                    cache_level+1, read_streams, write_streams, threads_per_core,
+                    cores=measured_cores)
 
                 # calculate cycles
                 cycles = float(misses[cache_level] + evicts[cache_level]) * \
@@ -133,23 +148,33 @@ class ECMData(object):
                     cycles += misses[cache_level] * \
                               cache_info['penalty cycles per read stream']
 
-            if cache_cycles is None:
+            transfers.append(('{}-{}'.format(cache_info['level'], next_level),
+                              cycles, bw, measurement_kernel))
+        return transfers
+
+    def calculate_cycles(self):
+        for transfer, cycles, bw, measurement_kernel in self.transfer_cycles():
+            if bw is not None:
                 self.results.update({
                     'memory bandwidth kernel': measurement_kernel,
                     'memory bandwidth': bw})
 
-            self.results['cycles'].append((
-                '{}-{}'.format(
-                    cache_info['level'], self.machine['memory hierarchy'][cache_level+1]['level']),
-                cycles))
+            self.results['cycles'].append((transfer, cycles))
 
             # TODO remove the following by makeing testcases more versatile:
-            self.results['{}-{}'.format(
-                cache_info['level'], self.machine['memory hierarchy'][cache_level+1]['level'])
-                ] = cycles
+            self.results[transfer] = cycles
 
         return self.results
 
+    def bandwidth_cycles(self, cores):
+        '''
+        Returns the cycles per cache line of work *cores* cores need together for each bandwidth
+        limited transfer (levels without cycles per cacheline transfer), as a list of (transfer,
+        cycles, bandwidth, bandwidth kernel), based on the bandwidth measured with that many cores
+        (see transfer_cycles()).
+        '''
+        return [t for t in self.transfer_cycles(cores) if t[2] is not None]
+
     def analyze(self):
         self.calculate_cache_access()
         self.calculate_cycles()
@@ -185,6 +210,15 @@ class ECMData(object):
     def report(self, output_file=sys.stdout):
         if self._args and self._args.verbose > 1:
             print('{}'.format(pformat(self.results['verbose infos'])), file=output_file)
+            if self.results['verbose infos'].get('arrays'):
+                print_array_traffic(
+                    self.results['verbose infos']['arrays'], self.machine, output_file)
+            if self.results['verbose infos'].get('prefetch'):
+                print_prefetch_traffic(
+                    self.results['verbose infos']['prefetch'], self.machine, output_file)
+            if self.results['verbose infos'].get('transitions'):
+                print_layer_condition_transitions(
+                    self.results['verbose infos']['transitions'], self.machine, output_file)
             
         for level, cycles in self.results['cycles']:
             print('{} = {}'.format(
@@ -204,12 +238,13 @@ class ECMCPU(object):
     def configure_arggroup(cls, parser):
         pass
 
-    def __init__(self, kernel, machine, args=None, parser=None):
+    def __init__(self, kernel, machine, args=None, parser=None, predictor_cache=None):
         """
         *kernel* is a Kernel object
         *machine* describes the machine (cpu, cache and memory) characteristics
         *args* (optional) are the parsed arguments from the comand line
         if *args* is given also *parser* has to be provided
+        *predictor_cache* (optional) is a PredictorCache shared with other models
         """
         if not isinstance(kernel, KernelCode):
             raise ValueError("Kernel was not derived from code, can not perform ECMCPU analysis."
@@ -229,69 +264,22 @@ class ECMCPU(object):
 
     def analyze(self):
         # For the IACA/CPU analysis we need to compile and assemble
+        compile_cache = get_compile_cache(self._args)
         asm_name = self.kernel.compile(
-            self.machine['compiler'], compiler_args=self.machine['compiler flags'])
+            self.machine['compiler'], compiler_args=self.machine['compiler flags'],
+            cache=compile_cache)
         bin_name = self.kernel.assemble(
             self.machine['compiler'], asm_name, iaca_markers=True, asm_block=self._args.asm_block,
-            asm_increment=self._args.asm_increment)
+            asm_increment=self._args.asm_increment, cache=compile_cache)
 
-        # Making sure iaca.sh is available:
-        if find_executable('iaca.sh') is None:
-            print("iaca.sh was not found. Make sure it is found in PATH.", file=sys.stderr)
-            sys.exit(1)
-
-        try:
-            cmd = ['iaca.sh', '-64', '-arch', self.machine['micro-architecture'], bin_name]
-            if self._args.verbose >= 3:
-                print('Executing:', ' '.join(cmd))
-            iaca_output = subprocess.check_output(cmd).decode('utf-8')
-        except OSError as e:
-            print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
-            print(e, file=sys.stderr)
-            sys.exit(1)
-        except subprocess.CalledProcessError as e:
-            print("IACA throughput analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-
-        # Get total cycles per loop iteration
-        match = re.search(
-            r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
-        assert match, "Could not find Block Throughput in IACA output."
-        block_throughput = float(match.groups()[0])
-
-        # Find ports and cyles per port
-        ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
-        cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
-        assert ports and cycles, "Could not find ports/cylces lines in IACA output."
-        ports = [p.strip() for p in ports[0].split('|')][2:]
-        cycles = [c.strip() for c in cycles[0].split('|')][2:]
-        port_cycles = []
-        for i in range(len(ports)):
-            if '-' in ports[i] and ' ' in cycles[i]:
-                subports = [p.strip() for p in ports[i].split('-')]
-                subcycles = [c for c in cycles[i].split(' ') if bool(c)]
-                port_cycles.append((subports[0], float(subcycles[0])))
-                port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
-            elif ports[i] and cycles[i]:
-                port_cycles.append((ports[i], float(cycles[i])))
-        port_cycles = dict(port_cycles)
-
-        match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
-        assert match, "Could not find Uops in IACA output."
-        uops = float(match.groups()[0])
-
-        # Get latency prediction from IACA
-        try:
-            iaca_latency_output = subprocess.check_output(
-                ['iaca.sh', '-64', '-analysis', 'LATENCY', '-arch',
-                 self.machine['micro-architecture'], bin_name]).decode('utf-8')
-        except subprocess.CalledProcessError as e:
-            print("IACA latency analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-        match = re.search(
-            r'^Latency: ([0-9\.]+) Cycles', iaca_latency_output, re.MULTILINE)
-        assert match, "Could not find Latency in IACA latency analysis output."
-        block_latency = float(match.groups()[0])
+        # Throughput and latency analysis by the selected in-core backend (IACA or built-in)
+        analysis = incore.analyze(self.kernel, self.machine, bin_name, self._args)
+        iaca_output = analysis['IACA output']
+        iaca_latency_output = analysis['IACA latency output']
+        block_throughput = analysis['block throughput']
+        block_latency = analysis['block latency']
+        port_cycles = analysis['port cycles']
+        uops = analysis['uops']
 
         # Normalize to cycles per cacheline
         elements_per_block = abs(self.kernel.asm_block['pointer_increment']
@@ -307,6 +295,9 @@ class ECMCPU(object):
         uops = uops*block_to_cl_ratio
         cl_throughput = block_throughput*block_to_cl_ratio
         cl_latency = block_latency*block_to_cl_ratio
+        cl_loop_carried_latency = None
+        if analysis['loop-carried latency'] is not None:
+            cl_loop_carried_latency = analysis['loop-carried latency']*block_to_cl_ratio
 
         # Compile most relevant information
         T_OL = max(
@@ -318,6 +309,12 @@ class ECMCPU(object):
         if T_nOL < cl_throughput:
             T_OL = cl_throughput
 
+        # Iterations can not follow each other faster than the loop-carried dependency chain.
+        # Only T_OL is bound: T_nOL is added serially to the data transfers, which are not delayed
+        # by a register dependency chain, so bounding it would count the chain twice.
+        if cl_loop_carried_latency is not None:
+            T_OL = max(T_OL, cl_loop_carried_latency)
+
         # Use latency if requested
         if self._args.latency:
             T_OL = cl_latency
@@ -327,11 +324,14 @@ class ECMCPU(object):
             'port cycles': port_cycles,
             'cl throughput': cl_throughput,
             'cl latency': cl_latency,
+            'cl loop-carried latency': cl_loop_carried_latency,
+            'loop-carried chain': analysis['loop-carried chain'],
             'uops': uops,
             'T_nOL': T_nOL,
             'T_OL': T_OL,
             'IACA output': iaca_output,
-            'IACA latency output': iaca_latency_output}
+            'IACA latency output': iaca_latency_output,
+            'in-core model': analysis['in-core model']}
 
 
     def conv_cy(self, cy_cl, unit, default='cy/CL'):
@@ -359,7 +359,7 @@ class ECMCPU(object):
 
     def report(self, output_file=sys.stdout):
         if self._args and self._args.verbose > 2:
-            print("IACA Output:", file=output_file)
+            print("{} Output:".format(self.results['in-core model']), file=output_file)
             print(self.results['IACA output'], file=output_file)
             print(self.results['IACA latency output'], file=output_file)
             print('', file=output_file)
@@ -376,8 +376,22 @@ class ECMCPU(object):
                       self.conv_cy(self.results['cl latency'], self._args.unit)),
                   file=output_file)
 
+            if self.results['cl loop-carried latency']:
+                print('Loop-carried dependency: {}'.format(
+                          self.conv_cy(self.results['cl loop-carried latency'], self._args.unit)),
+                      file=output_file)
+                for line in self.results['loop-carried chain']:
+                    print('    ' + line, file=output_file)
+
         print('T_nOL = {:.1f} cy/CL'.format(self.results['T_nOL']), file=output_file)
         print('T_OL = {:.1f} cy/CL'.format(self.results['T_OL']), file=output_file)
+        if (self.results['cl loop-carried latency'] and
+                self.results['T_OL'] == self.results['cl loop-carried latency'] and
+                self.results['T_OL'] > self.results['cl throughput']):
+            print('T_OL is bound by the loop-carried dependency chain (T_nOL is not):',
+                  file=output_file)
+            for line in self.results['loop-carried chain']:
+                print('    ' + line, file=output_file)
 
 
 class ECM(object):
@@ -395,12 +409,17 @@ class ECM(object):
         parser.add_argument(
             '--ecm-plot',
             help='Filename to save ECM plot to (supported extensions: pdf, png, svg and eps)')
+        parser.add_argument(
+            '--ecm-scaling', action='store_true',
+            help='Predict performance for 1 up to "cores per socket" cores, limited by the '
+                 'bandwidths measured for each core count (benchmarks in machine file).')
 
-    def __init__(self, kernel, machine, args=None, parser=None):
+    def __init__(self, kernel, machine, args=None, parser=None, predictor_cache=None):
         """
         *kernel* is a Kernel object
         *machine* describes the machine (cpu, cache and memory) characteristics
         *args* (optional) are the parsed arguments from the comand line
+        *predictor_cache* (optional) is a PredictorCache shared with other models
         """
         if not isinstance(kernel, KernelCode):
             raise ValueError("Kernel was not derived from code, can not perform ECM analysis. "
@@ -414,13 +433,14 @@ class ECM(object):
             pass
 
         self._CPU = ECMCPU(kernel, machine, args, parser)
-        self._data = ECMData(kernel, machine, args, parser)
+        self._data = ECMData(kernel, machine, args, parser, predictor_cache=predictor_cache)
 
     def analyze(self):
         self._CPU.analyze()
         self._data.analyze()
-        self.results = copy.deepcopy(self._CPU.results)
-        self.results.update(copy.deepcopy(self._data.results))
+        # Both sub-models only read their results after analyze(), so no copies are needed
+        self.results = dict(self._CPU.results)
+        self.results.update(self._data.results)
 
         # Saturation/multi-core scaling analysis
         # very simple approach. Assumptions are:
@@ -435,6 +455,36 @@ class ECM(object):
                     self.results['T_nOL'] + sum([c[1] for c in self.results['cycles']])) /
                 self.results['cycles'][-1][1]))
 
+        if self._args and self._args.ecm_scaling:
+            self.results.update(self.scaling_curve())
+
+    def scaling_curve(self):
+        '''
+        Returns the 'scaling curve' for 1 up to cores per socket cores and the 'saturation cores'
+        (None if bandwidth does not saturate).
+
+        Each point has the 'cycles' per cache line of work of all cores together, the
+        'bottleneck' ('ECM' or the limiting transfer) and its 'bandwidth'. Cores work
+        independently at the single core ECM prediction (with transfers at the bandwidth measured
+        with a single core), until a bandwidth limited transfer takes longer at the bandwidth
+        measured with that many cores. Transfers with cycles per cacheline are assumed to scale
+        with the number of cores.
+        '''
+        T_ECM = max(self.results['T_OL'],
+                    self.results['T_nOL'] + sum([t[1] for t in self._data.transfer_cycles(1)]))
+        curve = []
+        saturation_cores = None
+        for cores in range(1, self.machine['cores per socket']+1):
+            point = {'cores': cores, 'cycles': T_ECM/cores, 'bottleneck': 'ECM',
+                     'bandwidth': None}
+            for transfer, cycles, bw, measurement_kernel in self._data.bandwidth_cycles(cores):
+                if cycles > point['cycles']:
+                    point.update({'cycles': cycles, 'bottleneck': transfer, 'bandwidth': bw})
+            if point['bottleneck'] != 'ECM' and saturation_cores is None:
+                saturation_cores = cores
+            curve.append(point)
+        return {'scaling curve': curve, 'saturation cores': saturation_cores}
+
     def report(self, output_file=sys.stdout):
         report = ''
         if self._args and self._args.verbose > 1:
@@ -459,7 +509,24 @@ class ECM(object):
                                                 self.results['T_nOL'], self.results['T_OL']))
                             for i in range(len(self.results['cycles']))]))
 
-        report += '\nsaturating at {} cores'.format(self.results['scaling cores'])
+        if 'scaling curve' in self.results:
+            report += '\n\ncores |      performance | bottleneck | bandwidth'
+            report += '\n------+-{}-+------------+----------'.format('-'*16)
+            for point in self.results['scaling curve']:
+                report += '\n{:>5} | {:>16} | {:>10} | {}'.format(
+                    point['cores'],
+                    str(self._CPU.conv_cy(point['cycles'], self._args.unit)),
+                    point['bottleneck'],
+                    point['bandwidth'] if point['bandwidth'] is not None else '')
+            if self.results['saturation cores'] is None:
+                report += '\nnot saturating up to {} cores'.format(
+                    self.machine['cores per socket'])
+            else:
+                report += '\nsaturating at {} cores ({} bound)'.format(
+                    self.results['saturation cores'],
+                    self.results['scaling curve'][self.results['saturation cores']-1]['bottleneck'])
+        else:
+            report += '\nsaturating at {} cores'.format(self.results['scaling cores'])
 
         print(report, file=output_file)
 
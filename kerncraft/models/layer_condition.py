@@ -19,6 +19,7 @@ import sympy
 
 from kerncraft.prefixedunit import PrefixedUnit
 from kerncraft.kernel import KernelCode
+from kerncraft.cacheprediction import get_predictor, print_layer_condition_transitions
 
 
 # Not useing functools.cmp_to_key, because it does not exit in python 2.x
@@ -55,16 +56,18 @@ class LC(object):
     def configure_arggroup(cls, parser):
         pass
 
-    def __init__(self, kernel, machine, args=None, parser=None):
+    def __init__(self, kernel, machine, args=None, parser=None, predictor_cache=None):
         """
         *kernel* is a Kernel object
         *machine* describes the machine (cpu, cache and memory) characteristics
         *args* (optional) are the parsed arguments from the comand line
+        *predictor_cache* (optional) is a PredictorCache shared with other models
         """
         self.kernel = kernel
         self.machine = machine
         self._args = args
         self._parser = parser
+        self._predictor_cache = predictor_cache
 
         if args:
             # handle CLI info
@@ -231,6 +234,12 @@ class LC(object):
         
         self.results = self.calculate_cache_access()
 
+        # With the parametric predictor, also report where the conditions break along the sweep
+        if self._args and self._args.cache_predictor == 'PLC':
+            predictor = get_predictor(
+                self.kernel, self.machine, self._args, cache=self._predictor_cache)
+            self.results['transitions'] = predictor.get_infos()['transitions']
+
     def report(self, output_file=sys.stdout):
         if self._args and self._args.verbose > 2:
             pprint(self.results)
@@ -248,3 +257,8 @@ class LC(object):
                                 print("{} <= {:.0f}".format(s, v.n()), file=output_file)
                             else:
                                 print("{} <= {}".format(s, v), file=output_file)
+
+        if self.results.get('transitions'):
+            print('', file=output_file)
+            print_layer_condition_transitions(
+                self.results['transitions'], self.machine, output_file)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+from pprint import pformat
+
+from kerncraft.cacheprediction import get_predictor
+
+
+class Padding(object):
+    """
+    class representation of the array padding exploration
+
+    Simulates the set-associative caches with padding between arrays (spacing in the address
+    space of Kernel.compile_global_offsets()) and of the leading array dimension, and reports the
+    padding with the least misses per cache level. Misses without padding are compared to a fully
+    associative LRU cache of the same size (ReuseDistancePredictor), to flag conflict misses.
+
+    Simulations use the cache predictor selected by --cache-predictor (SIM or SSIM) and its
+    options. The fully associative cache is evaluated on the very same benchmark window, after
+    all preceding iterations, as is the simulation without padding.
+    """
+
+    name = "Array padding exploration"
+
+    @classmethod
+    def configure_arggroup(cls, parser):
+        parser.add_argument(
+            '--array-spacing', metavar='BYTES', type=int, nargs='+',
+            default=[0, 64, 256, 1024, 4096],
+            help='Paddings between arrays (in bytes) to simulate. (default: 0 64 256 1024 4096)')
+        parser.add_argument(
+            '--leading-padding', metavar='ELEMENTS', type=int, nargs='+', default=[0, 1, 8],
+            help='Paddings of the leading (inner most) array dimension (in elements) to '
+                 'simulate. (default: 0 1 8)')
+        parser.add_argument(
+            '--conflict-threshold', metavar='RATIO', type=float, default=0.2,
+            help='Conflict misses, relative to the misses of a fully associative cache, above '
+                 'which a cache level is flagged. (default: 0.2)')
+
+    def __init__(self, kernel, machine, args=None, parser=None, predictor_cache=None):
+        """
+        *kernel* is a Kernel object
+        *machine* describes the machine (cpu, cache and memory) characteristics
+        *args* (optional) are the parsed arguments from the comand line
+        *predictor_cache* (optional) is a PredictorCache shared with other models
+        """
+        self.kernel = kernel
+        self.machine = machine
+        self._args = args
+        self._parser = parser
+        self._predictor_cache = predictor_cache
+
+        if args:
+            self.spacings = args.array_spacing
+            self.leading_paddings = args.leading_padding
+            self.conflict_threshold = args.conflict_threshold
+        else:
+            self.spacings = [0, 64, 256, 1024, 4096]
+            self.leading_paddings = [0, 1, 8]
+            self.conflict_threshold = 0.2
+
+    def analyze(self):
+        levels = [c['level'] for c in self.machine['memory hierarchy'][:-1]]
+        paddings = []
+        for leading_padding in sorted(set([0] + self.leading_paddings)):
+            kernel = self.kernel.padded(leading_padding) if leading_padding else self.kernel
+            for spacing in sorted(set([0] + self.spacings)):
+                predictor = get_predictor(kernel, self.machine, self._args,
+                                          cache=self._predictor_cache, spacing=spacing)
+                if not paddings:
+                    unpadded_infos = predictor.get_infos()
+                paddings.append({'spacing': spacing,
+                                 'leading padding': leading_padding,
+                                 'misses': predictor.get_misses()})
+
+        # Paddings are sorted, so the smallest padding wins on equal misses
+        best = {}
+        for level, name in enumerate(levels):
+            best[name] = min(paddings, key=lambda p: p['misses'][level])
+
+        # Conflict misses without padding, on the benchmark window of its simulation
+        element_size = self.kernel.datatypes_size[self.kernel.datatype]
+        cacheline_iterations = int(self.machine['cacheline size'])//element_size*int(
+            list(self.kernel.get_loop_stack(subs_consts=True))[-1]['increment'])
+        misses = paddings[0]['misses']
+        fully_associative = get_predictor(
+            self.kernel, self.machine, self._args, cache=self._predictor_cache,
+            predictor_name='RD', start=unpadded_infos['sampling']['positions'][0],
+            window=int(unpadded_infos['cachelines in stats']*cacheline_iterations)).get_misses()
+        conflicts = [max(0.0, m - fa) for m, fa in zip(misses, fully_associative)]
+        flagged = [name for name, c, fa in zip(levels, conflicts, fully_associative)
+                   if c > self.conflict_threshold*max(fa, 1.0)]
+
+        self.results = {'paddings': paddings,
+                        'best': best,
+                        'misses': misses,
+                        'fully associative misses': fully_associative,
+                        'conflict misses': conflicts,
+                        'conflict levels': flagged}
+
+    def report(self, output_file=sys.stdout):
+        if self._args and self._args.verbose > 2:
+            print('{}'.format(pformat(self.results)), file=output_file)
+
+        levels = [c['level'] for c in self.machine['memory hierarchy'][:-1]]
+        print('Misses (cache lines per cache line of work):', file=output_file)
+        print('spacing [B] | leading padding | ' +
+              ' | '.join(['{:>6}'.format(l) for l in levels]), file=output_file)
+        for p in self.results['paddings']:
+            print('{:>11} | {:>15} | '.format(p['spacing'], p['leading padding']) +
+                  ' | '.join(['{:>6.2f}'.format(m) for m in p['misses']]), file=output_file)
+        print('', file=output_file)
+
+        for name in levels:
+            best = self.results['best'][name]
+            print('{}: least misses with {} B spacing and {} elements leading padding'.format(
+                name, best['spacing'], best['leading padding']), file=output_file)
+
+        for name, conflicts, fa in zip(levels, self.results['conflict misses'],
+                                       self.results['fully associative misses']):
+            if name in self.results['conflict levels']:
+                print('WARNING: {:.2f} conflict misses in {} without padding (fully associative: '
+                      '{:.2f})'.format(conflicts, name, fa), file=output_file)
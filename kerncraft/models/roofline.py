@@ -7,17 +7,18 @@ from __future__ import division
 
 from functools import reduce
 import operator
-import subprocess
-import re
 import sys
 from pprint import pformat  # Do not use pprint, breaks in combination with --store and StringIO
-from distutils.spawn import find_executable
 
 import sympy
 
 from kerncraft.prefixedunit import PrefixedUnit
 from kerncraft.kernel import KernelCode
-from kerncraft.cacheprediction import LayerConditionPredictor, CacheSimulationPredictor
+from kerncraft import incore
+from kerncraft.compilecache import get_compile_cache
+from kerncraft.cacheprediction import (
+    get_predictor, print_array_traffic, print_prefetch_traffic, print_layer_condition_transitions,
+    OFFSET_CHUNK_SIZE)
 
 
 class Roofline(object):
@@ -33,29 +34,26 @@ class Roofline(object):
     def configure_arggroup(cls, parser):
         pass
 
-    def __init__(self, kernel, machine, args=None, parser=None):
+    def __init__(self, kernel, machine, args=None, parser=None, predictor_cache=None):
         """
         *kernel* is a Kernel object
         *machine* describes the machine (cpu, cache and memory) characteristics
         *args* (optional) are the parsed arguments from the comand line
+        *predictor_cache* (optional) is a PredictorCache shared with other models
         """
         self.kernel = kernel
         self.machine = machine
         self._args = args
         self._parser = parser
+        self._predictor_cache = predictor_cache
 
         if args:
             # handle CLI info
             pass
 
     def calculate_cache_access(self):
-        if self._args.cache_predictor == 'SIM':
-            self.predictor = CacheSimulationPredictor(self.kernel, self.machine)
-        elif self._args.cache_predictor == 'LC':
-            self.predictor = LayerConditionPredictor(self.kernel, self.machine)
-        else:
-            raise NotImplementedError("Unknown cache predictor, only LC (layer condition) and "
-                                      "SIM (cache simulation with pycachesim) is supported.")
+        self.predictor = get_predictor(
+            self.kernel, self.machine, self._args, cache=self._predictor_cache)
         self.results = {'misses': self.predictor.get_misses(),
                         'hits': self.predictor.get_hits(),
                         'evicts': self.predictor.get_evicts(),
@@ -76,10 +74,12 @@ class Roofline(object):
 
         # CPU-L1 stats (in bytes!)
         # We compile CPU-L1 stats on our own, because cacheprediction only works on cache lines
-        read_offsets, write_offsets = zip(*list(self.kernel.compile_global_offsets(
-            iteration=range(0, elements_per_cacheline))))
-        read_offsets = set([item for sublist in read_offsets for item in sublist])
-        write_offsets = set([item for sublist in write_offsets for item in sublist])
+        read_offsets = set()
+        write_offsets = set()
+        for loads, stores in self.kernel.compile_global_offsets(
+                iteration=range(0, elements_per_cacheline), chunk_size=OFFSET_CHUNK_SIZE):
+            read_offsets.update(loads.ravel().tolist())
+            write_offsets.update(stores.ravel().tolist())
         
         write_streams = len(write_offsets)
         read_streams = len(read_offsets) + write_streams # write-allocate
@@ -186,6 +186,15 @@ class Roofline(object):
         
         if self._args and self._args.verbose >= 1:
             print('{}'.format(pformat(self.results['verbose infos'])), file=output_file)
+            if self.results['verbose infos'].get('arrays'):
+                print_array_traffic(
+                    self.results['verbose infos']['arrays'], self.machine, output_file)
+            if self.results['verbose infos'].get('prefetch'):
+                print_prefetch_traffic(
+                    self.results['verbose infos']['prefetch'], self.machine, output_file)
+            if self.results['verbose infos'].get('transitions'):
+                print_layer_condition_transitions(
+                    self.results['verbose infos']['transitions'], self.machine, output_file)
             print('Bottlenecks:', file=output_file)
             print('  level | a. intensity |   performance   |   bandwidth  | bandwidth kernel',
                   file=output_file)
@@ -232,85 +241,39 @@ class RooflineIACA(Roofline):
     def configure_arggroup(cls, parser):
         pass
 
-    def __init__(self, kernel, machine, args=None, parser=None):
+    def __init__(self, kernel, machine, args=None, parser=None, predictor_cache=None):
         """
         *kernel* is a Kernel object
         *machine* describes the machine (cpu, cache and memory) characteristics
         *args* (optional) are the parsed arguments from the comand line
         if *args* is given also *parser* has to be provided
+        *predictor_cache* (optional) is a PredictorCache shared with other models
         """
         if not isinstance(kernel, KernelCode):
             raise ValueError("Kernel was not derived from code, can not perform RooflineIACA "
                              "analysis. Try Roofline.")
-        Roofline.__init__(self, kernel, machine, args, parser)
+        Roofline.__init__(self, kernel, machine, args, parser, predictor_cache=predictor_cache)
 
     def analyze(self):
         self.results = self.calculate_cache_access()
 
         # For the IACA/CPU analysis we need to compile and assemble
+        compile_cache = get_compile_cache(self._args)
         asm_name = self.kernel.compile(
-            self.machine['compiler'], compiler_args=self.machine['compiler flags'])
+            self.machine['compiler'], compiler_args=self.machine['compiler flags'],
+            cache=compile_cache)
         bin_name = self.kernel.assemble(
            self.machine['compiler'], asm_name, iaca_markers=True, asm_block=self._args.asm_block,
-           asm_increment=self._args.asm_increment)
+           asm_increment=self._args.asm_increment, cache=compile_cache)
 
-        # Making sure iaca.sh is available:
-        if find_executable('iaca.sh') is None:
-            print("iaca.sh was not found. Make sure it is found in PATH.", file=sys.stderr)
-            sys.exit(1)
-
-        # Get total cycles per loop iteration
-        try:
-            cmd = ['iaca.sh', '-64', '-arch', self.machine['micro-architecture'], bin_name]
-            iaca_output = subprocess.check_output(cmd).decode('utf-8')
-        except OSError as e:
-            print("IACA execution failed:", ' '.join(cmd), file=sys.stderr)
-            print(e, file=sys.stderr)
-            sys.exit(1)
-        except subprocess.CalledProcessError as e:
-            print("IACA throughput analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-
-        match = re.search(
-            r'^Block Throughput: ([0-9\.]+) Cycles', iaca_output, re.MULTILINE)
-        assert match, "Could not find Block Throughput in IACA output."
-        block_throughput = float(match.groups()[0])
-
-        # Find ports and cyles per port
-        ports = [l for l in iaca_output.split('\n') if l.startswith('|  Port  |')]
-        cycles = [l for l in iaca_output.split('\n') if l.startswith('| Cycles |')]
-        assert ports and cycles, "Could not find ports/cylces lines in IACA output."
-        ports = [p.strip() for p in ports[0].split('|')][2:]
-        cycles = [p.strip() for p in cycles[0].split('|')][2:]
-        port_cycles = []
-        for i in range(len(ports)):
-            if '-' in ports[i] and ' ' in cycles[i]:
-                subports = [p.strip() for p in ports[i].split('-')]
-                subcycles = [c for c in cycles[i].split(' ') if bool(c)]
-                port_cycles.append((subports[0], float(subcycles[0])))
-                port_cycles.append((subports[0]+subports[1], float(subcycles[1])))
-            elif ports[i] and cycles[i]:
-                port_cycles.append((ports[i], float(cycles[i])))
-        port_cycles = dict(port_cycles)
-
-        match = re.search(r'^Total Num Of Uops: ([0-9]+)', iaca_output, re.MULTILINE)
-        assert match, "Could not find Uops in IACA output."
-        uops = float(match.groups()[0])
-
-        # Get latency prediction from IACA
-        try:
-            iaca_latency_output = subprocess.check_output(
-                ['iaca.sh', '-64', '-analysis', 'LATENCY', '-arch',
-                 self.machine['micro-architecture'], bin_name]).decode('utf-8')
-        except subprocess.CalledProcessError as e:
-            print("IACA latency analysis failed:", e, file=sys.stderr)
-            sys.exit(1)
-
-        # Get predicted latency
-        match = re.search(
-            r'^Latency: ([0-9\.]+) Cycles', iaca_latency_output, re.MULTILINE)
-        assert match, "Could not find Latency in IACA latency analysis output."
-        block_latency = float(match.groups()[0])
+        # Throughput and latency analysis by the selected in-core backend (IACA or built-in)
+        analysis = incore.analyze(self.kernel, self.machine, bin_name, self._args)
+        iaca_output = analysis['IACA output']
+        iaca_latency_output = analysis['IACA latency output']
+        block_throughput = analysis['block throughput']
+        block_latency = analysis['block latency']
+        port_cycles = analysis['port cycles']
+        uops = analysis['uops']
 
         # Normalize to cycles per cacheline
         elements_per_block = abs(self.kernel.asm_block['pointer_increment']
@@ -328,6 +291,13 @@ class RooflineIACA(Roofline):
         cl_latency = block_latency*block_to_cl_ratio
         flops_per_element = sum(self.kernel._flops.values())
 
+        # Iterations can not follow each other faster than the loop-carried dependency chain
+        block_cycles = block_throughput
+        cl_loop_carried_latency = None
+        if analysis['loop-carried latency'] is not None:
+            block_cycles = max(block_throughput, analysis['loop-carried latency'])
+            cl_loop_carried_latency = analysis['loop-carried latency']*block_to_cl_ratio
+
         # Overwrite CPU-L1 stats, because they are covered by IACA
         self.results['mem bottlenecks'][0] = None
 
@@ -337,15 +307,18 @@ class RooflineIACA(Roofline):
                 'port cycles': port_cycles,
                 'cl throughput': cl_throughput,
                 'cl latency': cl_latency,
+                'cl loop-carried latency': cl_loop_carried_latency,
+                'loop-carried chain': analysis['loop-carried chain'],
                 'uops': uops,
                 'performance throughput':
-                    self.machine['clock']/block_throughput*elements_per_block*flops_per_element
+                    self.machine['clock']/block_cycles*elements_per_block*flops_per_element
                     *self._args.cores,
                 'performance latency':
                     self.machine['clock']/block_latency*elements_per_block*flops_per_element
                     *self._args.cores,
                 'IACA output': iaca_output,
-                'IACA latency output': iaca_latency_output}})
+                'IACA latency output': iaca_latency_output,
+                'in-core model': analysis['in-core model']}})
         self.results['cpu bottleneck']['performance throughput'].unit = 'FLOP/s'
         self.results['cpu bottleneck']['performance latency'].unit = 'FLOP/s'
 
@@ -361,6 +334,15 @@ class RooflineIACA(Roofline):
             print('{}'.format(pformat(self.results)), file=output_file)
         
         if self._args and self._args.verbose >= 1:
+            if self.results['verbose infos'].get('arrays'):
+                print_array_traffic(
+                    self.results['verbose infos']['arrays'], self.machine, output_file)
+            if self.results['verbose infos'].get('prefetch'):
+                print_prefetch_traffic(
+                    self.results['verbose infos']['prefetch'], self.machine, output_file)
+            if self.results['verbose infos'].get('transitions'):
+                print_layer_condition_transitions(
+                    self.results['verbose infos']['transitions'], self.machine, output_file)
             print('Bottlenecks:', file=output_file)
             print('  level | a. intensity |   performance   |   bandwidth  | bandwidth kernel',
                   file=output_file)
@@ -376,12 +358,20 @@ class RooflineIACA(Roofline):
                           self.conv_perf(b['performance'], self._args.unit), **b),
                       file=output_file)
             print('', file=output_file)
-            print('IACA analisys:', file=output_file)
+            print('{} analisys:'.format(self.results['cpu bottleneck']['in-core model']),
+                  file=output_file)
             print('{!s}'.format(
                 {k: v
                  for k, v in list(self.results['cpu bottleneck'].items())
-                 if k not in['IACA output', 'IACA latency output']}),
+                 if k not in['IACA output', 'IACA latency output', 'loop-carried chain']}),
                 file=output_file)
+            cpu_bottleneck = self.results['cpu bottleneck']
+            if (cpu_bottleneck['cl loop-carried latency'] and
+                    cpu_bottleneck['cl loop-carried latency'] > cpu_bottleneck['cl throughput']):
+                print('CPU performance is bound by the loop-carried dependency chain:',
+                      file=output_file)
+                for line in cpu_bottleneck['loop-carried chain']:
+                    print('    ' + line, file=output_file)
 
         if float(self.results['min performance']) > float(cpu_flops):
             # CPU bound
@@ -128,7 +128,7 @@ setup(
     # have to be included in MANIFEST.in as well.
     package_data={
         'kerncraft': ['headers/dummy.c', 'headers/kerncraft.h', 'README.rst', 'LICENSE',
-                      'pycparser/*.cfg'],
+                      'pycparser/*.cfg', 'instruction_tables/*.yaml'],
         'examples': [
             'machine-files/*.yaml',
             'kernels/*.c',
@@ -11,7 +11,10 @@ suite = unittest.TestLoader().loadTestsFromNames(
         'test_kerncraft',
         'test_intervals',
         'test_kernel',
-        'test_layer_condition'
+        'test_layer_condition',
+        'test_cacheprediction',
+        'test_iaca',
+        'test_incore'
     ]
 )
 
@@ -0,0 +1,526 @@
+'''
+Tests for the cache predictors in cacheprediction.py
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import argparse
+import inspect
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import sympy
+import cachesim
+
+sys.path.insert(0, '..')
+from kerncraft.kernel import KernelCode
+from kerncraft.machinemodel import MachineModel
+from kerncraft.cacheprediction import (
+    LayerConditionPredictor, CacheSimulationPredictor, ParametricLayerConditionPredictor,
+    ReuseDistancePredictor, PredictorCache, PredictionStore, StoredPrediction, AutomaticPredictor,
+    StreamPrefetcher, get_predictor, stack_distances, MAX_REUSABLE_RESULTS)
+from kerncraft.models import ECMData, Roofline
+# registers the yaml constructor for units in machine files
+from kerncraft import prefixedunit
+
+
+class CachePredictorTestCase(unittest.TestCase):
+    def _find_file(self, name):
+        testdir = os.path.dirname(__file__)
+        name = os.path.join(testdir, 'test_files', name)
+        assert os.path.exists(name)
+        return name
+
+    def _kernel(self, name, **constants):
+        kernel = KernelCode(open(self._find_file(name)).read())
+        for name, value in constants.items():
+            kernel.set_constant(name, value)
+        return kernel
+
+
+class TestLayerConditionPredictor(CachePredictorTestCase):
+    def test_layer_conditions(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        predictor = LayerConditionPredictor(self._kernel('2d-5pt.c', N=1000, M=1000), machine)
+        # three rows of a (minus two elements) fit into all cache levels
+        self.assertEqual(predictor.get_hits(), [3, 3, 3])
+        self.assertEqual(predictor.get_misses(), [2, 2, 2])
+        self.assertEqual(predictor.get_evicts(), [1, 1, 1])
+        self.assertEqual([c['requirement'] for c in predictor.get_infos()['cache']], [31984]*3)
+
+        predictor = LayerConditionPredictor(self._kernel('2d-5pt.c', N=10000, M=10000), machine)
+        self.assertEqual(predictor.get_hits(), [1, 1, 3])
+        self.assertEqual(predictor.get_misses(), [4, 4, 2])
+        self.assertEqual([c['tail'] for c in predictor.get_infos()['cache']], [16, 16, 79992])
+
+    def test_no_reuse(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        predictor = LayerConditionPredictor(self._kernel('copy.c', N=1000), machine)
+        self.assertEqual(predictor.get_hits(), [0, 0, 0])
+        self.assertEqual(predictor.get_misses(), [2, 2, 2])
+
+    def test_array_traffic(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        predictor = LayerConditionPredictor(self._kernel('2d-5pt.c', N=10000, M=10000), machine)
+        arrays = predictor.get_infos()['arrays']
+        # only a[j+1] misses in L3, a[j] and a[j-1] only in L1 and L2
+        self.assertEqual(arrays['a'], {'hits': [1, 1, 3], 'misses': [3, 3, 1], 'evicts': [0]*3})
+        self.assertEqual(arrays['b'], {'hits': [0]*3, 'misses': [1]*3, 'evicts': [1]*3})
+
+    def test_parametric_sweep(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        predictor = ParametricLayerConditionPredictor(kernel, machine)
+        self.assertEqual(predictor.get_hits(), [3, 3, 3])
+        self.assertEqual(predictor.get_misses(), [2, 2, 2])
+
+        # all points of a sweep in one call, same as a LayerConditionPredictor per point
+        sweep = [100, 1024, 1025, 8192, 8193, 10000, 1000000]
+        results = predictor.evaluate({'N': sweep, 'M': 1000})
+        for i, n in enumerate(sweep):
+            kernel.clear_state()
+            kernel.set_constant('N', n)
+            kernel.set_constant('M', 1000)
+            reference = LayerConditionPredictor(kernel, machine)
+            for key in ['hits', 'misses', 'evicts', 'requirement', 'tail']:
+                self.assertEqual([int(r[i]) for r in results[key]],
+                                 [c[key] for c in reference.get_infos()['cache']])
+
+        # three rows of a and one of b, minus two elements, need to fit (32*N - 16 bytes)
+        self.assertEqual(predictor.transitions('N', [100, 1000000]),
+                         [[(1025, 3, 1)], [(8193, 3, 1)], []])
+
+    def test_parametric_define_points(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c')
+        points = [{'N': n, 'M': 1000} for n in [100, 1000, 10000, 100000]]
+        predictor = ParametricLayerConditionPredictor(kernel, machine, points=points)
+
+        # one predictor serves every point of the sweep, with the transitions along N
+        for point, hits in zip(points, [[3, 3, 3], [3, 3, 3], [1, 1, 3], [1, 1, 3]]):
+            kernel.clear_state()
+            for name, value in point.items():
+                kernel.set_constant(name, value)
+            self.assertEqual(predictor.get_hits(), hits)
+            self.assertEqual(predictor.get_infos()['transitions'],
+                             {'N': [[(1025, 3, 1)], [(8193, 3, 1)], []]})
+
+        # get_predictor hands the same predictor to all define points
+        args = argparse.Namespace(cache_predictor='PLC')
+        predictor_cache = PredictorCache(points=points)
+        with predictor_cache:
+            first = get_predictor(kernel, machine, args, cache=predictor_cache)
+        kernel.clear_state()
+        kernel.set_constant('N', 100)
+        kernel.set_constant('M', 1000)
+        with predictor_cache:
+            self.assertIs(get_predictor(kernel, machine, args, cache=predictor_cache), first)
+            self.assertEqual(first.get_hits(), [3, 3, 3])
+
+    def test_parametric_derivation_invalidated(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        self.assertEqual(ParametricLayerConditionPredictor(kernel, machine).get_hits(), [3, 3, 3])
+
+        # rows of a and b twice as long, so their layer condition breaks in L1
+        kernel.set_variable('a', 'double', [sympy.Symbol('M', positive=True),
+                                            2*sympy.Symbol('N', positive=True)])
+        kernel.set_variable('b', 'double', [sympy.Symbol('M', positive=True),
+                                            2*sympy.Symbol('N', positive=True)])
+        self.assertEqual(ParametricLayerConditionPredictor(kernel, machine).get_hits(), [1, 3, 3])
+
+
+class TestCacheSimulationPredictor(CachePredictorTestCase):
+    def test_adaptive_warmup(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('3d-7pt.c', N=50, M=50)
+        predictor = CacheSimulationPredictor(kernel, machine, warmup='adaptive')
+
+        warmup = predictor.get_infos()['warm-up']
+        self.assertEqual(warmup['mode'], 'adaptive')
+        self.assertTrue(warmup['converged'])
+        self.assertLessEqual(warmup['deviation'], warmup['tolerance'])
+        # at least the reuse span of two planes needs to be warmed up
+        self.assertGreaterEqual(warmup['iterations'], 2*48*48)
+        # steady state misses per cache line of work
+        self.assertEqual(predictor.get_misses(), [5, 3, 0])
+
+    def test_fixed_warmup(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        predictor = CacheSimulationPredictor(kernel, machine, warmup='fixed')
+        self.assertEqual(predictor.get_infos()['warm-up']['mode'], 'fixed')
+        self.assertEqual(predictor.get_misses(), [2, 2, 0])
+
+    def test_array_traffic(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=10000, M=1000)
+        predictor = CacheSimulationPredictor(kernel, machine, warmup='fixed')
+        arrays = predictor.get_infos()['arrays']
+        self.assertEqual(sorted(arrays), ['a', 'b'])
+        for key, total in [('hits', predictor.get_hits()), ('misses', predictor.get_misses()),
+                           ('evicts', predictor.get_evicts())]:
+            for level in range(3):
+                self.assertAlmostEqual(arrays['a'][key][level] + arrays['b'][key][level],
+                                       total[level])
+        # b is only stored, once per cache line
+        self.assertEqual(arrays['b']['misses'], [1, 1, 1])
+        self.assertEqual(arrays['a']['evicts'], [0, 0, 0])
+
+    def test_prefill(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('copy.c', N=1000)
+        predictor = CacheSimulationPredictor(kernel, machine, warmup='fixed')
+        # one access per cache line, b is loaded and a stored
+        chunks = list(predictor._prefill_offsets(chunk_size=100))
+        self.assertEqual([(l.shape, s.shape) for l, s in chunks],
+                         [((100, 0), (100, 1)), ((25, 0), (25, 1)),
+                          ((100, 1), (100, 0)), ((25, 1), (25, 0))])
+        self.assertEqual(chunks[0][1][:3, 0].tolist(), [0, 64, 128])
+        self.assertEqual(chunks[2][0][0, 0], 8000)
+        # everything fits into L1, only the initial misses of the window remain
+        self.assertEqual(predictor.get_misses(), [0, 0, 0])
+
+    def test_stream_prefetcher(self):
+        prefetcher = StreamPrefetcher(64, detection=2, distance=4)
+        self.assertEqual(prefetcher.train([0]), [])
+        # second advancing line detects the stream
+        self.assertEqual(prefetcher.train([1, 1]), [2, 3, 4, 5])
+        self.assertEqual(prefetcher.train([2]), [6])
+        # streams end at page boundaries (64 lines of 4 kB pages)
+        self.assertEqual(prefetcher.train([124, 125]), [126, 127])
+        prefetcher = StreamPrefetcher(64, detection=2, distance=4, adjacent_line=True)
+        self.assertEqual(prefetcher.train([10]), [11])
+
+    def test_prefetchers(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=10000, M=1000)
+        machine['memory hierarchy'][1]['prefetchers'] = {
+            'streams': 32, 'stream detection': 2, 'distance': 20}
+        predictor = CacheSimulationPredictor(kernel, machine)
+        prefetch = predictor.get_infos()['prefetch']
+        misses = predictor.get_misses()
+        # L1 is not prefetched, L2 demand misses are covered by the streamer, except for the
+        # lines needed to detect the streams at the beginning of each page
+        self.assertEqual(misses[0], 4)
+        self.assertEqual(prefetch['prefetch misses'][0], 0)
+        self.assertLess(prefetch['demand misses'][1], 0.2)
+        self.assertGreater(prefetch['prefetch misses'][1], 3.8)
+        # prefetched cache lines are transferred all the same
+        self.assertAlmostEqual(misses[1], 4, places=1)
+        for level in range(3):
+            self.assertAlmostEqual(prefetch['demand misses'][level] +
+                                   prefetch['prefetch misses'][level], misses[level])
+
+    def test_example_machine_prefetchers(self):
+        machine = MachineModel(os.path.join(
+            os.path.dirname(__file__), '..', 'examples', 'machine-files', 'hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=10000, M=1000)
+        prefetch = CacheSimulationPredictor(kernel, machine).get_infos()['prefetch']
+        self.assertLess(prefetch['demand misses'][1], 0.2)
+        self.assertGreater(prefetch['prefetch misses'][1], 3.8)
+        with self.assertRaises(AssertionError):
+            CacheSimulationPredictor(kernel, machine, set_sampling='auto')
+
+    def test_sampled_windows(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('3d-7pt.c', N=50, M=50)
+        predictor = CacheSimulationPredictor(kernel, machine, samples=4)
+
+        sampling = predictor.get_infos()['sampling']
+        self.assertEqual(sampling['samples'], 4)
+        self.assertEqual(len(sampling['positions']), 4)
+        self.assertEqual(sorted(sampling['positions']), sampling['positions'])
+        for level, misses in enumerate(predictor.get_misses()):
+            self.assertEqual(misses, sampling['misses']['mean'][level])
+            low, high = sampling['misses']['confidence interval'][level]
+            self.assertLessEqual(low, misses)
+            self.assertGreaterEqual(high, misses)
+
+        # budget only allows for the first window
+        predictor = CacheSimulationPredictor(kernel, machine, samples=4, budget=1)
+        self.assertEqual(predictor.get_infos()['sampling']['samples'], 1)
+        self.assertEqual(predictor.get_infos()['sampling']['simulated iterations'], 0)
+
+    def test_set_sampling(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+
+        # with a ratio of one, all sets are simulated
+        predictor = CacheSimulationPredictor(kernel, machine, warmup='fixed', set_sampling=1)
+        self.assertEqual(predictor.get_misses(), [2, 2, 0])
+
+        predictor = CacheSimulationPredictor(kernel, machine, warmup='fixed', set_sampling='auto')
+        infos = predictor.get_infos()['set sampling']
+        self.assertEqual(infos['ratio'], 64)
+        self.assertEqual(infos['groups'], 4)
+        self.assertAlmostEqual(infos['speed-up'], 16, places=0)
+        for misses, error, reference in zip(predictor.get_misses(), infos['misses error'],
+                                            [2, 2, 0]):
+            self.assertAlmostEqual(misses, reference, delta=0.1)
+            self.assertLess(error, 0.1)
+
+    def test_example_kernels(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel_dir = os.path.join(os.path.dirname(__file__), '..', 'examples', 'kernels')
+        # streaming kernels and stencils with reuse in one, two and three dimensions
+        for name, constants in [('triad.c', {'N': 100000}),
+                                ('1d-3pt.c', {'N': 100000}),
+                                ('2d-5pt.c', {'N': 5000, 'M': 200}),
+                                ('3d-7pt.c', {'N': 100, 'M': 100}),
+                                ('3d-27pt.c', {'N': 60, 'M': 60})]:
+            kernel = KernelCode(open(os.path.join(kernel_dir, name)).read())
+            for constant, value in constants.items():
+                kernel.set_constant(constant, value)
+            reference = CacheSimulationPredictor(kernel, machine)
+
+            # Misses and evicts agree with the full simulation within 10% (or 0.05 cache lines per
+            # cache line of work, where it has none)
+            for options in [{'warmup': 'adaptive'}, {'samples': 4}, {'set_sampling': 'auto'}]:
+                predictor = CacheSimulationPredictor(kernel, machine, **options)
+                for getter in ['get_misses', 'get_evicts']:
+                    for level, (value, expected) in enumerate(zip(
+                            getattr(predictor, getter)(), getattr(reference, getter)())):
+                        self.assertAlmostEqual(
+                            value, expected, delta=max(0.1*expected, 0.05),
+                            msg='{} of level {} with {} for {}'.format(
+                                getter, level, options, name))
+
+    def test_reuse_results(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        # arrays do not depend on M, so larger M only extends the trace
+        kernel = KernelCode('double a[N][N], b[N][N];\n'
+                            'for(int j=1; j<M-1; ++j)\n'
+                            '    for(int i=1; i<N-1; ++i)\n'
+                            '        b[j][i] = a[j][i-1] + a[j][i+1] + a[j-1][i] + a[j+1][i];\n')
+        results = []
+        for m in [1000, 2000]:
+            kernel.clear_state()
+            kernel.set_constant('N', 3000)
+            kernel.set_constant('M', m)
+            predictor = CacheSimulationPredictor(
+                kernel, machine, warmup='adaptive', reuse_results=True)
+            reference = CacheSimulationPredictor(kernel, machine, warmup='adaptive')
+            self.assertEqual(predictor.get_misses(), reference.get_misses())
+            self.assertEqual(predictor.get_hits(), reference.get_hits())
+            self.assertEqual(predictor.get_evicts(), reference.get_evicts())
+            results.append(predictor.get_infos()['warm-up'].get('reused', False))
+            self.assertNotIn('reused', reference.get_infos()['warm-up'])
+        self.assertEqual(results, [False, True])
+
+        # b moves with M, so its trace differs
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        CacheSimulationPredictor(kernel, machine, reuse_results=True)
+        kernel.clear_state()
+        kernel.set_constant('N', 1000)
+        kernel.set_constant('M', 2000)
+        predictor = CacheSimulationPredictor(kernel, machine, reuse_results=True)
+        self.assertNotIn('reused', predictor.get_infos()['warm-up'])
+
+        # only the most recent outcomes are kept per kernel
+        for n in range(100, 100 + MAX_REUSABLE_RESULTS + 2):
+            kernel.clear_state()
+            kernel.set_constant('N', n)
+            kernel.set_constant('M', 100)
+            CacheSimulationPredictor(kernel, machine, reuse_results=True)
+        self.assertEqual(
+            len(CacheSimulationPredictor._reusable_results[kernel]), MAX_REUSABLE_RESULTS)
+
+    def test_multi_core(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        self.assertIsInstance(machine.get_cachesim(), cachesim.CacheSimulator)
+        self.assertEqual(len(machine.get_cachesims(1)), 1)
+        csims = machine.get_cachesims(4)
+        self.assertEqual(len(csims), 4)
+        levels = [list(csim.levels(with_mem=False)) for csim in csims]
+        # L1 and L2 are private, L3 is shared by all cores of a socket
+        self.assertIsNot(levels[0][0], levels[1][0])
+        self.assertIsNot(levels[0][1], levels[1][1])
+        self.assertIs(levels[0][2], levels[3][2])
+
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        predictor = CacheSimulationPredictor(kernel, machine, warmup='fixed', cores=4)
+        infos = predictor.get_infos()['multi-core']
+        self.assertEqual(infos['shared levels'], ['L3'])
+        self.assertEqual(len(infos['partitions']), 4)
+        self.assertEqual(len(infos['per core']), 4)
+        # private levels behave as on a single core
+        self.assertEqual(predictor.get_misses()[0], 2)
+        for stats in infos['per core']:
+            self.assertEqual(stats['misses'][0], 2)
+
+    def test_multi_core_single_loop(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('copy.c', N=200000)
+        predictor = CacheSimulationPredictor(kernel, machine, warmup='fixed', cores=2)
+        infos = predictor.get_infos()['multi-core']
+        self.assertEqual(infos['partitions'], [(0, 100000), (100000, 200000)])
+        # every core warms up and benchmarks within its own partition
+        for (start, end), (window_start, window_end) in zip(infos['partitions'],
+                                                            infos['windows']):
+            self.assertGreater(window_start, start)
+            self.assertLess(window_start, window_end)
+            self.assertLessEqual(window_end, end)
+        for stats in infos['per core']:
+            self.assertAlmostEqual(stats['misses'][0], 2, places=1)
+
+
+class TestReuseDistancePredictor(CachePredictorTestCase):
+    def test_stack_distances(self):
+        trace = numpy.array([1, 2, 3, 1, 1, 3, 4, 2], dtype='int64')
+        self.assertEqual(stack_distances(trace).tolist(), [-1, -1, -1, 2, 0, 1, -1, 3])
+
+    def test_memory_hierarchy(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        predictor = ReuseDistancePredictor(kernel, machine)
+        # same as the cache simulation, up to row boundaries
+        for misses, reference in zip(predictor.get_misses(), [2, 2, 0]):
+            self.assertAlmostEqual(misses, reference, delta=0.01)
+        for hits, reference in zip(predictor.get_hits(), [31, 0, 2]):
+            self.assertAlmostEqual(hits, reference, delta=0.01)
+        for evicts in predictor.get_evicts():
+            self.assertAlmostEqual(evicts, 1, delta=0.01)
+
+    def test_simulation_window(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        simulation = CacheSimulationPredictor(kernel, machine)
+        infos = simulation.get_infos()
+        start = infos['sampling']['positions'][0]
+        predictor = ReuseDistancePredictor(
+            kernel, machine, start=start, window=infos['cachelines in stats']*8)
+        # the simulated window, without conflict misses in 2d-5pt
+        self.assertEqual(predictor.window, (start, start + infos['cachelines in stats']*8))
+        self.assertEqual(predictor.get_misses(), simulation.get_misses())
+
+    def test_miss_ratio_curve(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        predictor = ReuseDistancePredictor(kernel, machine)
+        # reusing a[j+1] and a[j] needs three rows of a and one of b (32 kB) to fit
+        self.assertAlmostEqual(predictor.get_misses_for_size(48*1024), 2, delta=0.01)
+        self.assertAlmostEqual(predictor.get_misses_for_size(16*1024), 4, delta=0.01)
+        curve = predictor.get_miss_ratio_curve()
+        self.assertEqual(curve, predictor.get_infos()['miss ratio curve'])
+        sizes, ratios = zip(*curve)
+        self.assertEqual(sizes[0], 64)
+        self.assertGreaterEqual(sizes[-1], 35*1024**2)
+        self.assertEqual(sorted(ratios, reverse=True), list(ratios))
+
+
+class TestAutomaticPredictor(CachePredictorTestCase):
+    def test_engine_selection(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        predictor = AutomaticPredictor(kernel, machine)
+        # 31984 bytes only just fit into L1 and both arrays (16 MB) fit into L3
+        self.assertEqual([e['engine'] for e in predictor.get_infos()['engines']],
+                         ['SIM', 'LC', 'SIM'])
+        self.assertEqual(predictor.get_misses(), [2, 2, 0])
+
+        kernel = self._kernel('2d-5pt.c', N=2000, M=10000)
+        predictor = AutomaticPredictor(kernel, machine)
+        self.assertEqual([e['engine'] for e in predictor.get_infos()['engines']], ['LC']*3)
+        self.assertIsNone(predictor.get_infos()['simulation'])
+
+    def test_fallback(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        # j+=2 can not be handled by layer conditions
+        kernel = self._kernel('3d-7pt.c', N=50, M=50)
+        predictor = AutomaticPredictor(kernel, machine)
+        self.assertEqual([e['engine'] for e in predictor.get_infos()['engines']], ['SIM']*3)
+        self.assertIsNone(predictor.get_infos()['layer conditions'])
+        self.assertEqual(predictor.get_misses(),
+                         CacheSimulationPredictor(kernel, machine).get_misses())
+
+
+class TestPredictorCache(CachePredictorTestCase):
+    def test_shared_predictor(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        args = argparse.Namespace(cache_predictor='LC', cores=1)
+
+        # without a cache, every model gets its own predictor
+        self.assertIsNot(get_predictor(kernel, machine, args),
+                         get_predictor(kernel, machine, args))
+
+        with PredictorCache() as cache:
+            predictor = get_predictor(kernel, machine, args, cache=cache)
+            self.assertIsInstance(predictor, LayerConditionPredictor)
+            self.assertIs(get_predictor(kernel, machine, args, cache=cache), predictor)
+            self.assertIsNot(get_predictor(kernel, machine, argparse.Namespace(
+                cache_predictor='SIM', cache_sim_samples=1, cache_sim_budget=None,
+                cache_sim_warmup='fixed', cache_sim_reuse=False, cores=1), cache=cache),
+                predictor)
+            # other caches do not share predictors
+            self.assertIsNot(get_predictor(kernel, machine, args, cache=PredictorCache()),
+                             predictor)
+            # models only share through the cache they are given
+            ecm_data = ECMData(kernel, machine, args, predictor_cache=cache)
+            ecm_data.calculate_cache_access()
+            self.assertIs(ecm_data.predictor, predictor)
+            roofline = Roofline(kernel, machine, args)
+            roofline.calculate_cache_access()
+            self.assertIsNot(roofline.predictor, predictor)
+
+            kernel.clear_state()
+            kernel.set_constant('N', 2000)
+            kernel.set_constant('M', 1000)
+            self.assertIsNot(get_predictor(kernel, machine, args, cache=cache), predictor)
+        self.assertEqual(cache.predictors, {})
+
+    def test_prediction_store(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        kernel = self._kernel('2d-5pt.c', N=1000, M=1000)
+        args = argparse.Namespace(cache_predictor='LC')
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        with PredictorCache(PredictionStore(path)) as cache:
+            predictor = get_predictor(kernel, machine, args, cache=cache)
+            self.assertIsInstance(predictor, LayerConditionPredictor)
+        self.assertEqual(len(os.listdir(path)), 1)
+
+        # a later run loads the results from disk
+        with PredictorCache(PredictionStore(path)) as cache:
+            stored = get_predictor(kernel, machine, args, cache=cache)
+            self.assertIsInstance(stored, StoredPrediction)
+            self.assertEqual(stored.get_misses(), predictor.get_misses())
+            self.assertEqual(stored.get_hits(), predictor.get_hits())
+            self.assertEqual(stored.get_evicts(), predictor.get_evicts())
+        with PredictorCache(PredictionStore(path, refresh=True)) as cache:
+            self.assertIsInstance(get_predictor(kernel, machine, args, cache=cache),
+                                  LayerConditionPredictor)
+
+        # other constants lead to another key, which only fits after evicting the first one
+        store = PredictionStore(path, max_size=1.5*os.path.getsize(
+            os.path.join(path, os.listdir(path)[0])))
+        kernel.clear_state()
+        kernel.set_constant('N', 10000)
+        kernel.set_constant('M', 10000)
+        with PredictorCache(store) as cache:
+            predictor = get_predictor(kernel, machine, args, cache=cache)
+            self.assertIsInstance(predictor, LayerConditionPredictor)
+        self.assertEqual(os.listdir(path),
+                         [store.key(kernel, machine, LayerConditionPredictor, {}) + '.pickle'])
+
+        # changes to the predictor code lead to another key
+        key = store.key(kernel, machine, LayerConditionPredictor, {})
+        filename = inspect.getsourcefile(LayerConditionPredictor)
+        digest = PredictionStore.source_digest(inspect.getmodule(LayerConditionPredictor))
+        PredictionStore._source_digests[filename] = 'modified'
+        try:
+            self.assertNotEqual(store.key(kernel, machine, LayerConditionPredictor, {}), key)
+        finally:
+            PredictionStore._source_digests[filename] = digest
+
+
+if __name__ == '__main__':
+    unittest.main()
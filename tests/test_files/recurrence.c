@@ -0,0 +1,4 @@
+double a[N], b[N], s;
+
+for(int i=1; i<N; ++i)
+    a[i] = a[i-1]*s + b[i];
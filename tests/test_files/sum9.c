@@ -0,0 +1,5 @@
+double a[M][N], b[M][N], c[M][N], d[M][N], e[M][N], f[M][N], g[M][N], h[M][N], k[M][N];
+
+for(int j=0; j<M; ++j)
+    for(int i=0; i<N; ++i)
+        a[j][i] = b[j][i] + c[j][i] + d[j][i] + e[j][i] + f[j][i] + g[j][i] + h[j][i] + k[j][i];
@@ -0,0 +1,109 @@
+'''
+Tests for IACA analysis and its store in iaca.py
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import os
+import argparse
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, '..')
+from kerncraft import iaca
+
+
+THROUGHPUT_OUTPUT = '''Intel(R) Architecture Code Analyzer Version - 2.1
+Analyzed File - 2d-5pt.iaca_marked
+Binary Format - 64Bit
+Architecture  - HSW
+Analysis Type - Throughput
+
+Throughput Analysis Report
+--------------------------
+Block Throughput: 6.20 Cycles       Throughput Bottleneck: FrontEnd
+
+Port Binding In Cycles Per Iteration:
+---------------------------------------------------------------------------------------
+|  Port  |  0   -  DV  |  1   |  2   -  D   |  3   -  D   |  4   |  5   |  6   |  7   |
+---------------------------------------------------------------------------------------
+| Cycles | 2.0    0.0  | 2.0  | 3.5    3.0  | 3.5    3.0  | 2.0  | 1.0  | 1.0  | 1.0  |
+---------------------------------------------------------------------------------------
+
+Total Num Of Uops: 25
+'''
+
+LATENCY_OUTPUT = '''Intel(R) Architecture Code Analyzer Version - 2.1
+Analysis Type - Latency
+
+Latency Analysis Report
+---------------------------
+Latency: 18 Cycles
+'''
+
+
+class FakeKernel(object):
+    asm_block = {'lines': ['.L3:\n', '    vaddpd (%rax), %ymm0, %ymm0\n', '    jb .L3\n']}
+
+
+class TestIACA(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_parse(self):
+        block_throughput, port_cycles, uops = iaca.parse_throughput(THROUGHPUT_OUTPUT)
+        self.assertEqual(block_throughput, 6.2)
+        self.assertEqual(port_cycles, {'0': 2.0, '0DV': 0.0, '1': 2.0, '2': 3.5, '2D': 3.0,
+                                       '3': 3.5, '3D': 3.0, '4': 2.0, '5': 1.0, '6': 1.0,
+                                       '7': 1.0})
+        self.assertEqual(uops, 25)
+        self.assertEqual(iaca.parse_latency(LATENCY_OUTPUT), 18)
+
+    def test_store(self):
+        store = iaca.IACAStore(self.temp_dir)
+        lines = FakeKernel.asm_block['lines']
+        key = store.key(lines, 'HSW', 'THROUGHPUT')
+        # keyed by block, micro-architecture and analysis type, but not by indentation
+        self.assertEqual(key, store.key([l.strip() for l in lines], 'HSW', 'THROUGHPUT'))
+        self.assertNotEqual(key, store.key(lines, 'SKL', 'THROUGHPUT'))
+        self.assertNotEqual(key, store.key(lines, 'HSW', 'LATENCY'))
+        self.assertNotEqual(key, store.key(lines[1:], 'HSW', 'THROUGHPUT'))
+
+        self.assertIsNone(store.load(key))
+        store.store(key, THROUGHPUT_OUTPUT)
+        self.assertEqual(store.load(key), THROUGHPUT_OUTPUT)
+        self.assertIsNone(iaca.IACAStore(self.temp_dir, refresh=True).load(key))
+
+        # least recently used outputs are evicted once the store exceeds its size
+        store = iaca.IACAStore(self.temp_dir, max_size=len(THROUGHPUT_OUTPUT) + 1)
+        os.utime(os.path.join(self.temp_dir, key + '.txt'), (0, 0))
+        other_key = store.key(lines, 'HSW', 'LATENCY')
+        store.store(other_key, LATENCY_OUTPUT)
+        self.assertIsNone(store.load(key))
+        self.assertEqual(store.load(other_key), LATENCY_OUTPUT)
+
+    def test_analyze_stored(self):
+        args = argparse.Namespace(iaca_cache='use', iaca_cache_dir=self.temp_dir,
+                                  iaca_cache_size=16, verbose=0)
+        store = iaca.get_store(args)
+        lines = FakeKernel.asm_block['lines']
+        store.store(store.key(lines, 'HSW', 'THROUGHPUT'), THROUGHPUT_OUTPUT)
+        store.store(store.key(lines, 'HSW', 'LATENCY'), LATENCY_OUTPUT)
+
+        # served from the store, without running iaca.sh on the (missing) binary
+        analysis = iaca.analyze(FakeKernel(), {'micro-architecture': 'HSW'},
+                                os.path.join(self.temp_dir, 'missing'), args)
+        self.assertEqual(analysis['block throughput'], 6.2)
+        self.assertEqual(analysis['block latency'], 18)
+        self.assertEqual(analysis['uops'], 25)
+        self.assertEqual(analysis['IACA output'], THROUGHPUT_OUTPUT)
+
+        args.iaca_cache = 'bypass'
+        self.assertIsNone(iaca.get_store(args))
@@ -0,0 +1,151 @@
+'''
+Tests for the built-in in-core analysis in incore.py
+'''
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+from __future__ import division
+
+import sys
+import argparse
+import unittest
+
+sys.path.insert(0, '..')
+from kerncraft import incore
+
+
+# 2d-5pt loop body as compiled by gcc -O3 -mavx2
+STENCIL_BLOCK = ['.L24:\n',
+                 '\tvmovupd\t(%r14,%rax), %ymm2\n',
+                 '\tvaddpd\t(%r9,%rax), %ymm2, %ymm0\n',
+                 '\tvaddpd\t0(%r13,%rax), %ymm0, %ymm0\n',
+                 '\tvaddpd\t(%r11,%rax), %ymm0, %ymm0\n',
+                 '\tvmulpd\t%ymm1, %ymm0, %ymm0\n',
+                 '\tvmovupd\t%ymm0, (%rsi,%rax)\n',
+                 '\taddq\t$32, %rax\n',
+                 '\tcmpq\t%rcx, %rax\n',
+                 '\tjne\t.L24\n']
+
+# scalar product with FMA
+DOT_BLOCK = ['.L3:\n',
+             '\tvmovsd\t(%rdi,%rax,8), %xmm1\n',
+             '\tvfmadd231sd\t(%rsi,%rax,8), %xmm1, %xmm0  # s += a[i]*b[i]\n',
+             '\taddq\t$1, %rax\n',
+             '\tcmpq\t%rax, %rdx\n',
+             '\tjne\t.L3\n']
+
+# Kahan-compensated scalar product (examples/kernels/kahan-dot.c) without fast-math
+KAHAN_BLOCK = ['.L4:\n',
+               '\tvmovsd\t(%rdi,%rax,8), %xmm0\n',
+               '\tvmulsd\t(%rsi,%rax,8), %xmm0, %xmm0\n',  # prod = a[i]*b[i]
+               '\tvsubsd\t%xmm2, %xmm0, %xmm0\n',  # y = prod-c
+               '\tvaddsd\t%xmm0, %xmm1, %xmm3\n',  # t = sum+y
+               '\tvsubsd\t%xmm1, %xmm3, %xmm1\n',  # t-sum
+               '\tvsubsd\t%xmm0, %xmm1, %xmm2\n',  # c = (t-sum)-y
+               '\tvmovapd\t%xmm3, %xmm1\n',  # sum = t
+               '\taddq\t$1, %rax\n',
+               '\tcmpq\t%rax, %rdx\n',
+               '\tjne\t.L4\n']
+
+# two partial sums, alternating between xmm0 and xmm1
+ALTERNATING_BLOCK = ['.L5:\n',
+                     '\tvaddsd\t(%rdi,%rax,8), %xmm0, %xmm1\n',
+                     '\tvaddsd\t8(%rdi,%rax,8), %xmm1, %xmm0\n',
+                     '\tvaddsd\t16(%rdi,%rax,8), %xmm0, %xmm0\n',
+                     '\taddq\t$3, %rax\n',
+                     '\tcmpq\t%rax, %rdx\n',
+                     '\tjne\t.L5\n']
+
+
+class FakeKernel(object):
+    asm_block = {'lines': STENCIL_BLOCK}
+
+
+class TestIncore(unittest.TestCase):
+    def test_parse_instruction(self):
+        self.assertIsNone(incore.parse_instruction('.L24:'))
+        self.assertIsNone(incore.parse_instruction('\t.p2align 4,,10'))
+        instruction = incore.parse_instruction('\tvaddpd\t8(%r9,%rax,8), %ymm2, %ymm0 # a\n')
+        self.assertEqual(instruction['mnemonic'], 'vaddpd')
+        self.assertEqual([o['type'] for o in instruction['operands']],
+                         ['memory', 'register', 'register'])
+        self.assertEqual(instruction['operands'][0]['registers'], ['r9', 'rax'])
+        self.assertEqual(incore.register_name('eax'), 'rax')
+        self.assertEqual(incore.register_name('r10d'), 'r10')
+        self.assertEqual(incore.register_name('ymm3'), 'xmm3')
+
+    def test_haswell_stencil(self):
+        analysis = incore.analyze_block(STENCIL_BLOCK, 'HSW')
+        # three additions bound to port 1, multiplication moved to port 0
+        self.assertEqual(analysis['block throughput'], 3.0)
+        self.assertEqual(analysis['port cycles']['1'], 3.0)
+        self.assertEqual(analysis['port cycles']['0'], 1.0)
+        # four loads, store address can not use port 7 with indexed addressing
+        self.assertEqual(analysis['port cycles']['2D'] + analysis['port cycles']['3D'], 4.0)
+        self.assertEqual(analysis['port cycles']['2'] + analysis['port cycles']['3'], 5.0)
+        self.assertEqual(analysis['port cycles']['7'], 0.0)
+        self.assertEqual(analysis['port cycles']['4'], 1.0)
+        # cmp and jne are macro-fused
+        self.assertEqual(analysis['uops'], 8)
+        # load, three additions and multiplication
+        self.assertEqual(analysis['block latency'], 5+3+3+3+5)
+        self.assertIn('Block Throughput: 3.00 Cycles', analysis['IACA output'])
+        self.assertIn('Latency: 19.00 Cycles', analysis['IACA latency output'])
+
+    def test_sandybridge_stencil(self):
+        analysis = incore.analyze_block(STENCIL_BLOCK, 'SNB')
+        # 256 bit loads occupy the data paths for two cycles, stores port 4
+        self.assertEqual(analysis['port cycles']['2D'] + analysis['port cycles']['3D'], 8.0)
+        self.assertEqual(analysis['port cycles']['4'], 2.0)
+        self.assertEqual(analysis['port cycles']['1'], 3.0)
+        self.assertEqual(analysis['block throughput'], 4.0)
+
+    def test_fma(self):
+        analysis = incore.analyze_block(DOT_BLOCK, 'HSW')
+        self.assertEqual(analysis['block throughput'], 1.0)
+        self.assertEqual(analysis['uops'], 4)
+        self.assertEqual(analysis['block latency'], 5+5)
+        self.assertNotIn('X ', analysis['IACA output'].split('Total')[0])
+
+    def test_loop_carried(self):
+        analysis = incore.analyze_block(KAHAN_BLOCK, 'HSW')
+        # c -> y -> t -> t-sum -> c, four dependent additions with 3 cycles each
+        self.assertEqual(analysis['loop-carried latency'], 12.0)
+        self.assertEqual(analysis['loop-carried chain'],
+                         [l.strip() for l in KAHAN_BLOCK[3:7]])
+        # throughput alone would be four additions on port 1
+        self.assertEqual(analysis['block throughput'], 4.0)
+        self.assertIn('Loop-carried dependency: 12.00 Cycles', analysis['IACA latency output'])
+
+        # accumulation through FMA destination
+        self.assertEqual(incore.analyze_block(DOT_BLOCK, 'HSW')['loop-carried latency'], 5.0)
+        # only the loop counter is carried
+        self.assertEqual(incore.analyze_block(STENCIL_BLOCK, 'HSW')['loop-carried latency'], 1.0)
+        # chain through xmm1 within an iteration, three additions per iteration
+        self.assertEqual(
+            incore.analyze_block(ALTERNATING_BLOCK, 'HSW')['loop-carried latency'], 9.0)
+
+        # also available without instruction table
+        self.assertEqual(incore.analyze_loop_carried(KAHAN_BLOCK, 'SNB')['loop-carried latency'],
+                         12.0)
+        self.assertIsNone(incore.analyze_loop_carried(KAHAN_BLOCK, 'XYZ')['loop-carried latency'])
+
+    def test_select_backend(self):
+        self.assertEqual(
+            incore.select_backend(argparse.Namespace(incore_model='builtin')), 'builtin')
+        self.assertEqual(incore.select_backend(argparse.Namespace(incore_model='IACA')), 'IACA')
+        self.assertIn(incore.select_backend(None), incore.backends)
+
+        analysis = incore.analyze(FakeKernel(), {'micro-architecture': 'HSW'}, None,
+                                  argparse.Namespace(incore_model='builtin'))
+        self.assertEqual(analysis['in-core model'], 'builtin')
+        self.assertEqual(analysis['block throughput'], 3.0)
+        self.assertEqual(analysis['loop-carried latency'], 1.0)
+
+    def test_supported_micro_architectures(self):
+        self.assertEqual(incore.supported_micro_architectures(), ['HSW', 'IVB', 'SNB'])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestIncore)
+    unittest.TextTestRunner(verbosity=2).run(suite)
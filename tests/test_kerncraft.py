@@ -22,6 +22,10 @@ import sympy
 
 sys.path.insert(0, '..')
 from kerncraft import kerncraft as kc
+from kerncraft import models
+from kerncraft import iaca_marker
+from kerncraft.kernel import KernelCode
+from kerncraft.machinemodel import MachineModel
 from kerncraft.prefixedunit import PrefixedUnit
 
 
@@ -29,8 +33,15 @@ class TestKerncraft(unittest.TestCase):
     def setUp(self):
         # Create a temporary directory
         self.temp_dir = tempfile.mkdtemp()
+        # Results stored on disk by earlier runs must not be reused
+        self._cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.temp_dir, 'cache')
 
     def tearDown(self):
+        if self._cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self._cache_home
         # Remove the directory after the test
         shutil.rmtree(self.temp_dir)
 
@@ -40,6 +51,12 @@ class TestKerncraft(unittest.TestCase):
         assert os.path.exists(name)
         return name
 
+    def _copy_to_temp_dir(self, name):
+        '''Returns a copy of a test file, so files generated next to it end up in temp_dir.'''
+        copy_name = os.path.join(self.temp_dir, name)
+        shutil.copy(self._find_file(name), copy_name)
+        return copy_name
+
     def test_2d5pt_ECMData(self):
         store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMData.pickle')
         output_stream = StringIO()
@@ -201,7 +218,7 @@ class TestKerncraft(unittest.TestCase):
         parser = kc.create_parser()
         args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
                                   '-p', 'ECMCPU',
-                                  self._find_file('2d-5pt.c'),
+                                  self._copy_to_temp_dir('2d-5pt.c'),
                                   '-D', 'N', '2000',
                                   '-D', 'M', '1000',
                                   '-vvv',
@@ -229,6 +246,113 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['T_OL'], 24.8, places=1)
         self.assertAlmostEqual(ecmd['T_nOL'], 20, places=1)
 
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    def test_2d5pt_ECMCPU_builtin(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMCPU_builtin.pickle')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECMCPU',
+                                  self._copy_to_temp_dir('2d-5pt.c'),
+                                  '-D', 'N', '2000',
+                                  '-D', 'M', '1000',
+                                  '-vvv',
+                                  '--unit=cy/CL',
+                                  '--incore-model', 'builtin',
+                                  '--compile-cache', 'bypass',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        result = list(results['2d-5pt.c'].values())[0]
+        ecmd = result['ECMCPU']
+        self.assertEqual(ecmd['in-core model'], 'builtin')
+        self.assertIn('Built-in port pressure analysis for SNB', output_stream.getvalue())
+        # Exact cycles depend on the code generated by the installed gcc
+        self.assertGreater(ecmd['T_nOL'], 0)
+        self.assertGreaterEqual(ecmd['T_OL'], ecmd['T_nOL'])
+        self.assertGreaterEqual(ecmd['cl latency'], ecmd['cl throughput'])
+        self.assertGreaterEqual(ecmd['T_OL'], ecmd['cl loop-carried latency'])
+
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    def test_recurrence_ECMCPU_builtin(self):
+        store_file = os.path.join(self.temp_dir, 'test_recurrence_ECMCPU_builtin.pickle')
+        output_stream = StringIO()
+        kernel_file = self._copy_to_temp_dir('recurrence.c')
+
+        # The largest block is an initialization loop, so select the one with the recurrence
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        kernel = KernelCode(open(kernel_file).read(), filename=kernel_file)
+        kernel.set_constant('N', 1000)
+        with open(kernel.compile(machine['compiler'], machine['compiler flags'])) as asm_file:
+            blocks = iaca_marker.find_asm_blocks(asm_file.readlines())
+        asm_block = [i for i, (idx, block) in enumerate(blocks)
+                     if any(['mulsd' in line for line in block['lines']])][-1]
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECMCPU',
+                                  kernel_file,
+                                  '-D', 'N', '1000',
+                                  '-vvv',
+                                  '--unit=cy/CL',
+                                  '--incore-model', 'builtin',
+                                  '--asm-block', str(asm_block),
+                                  '--asm-increment', '8',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        ecmd = list(results['recurrence.c'].values())[0]['ECMCPU']
+        # Multiplication (5 cy) and addition (3 cy) on a[i-1] for each of 8 elements per cache line
+        self.assertEqual(ecmd['cl loop-carried latency'], 8*(5+3))
+        self.assertGreater(ecmd['cl loop-carried latency'], ecmd['cl throughput'])
+        # Only the overlapping in-core time is bound, T_nOL stays the L1 data transfer time
+        self.assertEqual(ecmd['T_OL'], ecmd['cl loop-carried latency'])
+        self.assertLess(ecmd['T_nOL'], ecmd['cl loop-carried latency'])
+        self.assertIn('T_OL is bound by the loop-carried dependency chain (T_nOL is not)',
+                      output_stream.getvalue())
+
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    def test_recurrence_RooflineIACA_builtin(self):
+        store_file = os.path.join(self.temp_dir, 'test_recurrence_RooflineIACA_builtin.pickle')
+        output_stream = StringIO()
+        kernel_file = self._copy_to_temp_dir('recurrence.c')
+
+        # The largest block is an initialization loop, so select the one with the recurrence
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        kernel = KernelCode(open(kernel_file).read(), filename=kernel_file)
+        kernel.set_constant('N', 1000)
+        with open(kernel.compile(machine['compiler'], machine['compiler flags'])) as asm_file:
+            blocks = iaca_marker.find_asm_blocks(asm_file.readlines())
+        asm_block = [i for i, (idx, block) in enumerate(blocks)
+                     if any(['mulsd' in line for line in block['lines']])][-1]
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'RooflineIACA',
+                                  kernel_file,
+                                  '-D', 'N', '1000',
+                                  '-v',
+                                  '--incore-model', 'builtin',
+                                  '--asm-block', str(asm_block),
+                                  '--asm-increment', '8',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        cpu = list(results['recurrence.c'].values())[0]['RooflineIACA']['cpu bottleneck']
+        self.assertEqual(cpu['cl loop-carried latency'], 8*(5+3))
+        self.assertGreater(cpu['cl loop-carried latency'], cpu['cl throughput'])
+        # Two FLOPs per element, one element per 8 cycles of the chain, at 2.7 GHz
+        self.assertAlmostEqual(float(cpu['performance throughput']), 2.7e9/8*2, places=0)
+        self.assertIn('CPU performance is bound by the loop-carried dependency chain',
+                      output_stream.getvalue())
+
     @unittest.skipUnless(find_executable('iaca.sh'), "IACA not available")
     @unittest.skipUnless(find_executable('gcc'), "GCC not available")
     def test_2d5pt_ECM(self):
@@ -238,7 +362,7 @@ class TestKerncraft(unittest.TestCase):
         parser = kc.create_parser()
         args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
                                   '-p', 'ECM',
-                                  self._find_file('2d-5pt.c'),
+                                  self._copy_to_temp_dir('2d-5pt.c'),
                                   '-D', 'N', '2000',
                                   '-D', 'M', '1000',
                                   '-vvv',
@@ -274,6 +398,135 @@ class TestKerncraft(unittest.TestCase):
         self.assertAlmostEqual(ecmd['L2-L3'], 6, places=1)
         self.assertAlmostEqual(ecmd['L3-MEM'], 13, places=0)
 
+    def test_2d5pt_ECMData_PLC(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECMData_PLC.pickle')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('hasep1.yaml'),
+                                  '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '100-100000:4log10',
+                                  '-D', 'M', '1000',
+                                  '-P', 'PLC',
+                                  '-vv',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))['2d-5pt.c']
+        self.assertEqual(len(results), 4)
+        for constants, result in results.items():
+            # all define points are served by the sweep, with the same transitions
+            n = dict([(str(k), v) for k, v in constants])['N']
+            self.assertEqual(result['ECMData']['hits'], [3, 3, 3] if n <= 1000 else [1, 1, 3])
+            self.assertEqual(result['ECMData']['verbose infos']['transitions'],
+                             {'N': [[(1025, 3, 1)], [(8193, 3, 1)], []]})
+        self.assertIn('Layer condition transitions:', output_stream.getvalue())
+
+    def test_2d5pt_ECMData_bandwidth_cycles(self):
+        machine = MachineModel(self._find_file('hasep1.yaml'))
+        machine_yaml = dict(machine._data)
+        machine_yaml['memory hierarchy'] = [dict(l) for l in machine['memory hierarchy']]
+        machine_yaml['memory hierarchy'][2]['penalty cycles per read stream'] = 10
+        machine = MachineModel(machine_yaml=machine_yaml)
+        kernel = KernelCode(open(self._find_file('2d-5pt.c')).read())
+        kernel.set_constant('N', 10000)
+        kernel.set_constant('M', 10000)
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('hasep1.yaml'), '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c'), '--cache-predictor', 'LC'])
+        ecm_data = models.ECMData(kernel, machine, args, parser)
+        ecm_data.analyze()
+
+        # Scaling curve and ECM prediction share the same cycles, including read stream penalty
+        misses = ecm_data.results['misses'][2]
+        transfer, cycles, bw, kernel_name = ecm_data.bandwidth_cycles(1)[0]
+        self.assertEqual(transfer, 'L3-MEM')
+        self.assertAlmostEqual(
+            cycles,
+            (misses + ecm_data.results['evicts'][2])*64*float(machine['clock'])/float(bw) +
+            10*misses)
+        self.assertEqual(ecm_data.transfer_cycles()[2][1], ecm_data.results['L3-MEM'])
+
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    def test_2d5pt_ECM_scaling(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_ECM_scaling.pickle')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'ECM',
+                                  self._copy_to_temp_dir('2d-5pt.c'),
+                                  '-D', 'N', '2000',
+                                  '-D', 'M', '1000',
+                                  '--unit=cy/CL',
+                                  '--incore-model', 'builtin',
+                                  '--compile-cache', 'bypass',
+                                  '--cache-sim-warmup', 'adaptive',
+                                  '--ecm-scaling',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        ecmd = list(results['2d-5pt.c'].values())[0]['ECM']
+        curve = ecmd['scaling curve']
+        self.assertEqual([p['cores'] for p in curve], list(range(1, 9)))
+
+        # Single core runs at the ECM prediction, with the lower single core memory bandwidth
+        self.assertGreater(
+            curve[0]['cycles'],
+            max(ecmd['T_OL'], ecmd['T_nOL'] + sum([c[1] for c in ecmd['cycles']])))
+        self.assertEqual(curve[0]['bottleneck'], 'ECM')
+
+        # one cache line loaded and one evicted from/to memory, at 2.7 GHz
+        self.assertEqual(curve[-1]['bottleneck'], 'L3-MEM')
+        self.assertAlmostEqual(curve[-1]['cycles'],
+                               2*64*2.7e9/float(curve[-1]['bandwidth']), places=1)
+        saturation = ecmd['saturation cores']
+        self.assertTrue(all([p['bottleneck'] == 'ECM' for p in curve[:saturation-1]]))
+        self.assertTrue(all([p['bottleneck'] == 'L3-MEM' for p in curve[saturation-1:]]))
+        self.assertIn('saturating at {} cores'.format(saturation), output_stream.getvalue())
+
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    def test_2d5pt_ECM_scaling_single_core_bandwidth(self):
+        # Single core memory bandwidth far below the saturated one
+        machine = MachineModel(self._find_file('phinally_gcc.yaml'))
+        machine_yaml = dict(machine._data)
+        machine_yaml['benchmarks'] = dict(machine['benchmarks'])
+        measurements = dict(machine['benchmarks']['measurements']['MEM'][1])
+        measurements['results'] = {name: [PrefixedUnit('4 GB/s')] + list(bws[1:])
+                                   for name, bws in measurements['results'].items()}
+        machine_yaml['benchmarks']['measurements'] = dict(machine['benchmarks']['measurements'])
+        machine_yaml['benchmarks']['measurements']['MEM'] = {1: measurements}
+        machine = MachineModel(machine_yaml=machine_yaml)
+
+        kernel_file = self._copy_to_temp_dir('2d-5pt.c')
+        kernel = KernelCode(open(kernel_file).read(), filename=kernel_file)
+        kernel.set_constant('N', 2000)
+        kernel.set_constant('M', 1000)
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'), '-p', 'ECM',
+                                  kernel_file, '--incore-model', 'builtin',
+                                  '--cache-predictor', 'LC', '--ecm-scaling'])
+        ecm = models.ECM(kernel, machine, args, parser)
+        ecm.analyze()
+        curve = ecm.results['scaling curve']
+
+        # The memory transfer alone takes longer than the ECM prediction at saturated bandwidth
+        T_ECM_saturated = max(ecm.results['T_OL'], ecm.results['T_nOL'] +
+                              sum([c[1] for c in ecm.results['cycles']]))
+        self.assertGreater(ecm._data.bandwidth_cycles(1)[0][1], T_ECM_saturated)
+        # but a single core is not saturated, it runs at the ECM prediction with its own bandwidth
+        self.assertEqual(curve[0]['bottleneck'], 'ECM')
+        self.assertAlmostEqual(
+            curve[0]['cycles'],
+            max(ecm.results['T_OL'], ecm.results['T_nOL'] +
+                sum([t[1] for t in ecm._data.transfer_cycles(1)])))
+        self.assertEqual(curve[1]['cycles'], curve[0]['cycles']/2)
+        self.assertNotEqual(ecm.results['saturation cores'], 1)
+
     @unittest.skipUnless(find_executable('iaca.sh'), "IACA not available")
     @unittest.skipUnless(find_executable('gcc'), "GCC not available")
     def test_2d5pt_RooflineIACA(self):
@@ -283,7 +536,7 @@ class TestKerncraft(unittest.TestCase):
         parser = kc.create_parser()
         args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
                                   '-p', 'RooflineIACA',
-                                  self._find_file('2d-5pt.c'),
+                                  self._copy_to_temp_dir('2d-5pt.c'),
                                   '-D', 'N', '4000',
                                   '-D', 'M', '1000',
                                   '-vvv',
@@ -325,7 +578,7 @@ class TestKerncraft(unittest.TestCase):
         parser = kc.create_parser()
         args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
                                   '-p', 'Benchmark',
-                                  self._find_file('2d-5pt.c'),
+                                  self._copy_to_temp_dir('2d-5pt.c'),
                                   '-D', 'N', '1000',
                                   '-D', 'M', '1000',
                                   '-vvv',
@@ -362,6 +615,66 @@ class TestKerncraft(unittest.TestCase):
         for k, v in correct_results.items():
             self.assertAlmostEqual(roofline[k], v, places=1)
     
+    def test_2d5pt_Padding(self):
+        store_file = os.path.join(self.temp_dir, 'test_2d5pt_Padding.pickle')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'Padding',
+                                  self._find_file('2d-5pt.c'),
+                                  '-D', 'N', '1024',
+                                  '-D', 'M', '50',
+                                  '--array-spacing', '0', '64',
+                                  '--leading-padding', '8',
+                                  '--prediction-cache', 'bypass',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        result = list(results['2d-5pt.c'].values())[0]['Padding']
+
+        # no padding is always included
+        self.assertEqual([(p['spacing'], p['leading padding']) for p in result['paddings']],
+                         [(0, 0), (64, 0), (0, 8), (64, 8)])
+        self.assertEqual(sorted(result['best']), ['L1', 'L2', 'L3'])
+        for level, name in enumerate(['L1', 'L2', 'L3']):
+            self.assertEqual(result['best'][name]['misses'][level],
+                             min(p['misses'][level] for p in result['paddings']))
+
+    def test_sum9_Padding(self):
+        store_file = os.path.join(self.temp_dir, 'test_sum9_Padding.pickle')
+        output_stream = StringIO()
+
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('phinally_gcc.yaml'),
+                                  '-p', 'Padding',
+                                  self._find_file('sum9.c'),
+                                  '-D', 'N', '512',
+                                  '-D', 'M', '16',
+                                  '--array-spacing', '0',
+                                  '--leading-padding', '8',
+                                  '--store', store_file])
+        kc.check_arguments(args, parser)
+        kc.run(parser, args, output_file=output_stream)
+
+        results = pickle.load(open(store_file, 'rb'))
+        result = list(results['sum9.c'].values())[0]['Padding']
+
+        # Rows of 4 kB, so all nine arrays map to the same sets of the 8-way L1: every access
+        # misses, instead of one miss per array and cache line of work
+        self.assertEqual(result['misses'][0], 9*8)
+        self.assertEqual(result['fully associative misses'][0], 9)
+        self.assertEqual(result['conflict misses'][0], 9*8 - 9)
+        self.assertIn('L1', result['conflict levels'])
+        self.assertIn('63.00 conflict misses in L1', output_stream.getvalue())
+
+        # Padding the leading dimension removes all conflict misses
+        best = result['best']['L1']
+        self.assertEqual(best['leading padding'], 8)
+        self.assertEqual(best['misses'][0] - result['fully associative misses'][0], 0)
+
     def test_2d5pt_pragma(self):
         output_stream = StringIO()
 
@@ -409,6 +722,56 @@ class TestKerncraft(unittest.TestCase):
             kc.check_arguments(args, parser)
         self.assertEqual(cm.exception.code, 2)
 
+    def test_argument_parser_cores(self):
+        # valid multi-core cache simulation
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', self._find_file('hasep1.yaml'),
+                                  '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c'),
+                                  '--cores', '4'])
+        kc.check_arguments(args, parser)
+
+        # multi-core simulation with several benchmark windows or set sampling
+        for options in [['--cache-sim-samples', '4'], ['--cache-predictor', 'SSIM']]:
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('hasep1.yaml'),
+                                      '-p', 'ECMData',
+                                      self._find_file('2d-5pt.c'),
+                                      '--cores', '4'] + options)
+            with self.assertRaises(SystemExit) as cm:
+                kc.check_arguments(args, parser)
+            self.assertEqual(cm.exception.code, 2)
+
+    def test_argument_parser_prefetchers(self):
+        # the example Haswell EP machine file describes L2 prefetchers
+        machine_file = os.path.join(os.path.dirname(__file__), '..', 'examples', 'machine-files',
+                                    'hasep1.yaml')
+        parser = kc.create_parser()
+        args = parser.parse_args(['-m', machine_file, '-p', 'ECMData',
+                                  self._find_file('2d-5pt.c')])
+        kc.check_arguments(args, parser)
+
+        # prefetchers are supported neither with set sampling nor multi-core simulation
+        for options in [['--cache-predictor', 'SSIM'], ['--cores', '4']]:
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', machine_file, '-p', 'ECMData',
+                                      self._find_file('2d-5pt.c')] + options)
+            with self.assertRaises(SystemExit) as cm:
+                kc.check_arguments(args, parser)
+            self.assertEqual(cm.exception.code, 2)
+
+    def test_argument_parser_padding(self):
+        # padding is explored by simulating a single core and benchmark window
+        for options in [['--cache-predictor', 'LC'], ['--cache-sim-samples', '4'],
+                        ['--cores', '4']]:
+            parser = kc.create_parser()
+            args = parser.parse_args(['-m', self._find_file('hasep1.yaml'),
+                                      '-p', 'Padding',
+                                      self._find_file('2d-5pt.c')] + options)
+            with self.assertRaises(SystemExit) as cm:
+                kc.check_arguments(args, parser)
+            self.assertEqual(cm.exception.code, 2)
+
     def test_argument_parser_define(self):
         # invalid --define
         parser = kc.create_parser()
@@ -15,6 +15,7 @@ import pickle
 from pprint import pprint
 from io import StringIO
 from itertools import chain
+from distutils.spawn import find_executable
 
 import six
 import sympy
@@ -22,6 +23,7 @@ from ruamel import yaml
 
 sys.path.insert(0, '..')
 from kerncraft.kernel import Kernel, KernelCode, KernelDescription
+from kerncraft.compilecache import CompileCache
 
 
 class TestKernel(unittest.TestCase):
@@ -89,6 +91,148 @@ class TestKernel(unittest.TestCase):
         # write access to b[i][j]
         six.assertCountEqual(self, [sizes['a']+(1*10*10+1*10+1)*8], write_offsets)
 
+    def test_global_offsets_iteration_range(self):
+        k = KernelCode(self.twod_code)
+        k.set_constant('N', 10)
+        k.set_constant('M', 20)
+        sizes = k.array_sizes(in_bytes=True, subs_consts=True)
+        base_offsets = {'a': 0, 'b': sizes['a']}
+        offsets = list(k.compile_global_offsets(iteration=range(0, 140), spacing=0))
+        self.assertEqual(len(offsets), 140)
+        for it, (read_offsets, write_offsets) in enumerate(offsets):
+            # i runs from 1 to N-1 (8 iterations) and j from 1 to M-1
+            indices = {sympy.Symbol('i', positive=True): 1 + it % 8,
+                       sympy.Symbol('j', positive=True): 1 + it//8}
+            # every iteration must match the direct evaluation of the access expressions
+            expected_reads = [
+                k.subs_consts(k.access_to_sympy(v, r).subs(indices))*8 + base_offsets[v]
+                for v in sizes for r in k._sources.get(v, [])]
+            expected_writes = [
+                k.subs_consts(k.access_to_sympy(v, w).subs(indices))*8 + base_offsets[v]
+                for v in sizes for w in k._destinations.get(v, [])]
+            six.assertCountEqual(self, expected_reads, read_offsets)
+            six.assertCountEqual(self, expected_writes, write_offsets)
+
+    def test_global_offsets_non_affine(self):
+        k = KernelCode('double a[M*N], b[N];\n'
+                       'for(int j=0; j<M; ++j)\n'
+                       '    for(int i=0; i<N; ++i)\n'
+                       '        b[i] = a[i*j+1];\n')
+        k.set_constant('N', 10)
+        k.set_constant('M', 20)
+        offsets = list(k.compile_global_offsets(iteration=range(20, 23), spacing=0))
+        # j=2 and i=0..2: a[i*2+1] for reads and b[i] behind a (10*20*8 bytes) for writes
+        self.assertEqual([list(r) for r, w in offsets], [[1*8], [3*8], [5*8]])
+        self.assertEqual([list(w) for r, w in offsets], [[1600], [1608], [1616]])
+
+    def test_global_offsets_chunked(self):
+        k = KernelCode(self.twod_code)
+        k.set_constant('N', 10)
+        k.set_constant('M', 20)
+        offsets = list(k.compile_global_offsets(iteration=range(0, 140), spacing=0))
+        chunks = list(k.compile_global_offsets(iteration=range(0, 140), spacing=0, chunk_size=64))
+        # 140 iterations in chunks of 64: 64, 64 and 12 rows with 4 loads and 1 store each
+        self.assertEqual([(l.shape, s.shape) for l, s in chunks],
+                         [((64, 4), (64, 1)), ((64, 4), (64, 1)), ((12, 4), (12, 1))])
+        for loads, stores in chunks:
+            self.assertEqual(loads.dtype, 'int64')
+            self.assertEqual(stores.dtype, 'int64')
+        self.assertEqual([list(r) for r, w in offsets],
+                         [list(r) for l, s in chunks for r in l.tolist()])
+        self.assertEqual([list(w) for r, w in offsets],
+                         [list(w) for l, s in chunks for w in s.tolist()])
+
+    def test_array_extents(self):
+        k = KernelCode(self.twod_code)
+        k.set_constant('N', 10)
+        k.set_constant('M', 20)
+        # a and b (1600 bytes each), aligned to 64 bytes after spacing
+        self.assertEqual(k.array_extents(), [('a', 0, 1600), ('b', 1600, 3200)])
+        self.assertEqual(k.array_extents(spacing=8), [('a', 0, 1600), ('b', 1664, 3264)])
+
+    def test_padded(self):
+        k = KernelCode(self.twod_code)
+        k.set_constant('N', 10)
+        k.set_constant('M', 20)
+        p = k.padded(2)
+        # a and b (20*12 doubles each), original kernel is unchanged
+        self.assertEqual(p.array_extents(), [('a', 0, 1920), ('b', 1920, 3840)])
+        self.assertEqual(k.array_extents(), [('a', 0, 1600), ('b', 1600, 3200)])
+        self.assertEqual(p.constants, k.constants)
+
+    def test_global_iterator_to_indices(self):
+        k = KernelCode(self.twod_code)
+        k.set_constant('N', 10)
+        k.set_constant('M', 20)
+        i, j = sympy.Symbol('i', positive=True), sympy.Symbol('j', positive=True)
+        self.assertEqual(k.global_iterator_to_indices(19), {i: 4, j: 3})
+        # vectorized over an array of global iterators
+        indices = k.global_iterator_to_indices_array(range(0, 144))
+        self.assertEqual(indices[i].tolist(), [1 + it % 8 for it in range(0, 144)])
+        self.assertEqual(indices[j].tolist(), [1 + it//8 for it in range(0, 144)])
+        # inverse
+        self.assertEqual(k.indices_to_global_iterator({i: 4, j: 3}), 19)
+        self.assertEqual(k.indices_to_global_iterator(indices).tolist(), list(range(0, 144)))
+
+    def test_parametric_compilation(self):
+        k = KernelCode(self.twod_code)
+        k.set_constant('N', 10)
+        k.set_constant('M', 20)
+        read_offsets, write_offsets = list(k.compile_global_offsets(iteration=0))[0]
+        parametric = k._compile_parametric()
+
+        # compiled functions are kept across define points
+        k.clear_state()
+        k.set_constant('N', 30)
+        k.set_constant('M', 40)
+        self.assertIs(k._compile_parametric(), parametric)
+        self.assertEqual(k.array_sizes(in_bytes=True, subs_consts=True),
+                         {'a': 30*40*8, 'b': 30*40*8})
+        self.assertEqual(k.iteration_length(), 28*38)
+        read_offsets, write_offsets = list(k.compile_global_offsets(iteration=0))[0]
+        six.assertCountEqual(
+            self,
+            [(1*30+0)*8, (1*30+2)*8, (0*30+1)*8, (2*30+1)*8],
+            read_offsets)
+        six.assertCountEqual(self, [30*40*8+(1*30+1)*8], write_offsets)
+
+    @unittest.skipUnless(find_executable('gcc'), "GCC not available")
+    def test_compile_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(temp_dir, '2d-5pt.c')
+            cache = CompileCache(os.path.join(temp_dir, 'cache'))
+            flags = ['-O3']
+            outputs = []
+            for n in [100, 200]:
+                k = KernelCode(self.twod_code, filename=filename)
+                k.set_constant('N', n)
+                k.set_constant('M', 50)
+                asm_name = k.compile('gcc', compiler_args=flags, cache=cache)
+                bin_name = k.assemble('gcc', asm_name, cache=cache)
+                with open(asm_name) as f:
+                    outputs.append(f.read())
+                self.assertTrue(os.access(bin_name, os.X_OK))
+                # artifacts are restored from the cache for the second define point
+                os.remove(asm_name)
+                os.remove(bin_name)
+            # one compiled and one assembled kernel for both define points
+            self.assertEqual(len(os.listdir(cache.path)), 2)
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertEqual(flags, ['-O3'])
+            # other flags need to be compiled separately
+            k.compile('gcc', compiler_args=['-O1'], cache=cache)
+            self.assertEqual(len(os.listdir(cache.path)), 3)
+            # as do modified headers
+            k._header_sources = lambda: ['/* modified */']
+            k.compile('gcc', compiler_args=['-O1'], cache=cache)
+            self.assertEqual(len(os.listdir(cache.path)), 4)
+            # least recently used artifacts are evicted first
+            CompileCache(cache.path, max_size=1).evict()
+            self.assertEqual(os.listdir(cache.path), [])
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_from_description(self):
         k_descr = KernelDescription(self.twod_description)
         k_code = KernelCode(self.twod_code)